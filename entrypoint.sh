@@ -28,8 +28,8 @@ echo "Debezium connector is ready"
 echo "Listing Kafka topics..."
 docker-compose exec kafka kafka-topics.sh --list --bootstrap-server kafka:9092
 
-echo "Starting Kafka to Postgres consumer in the background..."
-python /app/fastapi/kafka_to_postgres.py &
+echo "Starting the Kafka to Postgres consumer supervisor in the background..."
+python /app/fastapi/consumer_supervisor.py &
 
 echo "Changing directory to /app/fastapi..."
 cd /app/fastapi
@@ -41,14 +41,14 @@ echo "Waiting for FastAPI server to start..."
 sleep 30
 
 echo "Generating test data..."
-python /app/fastapi/generate_test_data.py
+python /app/fastapi/load_generator.py --base-url http://app:8000 --requests 1000 --concurrency 8
 
 # After starting the Kafka to Postgres consumer
 echo "Waiting for data to propagate..."
 sleep 30
 
 # Then run the comparison
-echo "Comparing databases (users only)..."
+echo "Comparing databases..."
 python /app/fastapi/compare_databases.py
 
 echo "Entrypoint script completed. Keeping container running..."
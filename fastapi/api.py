@@ -1,71 +1,194 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List
-import crud, schemas
-from database import get_mysql_db as get_db
+import os
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+import crud, export, schemas
+from database import get_async_mysql_db as get_db
+from read_routing import read_db, read_engine, route_read
+from cache_invalidation import collection_tag, list_tag
+from response_cache import cache_response
+
+PRODUCT_TABLES = ("products", "product_categories")
+ORDER_TABLES = ("orders", "order_items") + PRODUCT_TABLES
+USER_TABLES = ("users",) + ORDER_TABLES
+
+# Rows accepted by one bulk create request.
+BULK_MAX_ROWS = int(os.getenv("BULK_MAX_ROWS", "10000"))
 
 router = APIRouter()
 
 
+def check_bulk_size(rows):
+    if len(rows) > BULK_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_ROWS} rows per request")
+
+
 @router.get("/products", response_model=List[schemas.Product])
-def read_products(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    products = crud.get_products(db, skip=skip, limit=limit)
+async def read_products(
+    request: Request,
+    skip: int = 0,
+    limit: int = 100,
+    after_id: Optional[int] = None,
+    db: AsyncSession = Depends(read_db(PRODUCT_TABLES, max_staleness_s=30)),
+):
+    products = await crud.get_products(db, skip=skip, limit=limit, after_id=after_id)
+    cache_response(request, products, schemas.Product, list_tag("products"))
     return products
 
 
 @router.post("/categories", response_model=schemas.ProductCategory)
-def create_category(
-    category: schemas.ProductCategoryCreate, db: Session = Depends(get_db)
+async def create_category(
+    category: schemas.ProductCategoryCreate, db: AsyncSession = Depends(get_db)
+):
+    try:
+        return await crud.create_product_category(db=db, category=category)
+    except crud.DuplicateRow:
+        raise HTTPException(status_code=400, detail="Category already exists")
+
+
+@router.post("/categories/bulk", response_model=List[schemas.ProductCategory])
+async def create_categories(
+    categories: List[schemas.ProductCategoryCreate], db: AsyncSession = Depends(get_db)
 ):
-    return crud.create_product_category(db=db, category=category)
+    check_bulk_size(categories)
+    try:
+        return await crud.create_product_categories(db, categories)
+    except crud.DuplicateRow:
+        raise HTTPException(status_code=400, detail="Category already exists")
 
 
 @router.get("/categories", response_model=List[schemas.ProductCategory])
-def read_categories(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    categories = crud.get_product_categories(db, skip=skip, limit=limit)
+async def read_categories(
+    request: Request,
+    skip: int = 0,
+    limit: int = 100,
+    after_id: Optional[int] = None,
+    db: AsyncSession = Depends(read_db(("product_categories",), max_staleness_s=60)),
+):
+    categories = await crud.get_product_categories(db, skip=skip, limit=limit, after_id=after_id)
+    cache_response(request, categories, schemas.ProductCategory, list_tag("product_categories"))
     return categories
 
 
 @router.post("/products", response_model=schemas.Product)
-def create_product(product: schemas.ProductCreate, db: Session = Depends(get_db)):
-    return crud.create_product(db=db, product=product)
+async def create_product(product: schemas.ProductCreate, db: AsyncSession = Depends(get_db)):
+    try:
+        return await crud.create_product(db=db, product=product)
+    except crud.MissingReference:
+        raise HTTPException(status_code=400, detail="Category not found")
+
+
+@router.post("/products/bulk", response_model=List[schemas.Product])
+async def create_products(products: List[schemas.ProductCreate], db: AsyncSession = Depends(get_db)):
+    check_bulk_size(products)
+    try:
+        return await crud.create_products(db, products)
+    except crud.MissingReference:
+        raise HTTPException(status_code=400, detail="Category not found")
 
 
 @router.get("/products/{product_id}", response_model=schemas.Product)
-def read_product(product_id: int, db: Session = Depends(get_db)):
-    db_product = crud.get_product(db, product_id=product_id)
+async def read_product(
+    product_id: int,
+    request: Request,
+    db: AsyncSession = Depends(read_db(PRODUCT_TABLES, max_staleness_s=30)),
+):
+    db_product = await crud.get_product(db, product_id=product_id)
     if db_product is None:
         raise HTTPException(status_code=404, detail="Product not found")
+    cache_response(request, db_product, schemas.Product)
     return db_product
 
 
 @router.get("/users/{user_id}/orders", response_model=List[schemas.Order])
-def get_orders(user_id: int, db: Session = Depends(get_db)):
-    return crud.get_orders(db, user_id)
+async def get_orders(
+    user_id: int, request: Request, db: AsyncSession = Depends(read_db(ORDER_TABLES))
+):
+    orders = await crud.get_orders(db, user_id)
+    cache_response(request, orders, schemas.Order, collection_tag("orders", "user_id", user_id))
+    return orders
 
 
 @router.post("/users/{user_id}/orders", response_model=schemas.Order)
-def create_order(user_id: int, db: Session = Depends(get_db)):
-    return crud.create_order(db, user_id)
+async def create_order(
+    user_id: int, order: schemas.OrderCreate, db: AsyncSession = Depends(get_db)
+):
+    try:
+        return await crud.create_order(db, user_id, order)
+    except crud.MissingReference as e:
+        if e.table == "users":
+            raise HTTPException(status_code=404, detail="User not found")
+        raise HTTPException(status_code=400, detail="Product not found")
+
+
+@router.post("/orders/bulk", response_model=List[schemas.Order])
+async def create_orders(orders: List[schemas.OrderBulkCreate], db: AsyncSession = Depends(get_db)):
+    check_bulk_size(orders)
+    try:
+        return await crud.create_orders(db, orders)
+    except crud.MissingReference as e:
+        detail = "User not found" if e.table == "users" else "Product not found"
+        raise HTTPException(status_code=400, detail=detail)
 
 
 @router.post("/users/", response_model=schemas.User)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = crud.get_user_by_email(db, email=user.email)
-    if db_user:
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
+    try:
+        return await crud.create_user(db=db, user=user)
+    except crud.DuplicateRow:
+        raise HTTPException(status_code=400, detail="Email already registered")
+
+
+@router.post("/users/bulk", response_model=List[schemas.User])
+async def create_users(users: List[schemas.UserCreate], db: AsyncSession = Depends(get_db)):
+    check_bulk_size(users)
+    try:
+        return await crud.create_users(db, users)
+    except crud.DuplicateRow:
         raise HTTPException(status_code=400, detail="Email already registered")
-    return crud.create_user(db=db, user=user)
 
 
 @router.get("/users/", response_model=List[schemas.User])
-def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    users = crud.get_users(db, skip=skip, limit=limit)
+async def read_users(
+    request: Request,
+    skip: int = 0,
+    limit: int = 100,
+    after_id: Optional[int] = None,
+    db: AsyncSession = Depends(read_db(USER_TABLES)),
+):
+    users = await crud.get_users(db, skip=skip, limit=limit, after_id=after_id)
+    cache_response(request, users, schemas.User, list_tag("users"))
     return users
 
 
 @router.get("/users/{user_id}", response_model=schemas.User)
-def read_user(user_id: int, db: Session = Depends(get_db)):
-    db_user = crud.get_user(db, user_id=user_id)
+async def read_user(
+    user_id: int, request: Request, db: AsyncSession = Depends(read_db(USER_TABLES))
+):
+    db_user = await crud.get_user(db, user_id=user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
+    cache_response(request, db_user, schemas.User)
     return db_user
+
+
+@router.get("/export/{table}")
+async def export_table(
+    table: str,
+    request: Request,
+    fmt: str = Query("ndjson", alias="format"),
+    after_id: Optional[int] = None,
+):
+    if table not in export.exporters:
+        raise HTTPException(status_code=404, detail="Table not found")
+    if fmt not in export.EXPORT_FORMATS:
+        raise HTTPException(
+            status_code=400, detail=f"Format must be one of {', '.join(export.EXPORT_FORMATS)}"
+        )
+    database = await route_read(request, (table,))
+    return StreamingResponse(
+        export.stream_table(read_engine(database), table, fmt, after_id),
+        media_type=export.EXPORT_FORMATS[fmt],
+        headers={"X-Read-From": database},
+    )
@@ -0,0 +1,123 @@
+import time
+from contextvars import ContextVar
+from fastapi import Request, Response
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from sqlalchemy import event
+
+REQUEST_SECONDS = Histogram(
+    "api_request_duration_seconds",
+    "HTTP request latency per route",
+    ["method", "route", "status"],
+)
+CONNECTION_CHECKOUTS = Counter(
+    "api_db_connection_checkouts_total",
+    "Pooled database connections checked out, per route",
+    ["database", "route"],
+)
+CONNECTION_HOLD_SECONDS = Histogram(
+    "api_db_connection_hold_seconds",
+    "Time a pooled database connection stayed checked out, per route",
+    ["database", "route"],
+)
+READ_ROUTING = Counter(
+    "api_read_routing_total",
+    "Read requests per database they were routed to, with the reason",
+    ["database", "reason"],
+)
+CACHE_REQUESTS = Counter(
+    "api_cache_requests_total",
+    "Cacheable GET requests, by whether the response cache served them",
+    ["result"],
+)
+CACHE_EVICTIONS = Counter(
+    "api_cache_evictions_total",
+    "Response cache entries removed, by reason",
+    ["reason"],
+)
+CACHE_ENTRIES = Gauge(
+    "api_cache_entries",
+    "Responses held in the in-process cache",
+)
+CACHE_HIT_RATIO = Gauge(
+    "api_cache_hit_ratio",
+    "Share of cacheable GET requests served from the cache since start",
+)
+POOL_CHECKED_OUT = Gauge(
+    "api_db_pool_checked_out",
+    "Connections currently checked out of the pool",
+    ["database"],
+)
+POOL_SIZE = Gauge(
+    "api_db_pool_size",
+    "Configured size of the connection pool",
+    ["database"],
+)
+
+# The ASGI scope of the request being served. Routing fills in
+# scope["route"] after the middleware runs, so the scope itself is shared
+# and the route template is read when a connection is returned.
+_current_scope = ContextVar("current_scope", default=None)
+
+
+def _route_name(scope):
+    route = scope.get("route") if scope else None
+    return route.path if route is not None else "unmatched"
+
+
+def instrument_engine(engine, name):
+    """
+    Record pool usage of an engine, attributed to the route that used it.
+
+    Args:
+        engine (Engine): The SQLAlchemy engine to instrument.
+        name (str): The `database` label, e.g. "mysql".
+    """
+    POOL_CHECKED_OUT.labels(name).set_function(engine.pool.checkedout)
+    POOL_SIZE.labels(name).set_function(engine.pool.size)
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info["checked_out_at"] = time.perf_counter()
+
+    @event.listens_for(engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        started = connection_record.info.pop("checked_out_at", None)
+        scope = _current_scope.get()
+        if started is None or scope is None:
+            return
+        route = _route_name(scope)
+        CONNECTION_CHECKOUTS.labels(name, route).inc()
+        CONNECTION_HOLD_SECONDS.labels(name, route).observe(time.perf_counter() - started)
+
+
+async def metrics_middleware(request: Request, call_next):
+    token = _current_scope.set(request.scope)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        REQUEST_SECONDS.labels(
+            request.method, _route_name(request.scope), str(status)
+        ).observe(time.perf_counter() - started)
+        _current_scope.reset(token)
+
+
+def metrics_endpoint():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+def setup_metrics(app, engines):
+    """
+    Add request latency and DB pool metrics to a FastAPI app and serve them at /metrics.
+
+    Args:
+        app (FastAPI): The application.
+        engines (Dict[str, Engine]): Engines to instrument, by `database` label.
+    """
+    for name, engine in engines.items():
+        instrument_engine(engine, name)
+    app.middleware("http")(metrics_middleware)
+    app.add_api_route("/metrics", metrics_endpoint, include_in_schema=False)
@@ -0,0 +1,186 @@
+import argparse
+import json
+import logging
+import os
+import resource
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+STAGES = ("decode", "snapshot", "prepare", "convert", "apply", "commit")
+
+
+def git_version():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def stage_seconds():
+    """
+    Return the total time recorded so far per consumer stage.
+    """
+    from prometheus_client import REGISTRY
+
+    return {
+        stage: REGISTRY.get_sample_value("cdc_stage_duration_seconds_sum", {"stage": stage}) or 0.0
+        for stage in STAGES
+    }
+
+
+def load_results(path):
+    try:
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def run_benchmark(consumer, messages, mode):
+    """
+    Feed messages to the consumer as a Kafka poll loop would.
+
+    Args:
+        consumer (module): The `kafka_to_postgres` module.
+        messages (List[SyntheticMessage]): The messages to apply.
+        mode (str): `message` calls `process_message` per message; `batch`
+            calls `apply_batch` with `BATCH_SIZE` messages at a time on one
+            long-lived session.
+
+    Returns:
+        float: Seconds spent applying.
+    """
+    started = time.perf_counter()
+    if mode == "message":
+        for message in messages:
+            consumer.process_message(message)
+    else:
+        db = consumer.PostgresSessionLocal()
+        try:
+            for start in range(0, len(messages), consumer.BATCH_SIZE):
+                consumer.apply_batch(db, messages[start:start + consumer.BATCH_SIZE])
+        finally:
+            db.close()
+    return time.perf_counter() - started
+
+
+def main(args):
+    # The consumer builds its engine at import time, so point it at the
+    # benchmark database before importing it.
+    os.environ["POSTGRES_CONNECTION_STRING"] = args.database_url
+    os.environ.setdefault("DEAD_LETTER_SINK", "log")
+    import kafka_to_postgres as consumer
+    import freshness
+    import offset_store
+    from sqlalchemy import func, select
+    from database import Base, postgres_engine
+    from synthetic_events import EventGenerator
+
+    if not args.verbose:
+        for name in ("kafka_to_postgres", "bulk_apply", "deferred"):
+            logging.getLogger(name).setLevel(logging.WARNING)
+
+    logger.info(f"Generating {args.events} events")
+    started = time.perf_counter()
+    generator = EventGenerator(
+        update_ratio=args.update_ratio,
+        delete_ratio=args.delete_ratio,
+        schemas=not args.schemaless,
+        seed=args.seed,
+    )
+    messages = generator.messages(args.events)
+    generate_seconds = time.perf_counter() - started
+
+    Base.metadata.drop_all(bind=postgres_engine)
+    Base.metadata.create_all(bind=postgres_engine)
+    freshness.create_table(postgres_engine)
+    offset_store.create_table(postgres_engine)
+
+    logger.info(f"Applying {len(messages)} events in {args.mode} mode")
+    if args.trace_memory:
+        tracemalloc.start()
+    stages_before = stage_seconds()
+    elapsed = run_benchmark(consumer, messages, args.mode)
+    stages_after = stage_seconds()
+    traced_peak = None
+    if args.trace_memory:
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    with postgres_engine.connect() as conn:
+        for table in Base.metadata.sorted_tables:
+            count = conn.execute(select(func.count()).select_from(table)).scalar()
+            expected = len(generator.live[table.name])
+            if count != expected:
+                logger.warning(f"{table.name}: {count} rows in PostgreSQL, expected {expected}")
+
+    result = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "version": git_version(),
+        "config": {
+            "mode": args.mode,
+            "events": args.events,
+            "update_ratio": args.update_ratio,
+            "delete_ratio": args.delete_ratio,
+            "schemas": not args.schemaless,
+            "batch_size": consumer.BATCH_SIZE,
+            "coalesce_events": consumer.COALESCE_EVENTS,
+            "defer_orphans": consumer.DEFER_ORPHANS,
+            "trace_memory": args.trace_memory,
+        },
+        "elapsed_s": round(elapsed, 3),
+        "events_per_s": round(len(messages) / elapsed, 1),
+        "generate_s": round(generate_seconds, 3),
+        "stages_s": {
+            stage: round(stages_after[stage] - stages_before[stage], 3) for stage in STAGES
+        },
+        # ru_maxrss is in kilobytes on Linux.
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "peak_traced_mb": round(traced_peak / 2**20, 1) if traced_peak is not None else None,
+    }
+
+    logger.info(
+        f"{len(messages)} events in {result['elapsed_s']}s: {result['events_per_s']} events/s, "
+        f"peak RSS {result['peak_rss_mb']} MB"
+        + (f", peak traced {result['peak_traced_mb']} MB" if traced_peak is not None else "")
+    )
+    logger.info("Stage time: " + ", ".join(f"{stage} {seconds}s" for stage, seconds in result["stages_s"].items()))
+
+    previous = [r for r in load_results(args.results) if r["config"] == result["config"]]
+    if previous:
+        baseline = previous[-1]
+        change = (result["events_per_s"] / baseline["events_per_s"] - 1) * 100
+        logger.info(
+            f"Throughput {change:+.1f}% vs {baseline['version']} "
+            f"({baseline['events_per_s']} events/s, {baseline['timestamp']})"
+        )
+    with open(args.results, "a") as f:
+        f.write(json.dumps(result) + "\n")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the consumer on synthetic Debezium events")
+    parser.add_argument(
+        "--database-url", required=True,
+        help="PostgreSQL URL of a scratch database; its replicated tables are dropped and recreated",
+    )
+    parser.add_argument("--mode", choices=["batch", "message"], default="batch")
+    parser.add_argument("--events", type=int, default=50000)
+    parser.add_argument("--update-ratio", type=float, default=0.2)
+    parser.add_argument("--delete-ratio", type=float, default=0.05)
+    parser.add_argument("--schemaless", action="store_true", help="omit the envelope schema block")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--trace-memory", action="store_true", help="also report the tracemalloc peak (slower)")
+    parser.add_argument("--results", default="benchmark_results.jsonl", help="JSON Lines file results are appended to")
+    parser.add_argument("--verbose", action="store_true", help="keep the consumer's per-event logging")
+    main(parser.parse_args())
@@ -0,0 +1,301 @@
+import logging
+from collections import defaultdict, namedtuple
+from sqlalchemy import any_, bindparam, delete
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from sqlalchemy.exc import InterfaceError, OperationalError
+from database import Base
+from converters import row_converters, schema_row_converter
+from consumer_metrics import CONVERT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Snapshot reads ('r') are upserts too, so a replayed snapshot is idempotent.
+UPSERT_OPS = ('c', 'u', 'r')
+DELETE_OPS = ('d',)
+
+# A row change taken from a Debezium payload. `row` is the `after` image for
+# upserts and the `before` image for deletes; `position` is the
+# (topic, partition, offset) of the message it came from, if any,
+# `source_ts_ms`/`ts_ms` are the MySQL commit and Debezium processing times,
+# and `schema` is the SchemaVersion of the message, if it carried one.
+ChangeEvent = namedtuple(
+    "ChangeEvent",
+    ["table", "op", "row", "position", "source_ts_ms", "ts_ms", "schema"],
+    defaults=(None, None, None, None),
+)
+
+
+class TableApplier:
+    """
+    Pre-built upsert and delete statements for one replicated table.
+
+    Upserts are a single `INSERT ... ON CONFLICT (id) DO UPDATE` executed over
+    all rows at once, and deletes are a single `DELETE ... WHERE id = ANY(:ids)`,
+    so a run of events costs one round-trip instead of two or three per row.
+
+    Rows are converted by a function compiled for their schema version on
+    first use, or by `converter` for rows without a schema.
+    """
+
+    def __init__(self, table, converter):
+        self.table = table
+        self.convert = converter
+        self.pk = list(table.primary_key.columns)[0]
+        self._converters = {}
+
+        stmt = insert(table)
+        self.upsert_stmt = stmt.on_conflict_do_update(
+            index_elements=[self.pk],
+            set_={c.name: stmt.excluded[c.name] for c in table.columns if c is not self.pk},
+        )
+        self.delete_stmt = delete(table).where(
+            self.pk == any_(bindparam("ids", type_=ARRAY(self.pk.type)))
+        )
+
+    def converter(self, schema=None):
+        """
+        Return the row converter for a SchemaVersion, or the default one for None.
+        """
+        if schema is None:
+            return self.convert
+        convert = self._converters.get(schema)
+        if convert is None:
+            convert = self._converters[schema] = schema_row_converter(self.table, schema.fields)
+        return convert
+
+    def upsert(self, db, rows, schema=None):
+        """
+        Insert or update Debezium row images.
+
+        Args:
+            db (Session | Connection): The PostgreSQL session or connection.
+            rows (List[dict]): The `after` images to apply.
+            schema (SchemaVersion, optional): The schema version of the rows.
+
+        Returns:
+            int: The number of rows written.
+        """
+        # A multi-row ON CONFLICT cannot touch the same key twice, and within
+        # a run of upserts the last image of a row is its final state.
+        latest = {}
+        for row in rows:
+            latest[row[self.pk.name]] = row
+        if latest:
+            convert = self.converter(schema)
+            with CONVERT_SECONDS.time():
+                params = [convert(row) for row in latest.values()]
+            db.execute(self.upsert_stmt, params)
+        return len(latest)
+
+    def delete(self, db, rows):
+        """
+        Delete rows by primary key.
+
+        Args:
+            db (Session | Connection): The PostgreSQL session or connection.
+            rows (List[dict]): The `before` images of the deleted rows.
+
+        Returns:
+            int: The number of keys sent to the delete.
+        """
+        ids = list({row[self.pk.name] for row in rows})
+        if ids:
+            db.execute(self.delete_stmt, {"ids": ids})
+        return len(ids)
+
+    def process(self, db, operation, data, schema=None):
+        """
+        Apply a single change event; the per-message counterpart of `apply_events`.
+        """
+        if operation in UPSERT_OPS:
+            self.upsert(db, [data], schema)
+        elif operation in DELETE_OPS:
+            self.delete(db, [data])
+
+
+# Table names ordered parent-first by their ForeignKey dependencies.
+TABLE_ORDER = [table.name for table in Base.metadata.sorted_tables]
+
+appliers = {
+    table.name: TableApplier(table, row_converters[table.name])
+    for table in Base.metadata.sorted_tables
+}
+
+
+def register_applier(applier):
+    """
+    Add or replace the applier of a table at runtime, e.g. for a table
+    replicated from its Debezium schema. New tables have no foreign keys and
+    are applied after the tables of `models.py`.
+    """
+    name = applier.table.name
+    appliers[name] = applier
+    if name not in TABLE_ORDER:
+        TABLE_ORDER.append(name)
+
+
+def _segment_order(upserts, deletes):
+    ordered = []
+    for table in TABLE_ORDER:
+        ordered.extend(upserts.get(table, ()))
+    for table in reversed(TABLE_ORDER):
+        ordered.extend(deletes.get(table, ()))
+    return ordered
+
+
+def order_events(events):
+    """
+    Put change events into an order that is safe to apply in bulk.
+
+    Upserts are applied parent-first and deletes child-first, following the
+    ForeignKey graph in `models.py`, so a batch that mixes tables never
+    violates a foreign key as long as the source database was consistent.
+
+    Reordering is only done among events for distinct rows: when a row shows
+    up again, the events collected so far are emitted first, which keeps
+    every row's own changes in order. Events for unknown tables or with
+    other operations are dropped.
+
+    Args:
+        events (Iterable[ChangeEvent]): Events in consume order.
+
+    Returns:
+        List[ChangeEvent]: The events in apply order.
+    """
+    ordered = []
+    upserts = defaultdict(list)
+    deletes = defaultdict(list)
+    seen = set()
+
+    for event in events:
+        if event.table not in appliers:
+            logger.warning(f"No processor found for table: {event.table}")
+            continue
+        if event.op in UPSERT_OPS:
+            target = upserts
+        elif event.op in DELETE_OPS:
+            target = deletes
+        else:
+            continue
+        key = (event.table, event.row[appliers[event.table].pk.name])
+        if key in seen:
+            ordered.extend(_segment_order(upserts, deletes))
+            upserts.clear()
+            deletes.clear()
+            seen.clear()
+        seen.add(key)
+        target[event.table].append(event)
+    ordered.extend(_segment_order(upserts, deletes))
+    return ordered
+
+
+def apply_ordered(db, events):
+    """
+    Apply events already in apply order, one statement per run of events
+    for the same table and kind of operation, and for upserts the same
+    schema version.
+
+    Args:
+        db (Session | Connection): The PostgreSQL session or connection.
+        events (List[ChangeEvent]): Events as returned by `order_events`.
+
+    Returns:
+        int: The number of events applied.
+    """
+    run_key = None
+    run_rows = []
+    for event in events:
+        if event.op in DELETE_OPS:
+            key = (event.table, True, None)
+        else:
+            key = (event.table, False, event.schema)
+        if key != run_key:
+            _apply_run(db, run_key, run_rows)
+            run_key = key
+            run_rows = []
+        run_rows.append(event.row)
+    _apply_run(db, run_key, run_rows)
+    return len(events)
+
+
+def _apply_run(db, run_key, rows):
+    if not rows:
+        return
+    table, is_delete, schema = run_key
+    if is_delete:
+        appliers[table].delete(db, rows)
+    else:
+        appliers[table].upsert(db, rows, schema)
+
+
+def apply_events(db, events):
+    """
+    Apply change events using bulk statements in a foreign-key-safe order.
+
+    Args:
+        db (Session | Connection): The PostgreSQL session or connection.
+        events (Iterable[ChangeEvent]): Events in consume order.
+
+    Returns:
+        int: The number of events that reached a table applier.
+    """
+    return apply_ordered(db, order_events(events))
+
+
+def is_poison(error):
+    """
+    Tell errors caused by the events themselves from infrastructure errors.
+
+    Lost connections, timeouts, deadlocks and serialization failures say
+    nothing about the rows being written, so they are never pinned on an
+    event; everything else (constraint violations, bad values) is.
+    """
+    return not isinstance(error, (OperationalError, InterfaceError))
+
+
+def is_foreign_key_violation(error):
+    """
+    Return True for an error raised because rows still reference a deleted
+    row, or a written row references one that does not exist.
+    """
+    # 23503 is PostgreSQL's foreign_key_violation SQLSTATE.
+    return getattr(getattr(error, "orig", None), "pgcode", None) == "23503"
+
+
+def apply_isolated(db, events):
+    """
+    Apply events in bulk, isolating the ones that cannot be applied.
+
+    The whole list is tried inside a savepoint. If that fails, the list is
+    bisected and each half retried in its own savepoint, so a single bad
+    event costs O(log n) extra statements while every other event is still
+    written in bulk.
+
+    Args:
+        db (Session | Connection): The PostgreSQL session or connection.
+        events (List[ChangeEvent]): Events as returned by `order_events`, so
+            each half is still in a foreign-key-safe order.
+
+    Returns:
+        Tuple[int, List[Tuple[ChangeEvent, Exception]]]: The number of events
+            applied and the rejected events with their errors.
+
+    Raises:
+        OperationalError, InterfaceError: Infrastructure errors, which the
+            caller should handle by retrying the whole batch.
+    """
+    if not events:
+        return 0, []
+    try:
+        with db.begin_nested():
+            apply_ordered(db, events)
+        return len(events), []
+    except Exception as e:
+        if not is_poison(e):
+            raise
+        if len(events) == 1:
+            return 0, [(events[0], e)]
+    middle = len(events) // 2
+    applied_left, failed_left = apply_isolated(db, events[:middle])
+    applied_right, failed_right = apply_isolated(db, events[middle:])
+    return applied_left + applied_right, failed_left + failed_right
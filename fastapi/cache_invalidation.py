@@ -0,0 +1,97 @@
+import json
+from sqlalchemy import text
+from database import Base
+
+# PostgreSQL NOTIFY channel the consumer announces changed rows on.
+CHANNEL = "cdc_cache_invalidation"
+# Tag that clears the whole cache, sent instead of very large tag sets.
+ALL = "*"
+# NOTIFY payloads are limited to 8000 bytes.
+MAX_PAYLOAD_BYTES = 7000
+MAX_TAGS_PER_BATCH = 5000
+
+_keys = {table.name: list(table.primary_key.columns)[0].name for table in Base.metadata.sorted_tables}
+_foreign_keys = {
+    table.name: [fk.parent.name for fk in table.foreign_keys] for table in Base.metadata.sorted_tables
+}
+
+
+def row_tag(table, key):
+    """
+    Tag of a cached response that embeds the row `table`.`key`.
+    """
+    return f"{table}:{key}"
+
+
+def collection_tag(table, column, value):
+    """
+    Tag of a cached response that embeds every `table` row whose `column` is `value`,
+    e.g. a user's orders: collection_tag("orders", "user_id", 5).
+    """
+    return f"{table}.{column}:{value}"
+
+
+def list_tag(table):
+    """
+    Tag of a cached list of `table` rows, which changes when rows are added or removed.
+    """
+    return f"{table}:*"
+
+
+def event_tags(events):
+    """
+    Return the tags of every cached response a set of change events affects.
+
+    An event affects the responses that embed its row, the collections its
+    new image belongs to through each foreign key, and for inserts and
+    deletes the lists of its table. A row leaving a collection is covered by
+    its row tag, since every response embedding it carries that tag.
+
+    Args:
+        events (Iterable[ChangeEvent]): The events.
+
+    Returns:
+        Set[str]: The tags.
+    """
+    tags = set()
+    for event in events:
+        if event.table not in _keys or event.row is None:
+            continue
+        tags.add(row_tag(event.table, event.row.get(_keys[event.table])))
+        for column in _foreign_keys[event.table]:
+            if event.row.get(column) is not None:
+                tags.add(collection_tag(event.table, column, event.row[column]))
+        if event.op != "u":
+            tags.add(list_tag(event.table))
+    return tags
+
+
+def notify(db, tags):
+    """
+    Announce changed rows to API caches when the current transaction commits.
+
+    NOTIFY is transactional, so the caches are invalidated exactly when the
+    rows become visible in PostgreSQL, and never for a rolled back batch.
+
+    Args:
+        db (Session): The PostgreSQL session applying the batch.
+        tags (Set[str]): Tags from `event_tags`.
+    """
+    if not tags:
+        return
+    if len(tags) > MAX_TAGS_PER_BATCH:
+        tags = [ALL]
+    chunk = []
+    size = 0
+    for tag in sorted(tags):
+        if chunk and size + len(tag) + 4 > MAX_PAYLOAD_BYTES:
+            _notify(db, chunk)
+            chunk = []
+            size = 0
+        chunk.append(tag)
+        size += len(tag) + 4
+    _notify(db, chunk)
+
+
+def _notify(db, tags):
+    db.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": CHANNEL, "payload": json.dumps(tags)})
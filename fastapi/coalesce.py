@@ -0,0 +1,38 @@
+from bulk_apply import appliers
+
+
+def coalesce_events(events):
+    """
+    Fold all change events for the same (table, primary key) into their net effect.
+
+    Within a consume window only the final state of a row matters: the last
+    upsert wins, and a delete wins over any earlier create or update. An
+    update of a row created in the window stays a create. A delete
+    is still emitted for rows created and deleted inside the window, because
+    a replayed window may find the row already present in PostgreSQL.
+
+    Each surviving event keeps the position of the last event for its key,
+    so the relative order between different rows is preserved.
+
+    Args:
+        events (Iterable[ChangeEvent]): Events in consume order.
+
+    Returns:
+        Tuple[List[ChangeEvent], int]: The net events and the number of
+            events that were collapsed away.
+    """
+    net = {}
+    total = 0
+    for event in events:
+        total += 1
+        applier = appliers.get(event.table)
+        if applier is None or event.row is None:
+            # Not keyed: keep it as-is under a key no other event shares.
+            net[(event.table, None, total)] = event
+            continue
+        key = (event.table, event.row.get(applier.pk.name))
+        previous = net.pop(key, None)
+        if previous is not None and previous.op == 'c' and event.op == 'u':
+            event = event._replace(op='c')
+        net[key] = event
+    return list(net.values()), total - len(net)
@@ -1,8 +1,14 @@
+import argparse
+import enum
+import json
 import logging
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from models import User
-from database import MYSQL_CONNECTION_STRING, POSTGRES_CONNECTION_STRING
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import Boolean, DateTime, Float, create_engine, select, text, update
+from database import Base, MYSQL_CONNECTION_STRING, POSTGRES_CONNECTION_STRING
+import models  # noqa: F401  (registers the tables on Base.metadata)
+from bulk_apply import appliers
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -10,68 +16,474 @@ logger = logging.getLogger(__name__)
 mysql_engine = create_engine(MYSQL_CONNECTION_STRING)
 postgres_engine = create_engine(POSTGRES_CONNECTION_STRING)
 
-MySQLSession = sessionmaker(bind=mysql_engine)
-PostgresSession = sessionmaker(bind=postgres_engine)
+# Rows per top-level checksum range, the split factor when drilling into a
+# mismatched range, and the range size at which rows are fetched and diffed.
+CHUNK_SIZE = int(os.getenv("VERIFY_CHUNK_SIZE", "10000"))
+FANOUT = int(os.getenv("VERIFY_FANOUT", "16"))
+LEAF_SIZE = int(os.getenv("VERIFY_LEAF_SIZE", "100"))
+# Rows per server-side cursor fetch in merge mode, and rows per repair statement.
+FETCH_SIZE = int(os.getenv("VERIFY_FETCH_SIZE", "5000"))
+REPAIR_BATCH_SIZE = int(os.getenv("REPAIR_BATCH_SIZE", "1000"))
+# Tables verified at the same time, where incremental runs keep their
+# per-table watermarks, and how many random older chunks they re-check.
+WORKERS = int(os.getenv("VERIFY_WORKERS", "4"))
+STATE_PATH = os.getenv("VERIFY_STATE_PATH", "/app/verify_state.json")
+SAMPLE_CHUNKS = int(os.getenv("VERIFY_SAMPLE_CHUNKS", "4"))
 
+NULL_MARKER = "<NULL>"
 
-def get_table_data(session, model):
-    return session.query(model).all()
 
+def normalized_column(column, dialect):
+    """
+    Return SQL rendering a column as text identically in MySQL and PostgreSQL.
 
-def object_to_dict(obj):
-    return {c.key: getattr(obj, c.key) for c in obj.__table__.columns}
+    Booleans become 0/1, floats are rounded to 4 decimals (MySQL FLOAT is
+    single precision), datetimes are truncated to seconds and NULL becomes a
+    marker, so equal rows produce equal strings on both sides.
 
+    Args:
+        column (Column): The model column.
+        dialect (str): `mysql` or `postgresql`.
 
-def compare_values(mysql_val, postgres_val):
-    return mysql_val == postgres_val
+    Returns:
+        str: A SQL expression.
+    """
+    name = column.name
+    if dialect == "mysql":
+        if isinstance(column.type, Float):
+            expr = f"CAST(CAST({name} AS DECIMAL(30,4)) AS CHAR)"
+        elif isinstance(column.type, DateTime):
+            expr = f"DATE_FORMAT({name}, '%Y-%m-%d %H:%i:%s')"
+        else:
+            expr = f"CAST({name} AS CHAR)"
+    else:
+        if isinstance(column.type, Float):
+            expr = f"CAST(CAST({name} AS NUMERIC(30,4)) AS TEXT)"
+        elif isinstance(column.type, DateTime):
+            expr = f"to_char({name}, 'YYYY-MM-DD HH24:MI:SS')"
+        elif isinstance(column.type, Boolean):
+            expr = f"CAST(CAST({name} AS INTEGER) AS TEXT)"
+        else:
+            expr = f"CAST({name} AS TEXT)"
+    return f"COALESCE({expr}, '{NULL_MARKER}')"
 
 
-def compare_databases():
-    logger.info("Starting database comparison for users table")
+def _row_hashes(table, dialect):
+    row_text = "CONCAT_WS('|', {})".format(
+        ", ".join(normalized_column(c, dialect) for c in table.columns)
+    )
+    # Two 32-bit slices of the row's MD5, summed per range. Sums are order
+    # independent and exact (DECIMAL/NUMERIC), so they match across databases.
+    if dialect == "mysql":
+        part = "CAST(CONV(SUBSTRING(MD5({}), {}, 8), 16, 10) AS UNSIGNED)"
+    else:
+        part = "('x' || lpad(substr(md5({}), {}, 8), 16, '0'))::bit(64)::bigint"
+    return part.format(row_text, 1), part.format(row_text, 9)
 
-    mysql_session = MySQLSession()
-    postgres_session = PostgresSession()
 
-    try:
+def _bucket(pk, dialect):
+    if dialect == "mysql":
+        return f"({pk} - :lo) DIV :step"
+    return f"({pk} - :lo) / :step"
 
-        mysql_users = get_table_data(mysql_session, User)
-        postgres_users = get_table_data(postgres_session, User)
 
-        mysql_count = len(mysql_users)
-        postgres_count = len(postgres_users)
+class TableVerifier:
+    """
+    Compare one table between MySQL and PostgreSQL by checksumming key ranges.
 
-        logger.info(f"User count: MySQL ({mysql_count}), PostgreSQL ({postgres_count})")
+    Each database hashes its own rows and returns only a count and checksum
+    per primary-key range, so a consistent table costs one small result set
+    per side. Mismatched ranges are split and re-checksummed until they are
+    small enough to fetch and diff row by row.
 
-        if mysql_count != postgres_count:
-            logger.warning(
-                f"Mismatch in number of users: MySQL ({mysql_count}) vs PostgreSQL ({postgres_count})"
+    Args:
+        table (Table): The model table to verify.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.pk = list(table.primary_key.columns)[0].name
+        self._checksum_sql = {}
+        self._rows_sql = {}
+        for dialect in ("mysql", "postgresql"):
+            h1, h2 = _row_hashes(table, dialect)
+            self._checksum_sql[dialect] = text(
+                f"SELECT {_bucket(self.pk, dialect)} AS bucket, COUNT(*), SUM({h1}), SUM({h2}) "
+                f"FROM {table.name} WHERE {self.pk} >= :lo AND {self.pk} < :hi "
+                f"GROUP BY bucket"
+            )
+            columns = ", ".join(normalized_column(c, dialect) for c in table.columns)
+            self._rows_sql[dialect] = text(
+                f"SELECT {self.pk}, {columns} FROM {table.name} "
+                f"WHERE {self.pk} >= :lo AND {self.pk} < :hi"
             )
 
-        for mysql_user, postgres_user in zip(mysql_users, postgres_users):
-            mysql_dict = object_to_dict(mysql_user)
-            postgres_dict = object_to_dict(postgres_user)
-
-            if not all(
-                compare_values(mysql_dict[key], postgres_dict[key])
-                for key in mysql_dict.keys()
-            ):
-                logger.warning(f"Mismatch in user records:")
-                logger.warning(f"  MySQL: {mysql_dict}")
-                logger.warning(f"  PostgreSQL: {postgres_dict}")
-                for key in mysql_dict.keys():
-                    if not compare_values(mysql_dict[key], postgres_dict[key]):
-                        logger.warning(
-                            f"    Difference in '{key}': MySQL={mysql_dict[key]}, PostgreSQL={postgres_dict[key]}"
-                        )
+    def key_bounds(self, conn):
+        return conn.execute(
+            text(f"SELECT MIN({self.pk}), MAX({self.pk}) FROM {self.table.name}")
+        ).one()
+
+    def checksums(self, conn, lo, hi, step):
+        """
+        Return {bucket: (count, sum1, sum2)} for the ranges of `step` keys in [lo, hi).
+        """
+        rows = conn.execute(
+            self._checksum_sql[conn.dialect.name], {"lo": lo, "hi": hi, "step": step}
+        )
+        return {int(bucket): (count, int(s1), int(s2)) for bucket, count, s1, s2 in rows}
+
+    def fetch_rows(self, conn, lo, hi):
+        """
+        Return {pk: normalized column values} for the rows in [lo, hi).
+        """
+        rows = conn.execute(self._rows_sql[conn.dialect.name], {"lo": lo, "hi": hi})
+        return {row[0]: tuple(row[1:]) for row in rows}
+
+    def diff_rows(self, mysql_conn, postgres_conn, lo, hi, report):
+        mysql_rows = self.fetch_rows(mysql_conn, lo, hi)
+        postgres_rows = self.fetch_rows(postgres_conn, lo, hi)
+        names = [c.name for c in self.table.columns]
+        for key in sorted(mysql_rows.keys() | postgres_rows.keys()):
+            mysql_row = mysql_rows.get(key)
+            postgres_row = postgres_rows.get(key)
+            if postgres_row is None:
+                report["missing"].append(key)
+            elif mysql_row is None:
+                report["extra"].append(key)
+            elif mysql_row != postgres_row:
+                changed = {
+                    name: (m, p)
+                    for name, m, p in zip(names, mysql_row, postgres_row)
+                    if m != p
+                }
+                report["changed"].append((key, changed))
+
+    def compare_range(self, mysql_conn, postgres_conn, lo, hi, step, report):
+        mysql_sums = self.checksums(mysql_conn, lo, hi, step)
+        postgres_sums = self.checksums(postgres_conn, lo, hi, step)
+        report["ranges_checked"] += len(mysql_sums.keys() | postgres_sums.keys())
+        for bucket in sorted(mysql_sums.keys() | postgres_sums.keys()):
+            if mysql_sums.get(bucket) == postgres_sums.get(bucket):
+                continue
+            report["ranges_mismatched"] += 1
+            bucket_lo = lo + bucket * step
+            bucket_hi = min(bucket_lo + step, hi)
+            if step <= LEAF_SIZE:
+                self.diff_rows(mysql_conn, postgres_conn, bucket_lo, bucket_hi, report)
             else:
-                logger.info(f"User {mysql_dict['id']} matches in both databases")
+                sub_step = max(step // FANOUT, LEAF_SIZE)
+                self.compare_range(mysql_conn, postgres_conn, bucket_lo, bucket_hi, sub_step, report)
+
+    def compare(self, mysql_conn, postgres_conn, since=None, sample_chunks=0):
+        """
+        Compare the whole table, or only the keys above a watermark plus a
+        random sample of older ranges.
+
+        Args:
+            mysql_conn (Connection): MySQL connection.
+            postgres_conn (Connection): PostgreSQL connection.
+            since (int, optional): The highest key verified by a previous pass.
+            sample_chunks (int): With `since`, how many random `CHUNK_SIZE`
+                ranges at or below it to re-check.
+
+        Returns:
+            dict: `missing` and `extra` primary keys (absent from PostgreSQL or
+                MySQL respectively), `changed` as (pk, {column: (mysql, postgres)})
+                pairs, the number of ranges checked and mismatched, and
+                `watermark`, the highest key below which every new row matched.
+        """
+        report = {"missing": [], "extra": [], "changed": [], "ranges_checked": 0, "ranges_mismatched": 0}
+        bounds = [self.key_bounds(mysql_conn), self.key_bounds(postgres_conn)]
+        lows = [lo for lo, _ in bounds if lo is not None]
+        highs = [hi for _, hi in bounds if hi is not None]
+        if not lows:
+            report["watermark"] = since
+            return report
+
+        lo, hi = min(lows), max(highs) + 1
+        if since is not None and since >= lo:
+            older = range(lo, min(since + 1, hi), CHUNK_SIZE)
+            for start in random.sample(older, min(sample_chunks, len(older))):
+                end = min(start + CHUNK_SIZE, since + 1)
+                self.compare_range(mysql_conn, postgres_conn, start, end, CHUNK_SIZE, report)
+            lo = since + 1
+        if lo < hi:
+            self.compare_range(mysql_conn, postgres_conn, lo, hi, CHUNK_SIZE, report)
+
+        # Stop the watermark before the first new row that did not match, so
+        # rows still in flight through the consumer are checked again.
+        unmatched = report["missing"] + report["extra"] + [key for key, _ in report["changed"]]
+        new_unmatched = [key for key in unmatched if since is None or key > since]
+        if new_unmatched:
+            report["watermark"] = min(new_unmatched) - 1
+        else:
+            report["watermark"] = max(hi - 1, since) if since is not None else hi - 1
+        return report
+
+
+def _value_normalizer(column):
+    if isinstance(column.type, Float):
+        return lambda value: None if value is None else round(float(value), 4)
+    if isinstance(column.type, DateTime):
+        return lambda value: None if value is None else value.replace(microsecond=0, tzinfo=None)
+    if isinstance(column.type, Boolean):
+        return lambda value: None if value is None else bool(value)
+    return lambda value: value.name if isinstance(value, enum.Enum) else value
+
+
+class Repairer:
+    """
+    Batch the upserts and deletes that bring PostgreSQL back in line with MySQL.
+
+    Uses the consumer's compiled `ON CONFLICT` upsert and `ANY(:ids)` delete
+    for the table, on a separate connection with one commit per batch.
+    Upserts are written while the table is scanned, and tables are scanned
+    parent-first. Deletes are only collected, and `delete_extra` is called
+    once every table is scanned, child-first, so an extra parent row is not
+    deleted while extra child rows still reference it.
+
+    A unique value an upserted row needs may still be held by another
+    PostgreSQL row: an extra row not deleted yet, or a row further on whose
+    value changed in MySQL. That value is first set to NULL in the same
+    transaction. The extra row is deleted at the end, and the other row is
+    reported as changed when the scan reaches it and is upserted then.
+    """
+
+    def __init__(self, table):
+        self.applier = appliers[table.name]
+        self.unique_columns = [c for c in table.columns if c.unique and not c.primary_key]
+        self.upserts = []
+        self.deletes = []
+        self.upserted = 0
+        self.deleted = 0
+
+    def upsert(self, row):
+        self.upserts.append(row)
+        if len(self.upserts) >= REPAIR_BATCH_SIZE:
+            self.flush()
+
+    def delete(self, key):
+        self.deletes.append(key)
+
+    def flush(self):
+        if not self.upserts:
+            return
+        with postgres_engine.begin() as conn:
+            for column in self.unique_columns:
+                values = {row[column.name] for row in self.upserts if row.get(column.name) is not None}
+                if values:
+                    conn.execute(
+                        update(self.applier.table).where(column.in_(values)).values({column.name: None})
+                    )
+            conn.execute(self.applier.upsert_stmt, self.upserts)
+        self.upserted += len(self.upserts)
+        self.upserts = []
+
+    def delete_extra(self):
+        """
+        Delete the collected extra rows, in batches of REPAIR_BATCH_SIZE.
+        """
+        for start in range(0, len(self.deletes), REPAIR_BATCH_SIZE):
+            batch = self.deletes[start:start + REPAIR_BATCH_SIZE]
+            with postgres_engine.begin() as conn:
+                conn.execute(self.applier.delete_stmt, {"ids": batch})
+            self.deleted += len(batch)
+        self.deletes = []
+
+
+def stream_rows(conn, table):
+    """
+    Yield a table's rows as dicts in primary-key order through a server-side cursor.
+    """
+    pk = list(table.primary_key.columns)[0]
+    result = conn.execution_options(yield_per=FETCH_SIZE).execute(
+        select(table).order_by(pk)
+    )
+    for row in result:
+        yield dict(row._mapping)
+
+
+def merge_compare_table(mysql_conn, postgres_conn, table, repairer=None):
+    """
+    Compare a table with a sorted merge-join of both primary-key-ordered streams.
+
+    Memory use does not depend on table size. Values are normalized the same
+    way on both sides (floats rounded to 4 decimals, datetimes to seconds
+    without time zone, booleans and enums to plain values), so only real
+    differences are reported.
+
+    Args:
+        mysql_conn (Connection): MySQL connection.
+        postgres_conn (Connection): PostgreSQL connection.
+        table (Table): The model table to compare.
+        repairer (Repairer, optional): Upserts missing and changed rows from
+            MySQL, and collects extra rows to delete from PostgreSQL.
+
+    Returns:
+        dict: The same report as `TableVerifier.compare`.
+    """
+    pk = list(table.primary_key.columns)[0].name
+    normalizers = [(c.name, _value_normalizer(c)) for c in table.columns]
+    report = {"missing": [], "extra": [], "changed": [], "ranges_checked": 0, "ranges_mismatched": 0}
+    sentinel = object()
+
+    mysql_rows = stream_rows(mysql_conn, table)
+    postgres_rows = stream_rows(postgres_conn, table)
+    mysql_row = next(mysql_rows, sentinel)
+    postgres_row = next(postgres_rows, sentinel)
+    while mysql_row is not sentinel or postgres_row is not sentinel:
+        if postgres_row is sentinel or (mysql_row is not sentinel and mysql_row[pk] < postgres_row[pk]):
+            report["missing"].append(mysql_row[pk])
+            if repairer:
+                repairer.upsert(mysql_row)
+            mysql_row = next(mysql_rows, sentinel)
+        elif mysql_row is sentinel or postgres_row[pk] < mysql_row[pk]:
+            report["extra"].append(postgres_row[pk])
+            if repairer:
+                repairer.delete(postgres_row[pk])
+            postgres_row = next(postgres_rows, sentinel)
+        else:
+            changed = {}
+            for name, normalize in normalizers:
+                mysql_val = normalize(mysql_row[name])
+                postgres_val = normalize(postgres_row[name])
+                if mysql_val != postgres_val:
+                    changed[name] = (mysql_val, postgres_val)
+            if changed:
+                report["changed"].append((mysql_row[pk], changed))
+                if repairer:
+                    repairer.upsert(mysql_row)
+            mysql_row = next(mysql_rows, sentinel)
+            postgres_row = next(postgres_rows, sentinel)
+
+    if repairer:
+        repairer.flush()
+    return report
+
+
+def log_report(table_name, report):
+    if not (report["missing"] or report["extra"] or report["changed"]):
+        logger.info(f"Table {table_name} matches ({report['ranges_checked']} ranges checked)")
+        return
+    logger.warning(
+        f"Table {table_name}: {len(report['missing'])} missing, {len(report['extra'])} extra, "
+        f"{len(report['changed'])} changed rows in PostgreSQL "
+        f"({report['ranges_mismatched']}/{report['ranges_checked']} ranges mismatched)"
+    )
+    for key in report["missing"]:
+        logger.warning(f"  {table_name} {key}: missing from PostgreSQL")
+    for key in report["extra"]:
+        logger.warning(f"  {table_name} {key}: not in MySQL")
+    for key, changed in report["changed"]:
+        for name, (mysql_val, postgres_val) in changed.items():
+            logger.warning(
+                f"  {table_name} {key}: difference in '{name}': MySQL={mysql_val}, PostgreSQL={postgres_val}"
+            )
+
+
+def load_watermarks(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_watermarks(path, watermarks):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(watermarks, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def verify_table(table, mode, since, repairer=None):
+    """
+    Verify one table on its own pair of connections.
+    """
+    with mysql_engine.connect() as mysql_conn, postgres_engine.connect() as postgres_conn:
+        if mode == "merge":
+            report = merge_compare_table(mysql_conn, postgres_conn, table, repairer=repairer)
+        else:
+            report = TableVerifier(table).compare(
+                mysql_conn, postgres_conn, since=since, sample_chunks=SAMPLE_CHUNKS
+            )
+    log_report(table.name, report)
+    return report
+
+
+def compare_databases(mode="checksum", repair=False, full=False):
+    """
+    Compare every replicated table between MySQL and PostgreSQL.
+
+    Tables are verified in parallel on `VERIFY_WORKERS` threads, except when
+    repairing: upserts must reach parents before their children, so tables
+    are then compared and repaired one at a time in FK order. Checksum
+    runs are incremental: each table's watermark in `VERIFY_STATE_PATH`
+    records the highest key already verified, and later runs check only newer
+    keys plus `VERIFY_SAMPLE_CHUNKS` random older ranges, which catch updates
+    and deletes of old rows over successive runs.
+
+    Args:
+        mode (str): `checksum` compares range checksums computed in each
+            database; `merge` streams both tables in key order and diffs
+            every row.
+        repair (bool): In `merge` mode, fix the differences in PostgreSQL:
+            missing and changed rows are upserted parent-first, then extra
+            rows are deleted child-first.
+        full (bool): In `checksum` mode, ignore the stored watermarks and
+            verify every row.
+
+    Returns:
+        Dict[str, dict]: The report for each table.
+    """
+    incremental = mode == "checksum" and not full
+    logger.info(f"Starting database comparison ({mode} mode{', incremental' if incremental else ''})")
+
+    watermarks = load_watermarks(STATE_PATH) if incremental else {}
+    tables = Base.metadata.sorted_tables
+    repairers = {table.name: Repairer(table) for table in tables} if repair else {}
+    with ThreadPoolExecutor(max_workers=1 if repair else WORKERS) as pool:
+        futures = {
+            table.name: pool.submit(
+                verify_table, table, mode, watermarks.get(table.name), repairers.get(table.name)
+            )
+            for table in tables
+        }
+        reports = {name: future.result() for name, future in futures.items()}
+
+    # Extra rows are deleted child-first, once every missing parent is back.
+    for table in reversed(tables):
+        if table.name in repairers:
+            repairer = repairers[table.name]
+            repairer.delete_extra()
+            reports[table.name]["upserted"] = repairer.upserted
+            reports[table.name]["deleted"] = repairer.deleted
+            logger.info(
+                f"Repaired {table.name}: {repairer.upserted} rows upserted, {repairer.deleted} rows deleted"
+            )
 
-    finally:
-        mysql_session.close()
-        postgres_session.close()
+    if mode == "checksum":
+        save_watermarks(STATE_PATH, {
+            name: report["watermark"] for name, report in reports.items()
+            if report["watermark"] is not None
+        })
 
-    logger.info("Database comparison for users table completed")
+    logger.info("Database comparison completed")
+    return reports
 
 
 if __name__ == "__main__":
-    compare_databases()
+    parser = argparse.ArgumentParser(description="Compare MySQL and PostgreSQL replicas")
+    parser.add_argument("--mode", choices=["checksum", "merge"], default="checksum")
+    parser.add_argument(
+        "--repair", action="store_true",
+        help="upsert missing/changed rows and delete extra rows in PostgreSQL (merge mode)",
+    )
+    parser.add_argument(
+        "--full", action="store_true",
+        help="verify every row instead of only rows above the stored watermarks (checksum mode)",
+    )
+    args = parser.parse_args()
+    if args.repair and args.mode != "merge":
+        parser.error("--repair requires --mode merge")
+    compare_databases(mode=args.mode, repair=args.repair, full=args.full)
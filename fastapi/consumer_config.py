@@ -0,0 +1,21 @@
+import os
+
+# Kafka settings shared by the consumer and its supervisor. Kept apart from
+# kafka_to_postgres, which sets up logging and its sinks when imported.
+
+KAFKA_BOOTSTRAP_SERVERS = ['kafka:9092']
+KAFKA_TOPICS = [
+    'mysql.fastapi_db.users',
+    'mysql.fastapi_db.products',
+    'mysql.fastapi_db.orders',
+    'mysql.fastapi_db.order_items',
+    'mysql.fastapi_db.product_categories'
+]
+KAFKA_GROUP_ID = 'my-group'
+# With DYNAMIC_TABLES, every topic matching KAFKA_TOPIC_PATTERN is replicated:
+# tables and new columns are created in PostgreSQL from the `schema` block of
+# the messages, which needs JSON messages with schemas enabled.
+DYNAMIC_TABLES = os.getenv("DYNAMIC_TABLES", "false").lower() == "true"
+KAFKA_TOPIC_PATTERN = os.getenv("KAFKA_TOPIC_PATTERN", r"^mysql\.fastapi_db\..+")
+# Prometheus metrics are served on this port; 0 disables the endpoint.
+METRICS_PORT = int(os.getenv("METRICS_PORT", "8001"))
@@ -0,0 +1,144 @@
+import threading
+import time
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+EVENTS_APPLIED = Counter(
+    "cdc_events_applied_total",
+    "Change events written to PostgreSQL",
+    ["table", "op"],
+)
+EVENTS_COALESCED = Counter(
+    "cdc_events_coalesced_total",
+    "Change events folded into a later event for the same row",
+)
+DEAD_LETTERS = Counter(
+    "cdc_dead_letters_total",
+    "Events and messages sent to the dead-letter sink",
+)
+STAGE_SECONDS = Histogram(
+    "cdc_stage_duration_seconds",
+    "Time spent per batch in each consumer stage; convert is included in apply",
+    ["stage"],
+)
+REPLICATION_LATENCY = Histogram(
+    "cdc_replication_latency_seconds",
+    "Time from the MySQL commit (source.ts_ms) to the PostgreSQL commit",
+    ["table"],
+    buckets=LATENCY_BUCKETS,
+)
+PIPELINE_LATENCY = Histogram(
+    "cdc_pipeline_latency_seconds",
+    "Time from Debezium processing the change (ts_ms) to the PostgreSQL commit",
+    ["table"],
+    buckets=LATENCY_BUCKETS,
+)
+CONSUMER_LAG = Gauge(
+    "cdc_consumer_lag_messages",
+    "Messages between the consumer position and the partition high watermark",
+    ["topic", "partition"],
+)
+DEFERRED_DEPTH = Gauge(
+    "cdc_deferred_rows",
+    "Child rows waiting in the deferred-parent buffer",
+    ["worker"],
+)
+DEFERRED_OLDEST_AGE = Gauge(
+    "cdc_deferred_oldest_age_seconds",
+    "Age of the oldest row in the deferred-parent buffer",
+    ["worker"],
+)
+
+
+class BatchStageTimer:
+    """
+    Add up the time of a stage that runs several times per batch, per
+    thread, and observe the total once per batch like the other stages.
+
+    Args:
+        histogram (Histogram): The stage's labelled histogram.
+    """
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self._local = threading.local()
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._local.seconds = getattr(self._local, "seconds", 0.0) + time.perf_counter() - started
+
+    def reset(self):
+        """
+        Forget the time of the current thread's unfinished batch.
+        """
+        self._local.seconds = 0.0
+
+    def observe(self):
+        """
+        Observe the current thread's total for its batch and start a new one.
+        """
+        self.histogram.observe(getattr(self._local, "seconds", 0.0))
+        self._local.seconds = 0.0
+
+
+DECODE_SECONDS = STAGE_SECONDS.labels("decode")
+PREPARE_SECONDS = STAGE_SECONDS.labels("prepare")
+SNAPSHOT_SECONDS = STAGE_SECONDS.labels("snapshot")
+# Row conversion runs once per upsert statement, and is summed per batch.
+CONVERT_SECONDS = BatchStageTimer(STAGE_SECONDS.labels("convert"))
+APPLY_SECONDS = STAGE_SECONDS.labels("apply")
+COMMIT_SECONDS = STAGE_SECONDS.labels("commit")
+
+
+def start_metrics_server(port):
+    """
+    Serve the metrics on `http://0.0.0.0:<port>/metrics` from a background thread.
+    """
+    start_http_server(port)
+
+
+def observe_applied(events, committed_at=None):
+    """
+    Count committed events and record their end-to-end latency.
+
+    Args:
+        events (List[ChangeEvent]): The events committed to PostgreSQL.
+        committed_at (float, optional): Commit time in epoch seconds.
+    """
+    now_ms = (committed_at or time.time()) * 1000
+    for event in events:
+        EVENTS_APPLIED.labels(event.table, event.op).inc()
+        if event.source_ts_ms:
+            REPLICATION_LATENCY.labels(event.table).observe((now_ms - event.source_ts_ms) / 1000)
+        if event.ts_ms:
+            PIPELINE_LATENCY.labels(event.table).observe((now_ms - event.ts_ms) / 1000)
+
+
+def observe_deferred(stats):
+    """
+    Publish the stats of the current thread's deferred-parent buffer.
+    """
+    worker = threading.current_thread().name
+    DEFERRED_DEPTH.labels(worker).set(stats["depth"])
+    DEFERRED_OLDEST_AGE.labels(worker).set(stats["oldest_age_seconds"])
+
+
+def observe_lag(consumer):
+    """
+    Update per-partition consumer lag from the consumer's fetch metadata.
+
+    Args:
+        consumer (KafkaConsumer): The consumer; must be called from its thread.
+    """
+    for tp in consumer.assignment():
+        highwater = consumer.highwater(tp)
+        if highwater is None:
+            continue
+        lag = max(highwater - consumer.position(tp), 0)
+        CONSUMER_LAG.labels(tp.topic, str(tp.partition)).set(lag)
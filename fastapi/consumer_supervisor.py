@@ -0,0 +1,291 @@
+import logging
+import os
+import re
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+from kafka import KafkaConsumer, TopicPartition
+from prometheus_client.parser import text_string_to_metric_families
+from consumer_config import (
+    DYNAMIC_TABLES,
+    KAFKA_BOOTSTRAP_SERVERS,
+    KAFKA_GROUP_ID,
+    KAFKA_TOPIC_PATTERN,
+    KAFKA_TOPICS,
+    METRICS_PORT,
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CONSUMER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "kafka_to_postgres.py")
+
+# Bounds on the number of consumer processes. More processes than partitions
+# would sit idle, so the partition count caps the maximum too.
+MIN_PROCESSES = int(os.getenv("CONSUMER_MIN_PROCESSES", "1"))
+MAX_PROCESSES = int(os.getenv("CONSUMER_MAX_PROCESSES", "4"))
+# How often lag and apply latency are measured, and the least time between
+# two scaling steps; each step makes the group rebalance its partitions.
+SCALE_INTERVAL_S = float(os.getenv("SCALE_INTERVAL_S", "30"))
+SCALE_COOLDOWN_S = float(os.getenv("SCALE_COOLDOWN_S", "120"))
+# Total lag, in messages, above which a process is added and below which one
+# is removed.
+SCALE_UP_LAG = int(os.getenv("SCALE_UP_LAG", "10000"))
+SCALE_DOWN_LAG = int(os.getenv("SCALE_DOWN_LAG", "1000"))
+# Mean time to apply one event above which PostgreSQL is taken to be
+# saturated: another writer would only slow every process down, so one is
+# removed. Measured per event, so larger batches during snapshots and
+# backfills do not count as saturation.
+MAX_APPLY_MS_PER_EVENT = float(os.getenv("MAX_APPLY_MS_PER_EVENT", "5"))
+# A process that exits within STABLE_AFTER_S of starting is restarted after a
+# delay doubling from RESTART_BACKOFF_S up to MAX_RESTART_BACKOFF_S.
+RESTART_BACKOFF_S = float(os.getenv("RESTART_BACKOFF_S", "1"))
+MAX_RESTART_BACKOFF_S = float(os.getenv("MAX_RESTART_BACKOFF_S", "60"))
+STABLE_AFTER_S = float(os.getenv("STABLE_AFTER_S", "60"))
+# Time a stopping process gets to finish its batch and leave the group.
+STOP_TIMEOUT_S = float(os.getenv("STOP_TIMEOUT_S", "30"))
+
+
+class ConsumerProcess:
+    """
+    One `kafka_to_postgres.py` process in a fixed slot.
+
+    Each slot serves its metrics on METRICS_PORT + slot, where the supervisor
+    reads its apply time per event.
+
+    Args:
+        slot (int): The slot number, from 0.
+    """
+
+    def __init__(self, slot):
+        self.slot = slot
+        self.metrics_port = METRICS_PORT + slot if METRICS_PORT else 0
+        self.process = None
+        self.terminated = False
+        self.started_at = 0.0
+        self.backoff = RESTART_BACKOFF_S
+        self.restart_at = 0.0
+        self.apply_totals = None
+
+    def start(self):
+        env = dict(os.environ, METRICS_PORT=str(self.metrics_port))
+        self.process = subprocess.Popen([sys.executable, CONSUMER_SCRIPT], env=env)
+        self.terminated = False
+        self.started_at = time.monotonic()
+        self.apply_totals = None
+        logger.info(f"Started consumer {self.slot} (pid {self.process.pid})")
+
+    def check(self):
+        """
+        Restart the process if it exited, backing off while it keeps crashing.
+        """
+        now = time.monotonic()
+        if self.process is not None:
+            code = self.process.poll()
+            if code is None:
+                return
+            if now - self.started_at >= STABLE_AFTER_S:
+                self.backoff = RESTART_BACKOFF_S
+            self.process = None
+            self.restart_at = now + self.backoff
+            logger.error(f"Consumer {self.slot} exited with code {code}, restarting in {self.backoff:.0f}s")
+            self.backoff = min(self.backoff * 2, MAX_RESTART_BACKOFF_S)
+        if now >= self.restart_at:
+            self.start()
+
+    def terminate(self):
+        """
+        Ask the process to finish its batch and leave the group.
+        """
+        if self.process is not None and not self.terminated:
+            self.process.terminate()
+            self.terminated = True
+
+    def stop(self):
+        if self.process is None:
+            return
+        self.terminate()
+        try:
+            self.process.wait(STOP_TIMEOUT_S)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"Consumer {self.slot} did not stop within {STOP_TIMEOUT_S:.0f}s, killing it")
+            self.process.kill()
+            self.process.wait()
+        logger.info(f"Stopped consumer {self.slot}")
+        self.process = None
+
+    def apply_delta(self):
+        """
+        Return the (seconds, events) spent in and written by the apply and
+        snapshot stages since the previous call, or None if the metrics
+        cannot be read.
+        """
+        if self.process is None or not self.metrics_port:
+            return None
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{self.metrics_port}/metrics", timeout=2) as response:
+                body = response.read().decode()
+        except OSError:
+            return None
+        seconds = events = 0.0
+        for family in text_string_to_metric_families(body):
+            for sample in family.samples:
+                if sample.name == "cdc_events_applied_total":
+                    events += sample.value
+                elif (
+                    sample.name == "cdc_stage_duration_seconds_sum"
+                    and sample.labels.get("stage") in ("apply", "snapshot")
+                ):
+                    seconds += sample.value
+        previous = self.apply_totals or (0.0, 0.0)
+        self.apply_totals = (seconds, events)
+        return seconds - previous[0], events - previous[1]
+
+
+class LagMonitor:
+    """
+    Measure the consumer group's total lag from its committed Kafka offsets.
+
+    With OFFSET_STORE=postgres the consumers still commit to Kafka after
+    every batch, so the committed offsets follow the applied ones closely.
+    """
+
+    def __init__(self):
+        self.kafka = KafkaConsumer(
+            bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
+            group_id=KAFKA_GROUP_ID,
+            enable_auto_commit=False,
+        )
+
+    def partitions(self):
+        if DYNAMIC_TABLES:
+            pattern = re.compile(KAFKA_TOPIC_PATTERN)
+            topics = [topic for topic in self.kafka.topics() if pattern.match(topic)]
+        else:
+            topics = KAFKA_TOPICS
+        return [
+            TopicPartition(topic, partition)
+            for topic in topics
+            for partition in sorted(self.kafka.partitions_for_topic(topic) or ())
+        ]
+
+    def lag(self, partitions):
+        if not partitions:
+            return 0
+        end = self.kafka.end_offsets(partitions)
+        beginning = self.kafka.beginning_offsets(partitions)
+        total = 0
+        for tp in partitions:
+            committed = self.kafka.committed(tp)
+            total += max(end[tp] - (committed if committed is not None else beginning[tp]), 0)
+        return total
+
+    def close(self):
+        self.kafka.close()
+
+
+def scale_step(processes, max_processes, lag, apply_ms):
+    """
+    Decide whether to add or remove a consumer process.
+
+    Args:
+        processes (int): The current number of processes.
+        max_processes (int): The upper bound, already capped by partitions.
+        lag (int): Total lag of the group, in messages.
+        apply_ms (float | None): Mean milliseconds to apply an event over
+            the last interval, or None when no event was applied.
+
+    Returns:
+        int: +1, -1 or 0.
+    """
+    if apply_ms is not None and apply_ms > MAX_APPLY_MS_PER_EVENT and processes > MIN_PROCESSES:
+        return -1
+    if lag > SCALE_UP_LAG and processes < max_processes:
+        return 1
+    if lag < SCALE_DOWN_LAG and processes > MIN_PROCESSES:
+        return -1
+    return 0
+
+
+class Supervisor:
+    """
+    Run consumer processes in one consumer group and scale their number.
+
+    Kafka spreads the topics' partitions over the processes, and rebalances
+    them whenever a process starts, stops or crashes. Crashed processes are
+    restarted. Every SCALE_INTERVAL_S the group's lag and the mean apply
+    time per event decide, through `scale_step`, whether a process is added
+    or removed, at most once per SCALE_COOLDOWN_S.
+    """
+
+    def __init__(self):
+        self.processes = []
+        self.lag_monitor = LagMonitor()
+        self.stopping = False
+        self.last_scaled = 0.0
+
+    def resize(self, count):
+        while len(self.processes) < count:
+            process = ConsumerProcess(len(self.processes))
+            process.start()
+            self.processes.append(process)
+        while len(self.processes) > count:
+            self.processes.pop().stop()
+
+    def apply_ms_per_event(self):
+        seconds = events = 0.0
+        for process in self.processes:
+            delta = process.apply_delta()
+            if delta is not None:
+                seconds += delta[0]
+                events += delta[1]
+        return seconds * 1000 / events if events > 0 else None
+
+    def autoscale(self):
+        partitions = self.lag_monitor.partitions()
+        lag = self.lag_monitor.lag(partitions)
+        apply_ms = self.apply_ms_per_event()
+        max_processes = max(MIN_PROCESSES, min(MAX_PROCESSES, len(partitions)))
+        step = scale_step(len(self.processes), max_processes, lag, apply_ms)
+        apply_text = f"{apply_ms:.2f}ms" if apply_ms is not None else "n/a"
+        logger.info(
+            f"{len(self.processes)} consumers, lag {lag} messages over {len(partitions)} partitions, "
+            f"apply time {apply_text} per event"
+        )
+        if step and time.monotonic() - self.last_scaled >= SCALE_COOLDOWN_S:
+            logger.info(f"Scaling consumers from {len(self.processes)} to {len(self.processes) + step}")
+            self.resize(len(self.processes) + step)
+            self.last_scaled = time.monotonic()
+
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.resize(MIN_PROCESSES)
+        self.last_scaled = time.monotonic()
+        next_scale = time.monotonic() + SCALE_INTERVAL_S
+        try:
+            while not self.stopping:
+                for process in self.processes:
+                    process.check()
+                if time.monotonic() >= next_scale:
+                    next_scale = time.monotonic() + SCALE_INTERVAL_S
+                    try:
+                        self.autoscale()
+                    except Exception as e:
+                        logger.warning(f"Could not measure consumer lag: {e}")
+                time.sleep(1)
+        finally:
+            # Stop every process at once, so the group rebalances only once.
+            for process in self.processes:
+                process.terminate()
+            self.resize(0)
+            self.lag_monitor.close()
+
+
+if __name__ == "__main__":
+    Supervisor().run()
@@ -0,0 +1,297 @@
+import base64
+import re
+import threading
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from sqlalchemy import (
+    BigInteger, Boolean, Date, DateTime, Float, Integer, Interval, LargeBinary, Numeric, SmallInteger, Text,
+)
+from sqlalchemy.dialects.postgresql import DOUBLE_PRECISION, JSONB, REAL
+from database import Base
+from deserializers import json_loads
+import models  # noqa: F401  (registers the tables on Base.metadata)
+
+# MySQL DATETIME has no time zone; Debezium encodes its wall-clock time as if
+# it were UTC, so it is decoded to a naive datetime.
+EPOCH = datetime(1970, 1, 1)
+EPOCH_DATE = date(1970, 1, 1)
+
+
+def timestamp_from_millis(value):
+    """
+    Convert a Debezium epoch-millisecond timestamp to a UTC datetime.
+    """
+    if not value:
+        return None
+    return datetime.fromtimestamp(value / 1000, timezone.utc)
+
+
+def _column_converter(column):
+    if isinstance(column.type, DateTime):
+        return timestamp_from_millis
+    if isinstance(column.type, Boolean):
+        return bool
+    if isinstance(column.type, Float):
+        return float
+    return None
+
+
+def _decimal(scale):
+    def convert(value):
+        unscaled = int.from_bytes(base64.b64decode(value), "big", signed=True)
+        return Decimal(unscaled).scaleb(-scale)
+    return convert
+
+
+def _variable_scale_decimal(value):
+    return _decimal(value["scale"])(value["value"])
+
+
+def _decimal_type(field):
+    parameters = field.get("parameters") or {}
+    precision = parameters.get("connect.decimal.precision")
+    scale = int(parameters.get("scale", 0))
+    return Numeric(int(precision), scale) if precision else Numeric(), _decimal(scale)
+
+
+_ZONED_FRACTION = re.compile(r"\.(\d+)")
+
+
+def _zoned_timestamp(value):
+    # Debezium writes e.g. "2024-01-01T00:00:00.12Z": a trailing Z, and only
+    # the fraction digits needed. Python 3.10's fromisoformat accepts neither.
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    return datetime.fromisoformat(
+        _ZONED_FRACTION.sub(lambda m: "." + m.group(1)[:6].ljust(6, "0"), value, count=1)
+    )
+
+
+def _geometry(value):
+    return base64.b64decode(value["wkb"])
+
+
+# Debezium and Kafka Connect logical types: column type and converter from
+# the JSON-encoded value. Converters are only called for values that are not null.
+LOGICAL_TYPES = {
+    "io.debezium.time.Date": (Date, lambda days: EPOCH_DATE + timedelta(days=days)),
+    "org.apache.kafka.connect.data.Date": (Date, lambda days: EPOCH_DATE + timedelta(days=days)),
+    "io.debezium.time.Timestamp": (DateTime, lambda ms: EPOCH + timedelta(milliseconds=ms)),
+    "org.apache.kafka.connect.data.Timestamp": (DateTime, lambda ms: EPOCH + timedelta(milliseconds=ms)),
+    "io.debezium.time.MicroTimestamp": (DateTime, lambda us: EPOCH + timedelta(microseconds=us)),
+    "io.debezium.time.NanoTimestamp": (DateTime, lambda ns: EPOCH + timedelta(microseconds=ns // 1000)),
+    # MySQL TIMESTAMP, sent as an ISO 8601 string in UTC.
+    "io.debezium.time.ZonedTimestamp": (DateTime(timezone=True), _zoned_timestamp),
+    # MySQL TIME ranges over +/-838 hours, so it is kept as an interval.
+    "io.debezium.time.Time": (Interval, lambda ms: timedelta(milliseconds=ms)),
+    "org.apache.kafka.connect.data.Time": (Interval, lambda ms: timedelta(milliseconds=ms)),
+    "io.debezium.time.MicroTime": (Interval, lambda us: timedelta(microseconds=us)),
+    "io.debezium.time.NanoTime": (Interval, lambda ns: timedelta(microseconds=ns // 1000)),
+    "io.debezium.time.Year": (Integer, None),
+    "io.debezium.data.Json": (JSONB, json_loads),
+    "io.debezium.data.Enum": (Text, None),
+    "io.debezium.data.EnumSet": (Text, None),
+    "io.debezium.data.Bits": (LargeBinary, base64.b64decode),
+    "io.debezium.data.VariableScaleDecimal": (Numeric, _variable_scale_decimal),
+    # Spatial values are kept as their well-known binary.
+    "io.debezium.data.geometry.Geometry": (LargeBinary, _geometry),
+    "io.debezium.data.geometry.Point": (LargeBinary, _geometry),
+}
+
+# Kafka Connect schema types of fields without a logical type.
+PRIMITIVE_TYPES = {
+    "int8": (SmallInteger, None),
+    "int16": (SmallInteger, None),
+    "int32": (Integer, None),
+    "int64": (BigInteger, None),
+    "float": (REAL, None),
+    "double": (DOUBLE_PRECISION, None),
+    "boolean": (Boolean, None),
+    "string": (Text, None),
+    "bytes": (LargeBinary, base64.b64decode),
+}
+
+
+def field_type(field):
+    """
+    Map a field of a Debezium envelope's `schema` block to a PostgreSQL
+    column type and a converter for its JSON-encoded values.
+
+    Other structs, arrays and maps are stored as JSONB.
+
+    Args:
+        field (dict): The field's schema, e.g. `{"type": "int32", "field": "id"}`.
+
+    Returns:
+        Tuple[TypeEngine, Optional[Callable]]: The column type, and the
+            converter for non-null values, or None when they are stored as
+            they are.
+    """
+    name = field.get("name")
+    if name == "org.apache.kafka.connect.data.Decimal":
+        return _decimal_type(field)
+    if name in LOGICAL_TYPES:
+        return LOGICAL_TYPES[name]
+    return PRIMITIVE_TYPES.get(field["type"], (JSONB, None))
+
+
+def field_converter(column, field):
+    """
+    Return the converter from a field's values to a column's values.
+
+    The field's logical type decides how a value is decoded, and the column
+    only matters where the two disagree: MySQL BOOLEAN is TINYINT(1), which
+    Debezium sends as an int16.
+
+    Args:
+        column (Column): The target column.
+        field (dict, optional): The field's schema; None if the schema
+            version has no such field, so the column is written as null.
+
+    Returns:
+        Optional[Callable]: The converter for non-null values, or None.
+    """
+    if field is None:
+        return None
+    if isinstance(column.type, Boolean) and field["type"] != "boolean":
+        return bool
+    return field_type(field)[1]
+
+
+def compile_row_converter(columns):
+    """
+    Compile a row converter from per-column converters.
+
+    The converter is generated as a single function returning a dict
+    literal, so converting a row is one pass with no loop over columns and
+    no type dispatch.
+
+    Args:
+        columns (List[Tuple[str, Optional[Callable]]]): Each column name with
+            the converter for its non-null values, or None to copy them as
+            they are.
+
+    Returns:
+        Callable[[dict], dict]: Turns a Debezium row image into column values.
+    """
+    namespace = {}
+    lines = ["def convert(data):", "    get = data.get"]
+    items = []
+    for i, (name, func) in enumerate(columns):
+        if func is None:
+            items.append(f"{name!r}: get({name!r})")
+        else:
+            namespace[f"f{i}"] = func
+            lines.append(f"    v{i} = get({name!r})")
+            items.append(f"{name!r}: None if v{i} is None else f{i}(v{i})")
+    lines.append("    return {" + ", ".join(items) + "}")
+    exec("\n".join(lines), namespace)
+    return namespace["convert"]
+
+
+def make_row_converter(table):
+    """
+    Build a function that turns a Debezium row image into column values.
+
+    The returned function always yields every column of `table`, so rows for
+    the same table can be sent together as one executemany. Fields that are
+    not columns of the model are dropped. Used for messages without a
+    schema, whose timestamps are taken to be in milliseconds.
+
+    Args:
+        table (Table): The SQLAlchemy table the rows belong to.
+
+    Returns:
+        Callable[[dict], dict]: The row converter.
+    """
+    return compile_row_converter([(column.name, _column_converter(column)) for column in table.columns])
+
+
+def schema_row_converter(table, fields):
+    """
+    Build the row converter of `table` for one schema version.
+
+    Like `make_row_converter`, but each value is decoded according to the
+    logical type of its field in the envelope schema.
+
+    Args:
+        table (Table): The SQLAlchemy table the rows belong to.
+        fields (List[dict]): The row fields of the envelope schema.
+
+    Returns:
+        Callable[[dict], dict]: The row converter.
+    """
+    by_name = {field["field"]: field for field in fields}
+    return compile_row_converter([
+        (column.name, field_converter(column, by_name.get(column.name))) for column in table.columns
+    ])
+
+
+def row_fields(schema):
+    """
+    Return the fields of the row images in a Debezium envelope's `schema` block.
+    """
+    for field in schema["fields"]:
+        if field["field"] in ("after", "before"):
+            return field["fields"]
+    raise KeyError("Envelope schema has no before or after field")
+
+
+class SchemaVersion:
+    """
+    One version of a table's row schema.
+
+    Instances are shared by every message with an equal schema and compare
+    by identity, so they are cheap keys for per-version caches.
+    """
+
+    __slots__ = ("table", "fields")
+
+    def __init__(self, table, fields):
+        self.table = table
+        self.fields = fields
+
+
+class SchemaVersions:
+    """
+    Intern the row schemas of incoming messages as SchemaVersion objects.
+
+    A message whose row schema equals the newest version seen for its table
+    costs one comparison.
+    """
+
+    def __init__(self):
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, table, schema):
+        """
+        Return the SchemaVersion of an envelope's `schema` block.
+
+        Args:
+            table (str): The source table name.
+            schema (dict): The envelope's `schema` block, or None.
+
+        Returns:
+            SchemaVersion: The version, or None for schemaless messages.
+        """
+        if schema is None:
+            return None
+        fields = row_fields(schema)
+        for version in self._versions.get(table, ()):
+            if version.fields == fields:
+                return version
+        with self._lock:
+            for version in self._versions.get(table, ()):
+                if version.fields == fields:
+                    return version
+            version = SchemaVersion(table, fields)
+            self._versions[table] = [version] + self._versions.get(table, [])
+            return version
+
+
+schema_versions = SchemaVersions()
+
+row_converters = {
+    table.name: make_row_converter(table) for table in Base.metadata.sorted_tables
+}
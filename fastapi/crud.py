@@ -1,165 +1,434 @@
-from sqlalchemy.orm import Session
+import logging
+from sqlalchemy import insert, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
+from typing import List, Optional
 import models, schemas
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
+# Rows per multi-row INSERT on MySQL, well below max_allowed_packet.
+INSERT_CHUNK_SIZE = 1000
+
+# Loader options matching the nesting of each response schema. Collections
+# use selectin loading (one extra query per level, however many rows) and
+# many-to-one references are joined, so a request costs a fixed number of
+# queries instead of one per related row.
+PRODUCT_LOAD_OPTIONS = (joinedload(models.Product.category),)
+ORDER_LOAD_OPTIONS = (
+    selectinload(models.Order.order_items)
+    .joinedload(models.OrderItem.product)
+    .joinedload(models.Product.category),
+)
+USER_LOAD_OPTIONS = (
+    selectinload(models.User.orders)
+    .selectinload(models.Order.order_items)
+    .joinedload(models.OrderItem.product)
+    .joinedload(models.Product.category),
+)
+
+
+class DuplicateRow(Exception):
+    """
+    An insert was rejected by a unique constraint.
+    """
+
 
-def get_product_category(db: Session, category_id: int):
+class MissingReference(Exception):
+    """
+    An insert referenced a row that does not exist.
+
+    Args:
+        table (str): The table the missing row belongs to.
+    """
+
+    def __init__(self, table):
+        super().__init__(f"Referenced {table} row does not exist")
+        self.table = table
+
+
+# Step between the ids of one multi-row INSERT per MySQL server, or None
+# if they may not be consecutive.
+_id_steps = {}
+
+
+async def _id_step(db: AsyncSession):
+    key = db.bind.url
+    if key not in _id_steps:
+        mode, step = (
+            await db.execute(text("SELECT @@innodb_autoinc_lock_mode, @@auto_increment_increment"))
+        ).one()
+        _id_steps[key] = step if mode in (0, 1) else None
+        if _id_steps[key] is None:
+            logger.warning(
+                f"innodb_autoinc_lock_mode is {mode}: ids of a multi-row INSERT may not be "
+                f"consecutive, so rows are inserted one at a time"
+            )
+    return _id_steps[key]
+
+
+async def insert_rows(db: AsyncSession, table, rows: List[dict]):
+    """
+    Insert rows with multi-row INSERTs and return their generated ids, in order.
+
+    Dialects with RETURNING (PostgreSQL, MariaDB) send the ids back. MySQL
+    gives the rows of one multi-row INSERT consecutive ids starting at
+    LAST_INSERT_ID() while `innodb_autoinc_lock_mode` is 0 or 1; with 2,
+    concurrent inserts may interleave, so the rows are inserted one by one.
+
+    Args:
+        db (AsyncSession): The database session.
+        table (Table): The table to insert into.
+        rows (List[dict]): The rows, all with the same keys.
+
+    Returns:
+        List[int]: The ids of the rows.
+    """
+    if not rows:
+        return []
+    if db.bind.dialect.insert_returning:
+        stmt = insert(table).returning(table.c.id, sort_by_parameter_order=True)
+        return list((await db.execute(stmt, rows)).scalars())
+    step = await _id_step(db)
+    ids = []
+    if step is None:
+        for row in rows:
+            ids.append((await db.execute(insert(table).values(row))).lastrowid)
+        return ids
+    for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+        chunk = rows[start:start + INSERT_CHUNK_SIZE]
+        first_id = (await db.execute(insert(table).values(chunk))).lastrowid
+        ids.extend(range(first_id, first_id + step * len(chunk), step))
+    return ids
+
+
+async def _insert(db: AsyncSession, table, rows: List[dict], error: Exception):
+    # Any constraint on these inserts means `error`; the session is rolled back.
+    try:
+        return await insert_rows(db, table, rows)
+    except IntegrityError as e:
+        await db.rollback()
+        raise error from e
+
+
+async def _get_many(db: AsyncSession, model, ids: List[int], options=()):
+    stmt = select(model).options(*options).where(model.id.in_(ids))
+    found = {obj.id: obj for obj in await db.scalars(stmt)}
+    return [found[id_] for id_ in ids]
+
+
+def paginate(stmt, model, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    """
+    Apply offset or keyset pagination to a select statement.
+
+    With `after_id`, rows are returned in id order starting after that id,
+    which is an index range scan and costs the same on every page. Without
+    it, `skip` rows are skipped with OFFSET, as before.
+
+    Args:
+        stmt (Select): The statement to paginate.
+        model: The mapped class whose `id` is the key.
+        skip (int, optional): Number of records to skip. Defaults to 0.
+        limit (int, optional): Maximum number of records to return. Defaults to 100.
+        after_id (int, optional): Return only records with a larger id.
+
+    Returns:
+        Select: The paginated statement.
+    """
+    if after_id is not None:
+        return stmt.where(model.id > after_id).order_by(model.id).limit(limit)
+    return stmt.offset(skip).limit(limit)
+
+
+async def get_product_category(db: AsyncSession, category_id: int):
     """
     Retrieve a product category by its ID.
 
     Args:
-        db (Session): The database session.
+        db (AsyncSession): The database session.
         category_id (int): The ID of the product category to retrieve.
 
     Returns:
         models.ProductCategory: The product category object if found, else None.
     """
-    return (
-        db.query(models.ProductCategory)
-        .filter(models.ProductCategory.id == category_id)
-        .first()
-    )
+    return await db.get(models.ProductCategory, category_id)
 
 
-def get_product_categories(db: Session, skip: int = 0, limit: int = 100):
+async def get_product_categories(
+    db: AsyncSession, skip: int = 0, limit: int = 100, after_id: Optional[int] = None
+):
     """
     Retrieve a list of product categories.
 
     Args:
-        db (Session): The database session.
+        db (AsyncSession): The database session.
         skip (int, optional): Number of records to skip. Defaults to 0.
         limit (int, optional): Maximum number of records to return. Defaults to 100.
+        after_id (int, optional): Keyset pagination: return categories after this id.
 
     Returns:
         List[models.ProductCategory]: A list of product category objects.
     """
-    return db.query(models.ProductCategory).offset(skip).limit(limit).all()
+    stmt = paginate(select(models.ProductCategory), models.ProductCategory, skip, limit, after_id)
+    return (await db.scalars(stmt)).all()
+
+
+async def create_product_categories(db: AsyncSession, categories: List[schemas.ProductCategoryCreate]):
+    """
+    Create product categories with a single INSERT.
+
+    Args:
+        db (AsyncSession): The database session.
+        categories (List[schemas.ProductCategoryCreate]): The categories to create.
 
+    Returns:
+        List[models.ProductCategory]: The created categories, in order.
 
-def create_product_category(db: Session, category: schemas.ProductCategoryCreate):
+    Raises:
+        DuplicateRow: If a category name is taken; nothing is created.
+    """
+    rows = [{"name": category.name} for category in categories]
+    ids = await _insert(db, models.ProductCategory.__table__, rows, DuplicateRow())
+    await db.commit()
+    return [models.ProductCategory(id=id_, **row) for id_, row in zip(ids, rows)]
+
+
+async def create_product_category(db: AsyncSession, category: schemas.ProductCategoryCreate):
     """
     Create a new product category.
 
     Args:
-        db (Session): The database session.
+        db (AsyncSession): The database session.
         category (schemas.ProductCategoryCreate): The product category data to create.
 
     Returns:
         models.ProductCategory: The created product category object.
+
+    Raises:
+        DuplicateRow: If the name is taken.
     """
-    db_category = models.ProductCategory(name=category.name)
-    db.add(db_category)
-    db.commit()
-    db.refresh(db_category)
-    return db_category
+    return (await create_product_categories(db, [category]))[0]
 
 
-def get_product(db: Session, product_id: int):
+async def get_product(db: AsyncSession, product_id: int):
     """
     Retrieve a product by its ID.
 
     Args:
-        db (Session): The database session.
+        db (AsyncSession): The database session.
         product_id (int): The ID of the product to retrieve.
 
     Returns:
         models.Product: The product object if found, else None.
     """
-    return db.query(models.Product).filter(models.Product.id == product_id).first()
+    return await db.scalar(
+        select(models.Product).options(*PRODUCT_LOAD_OPTIONS).where(models.Product.id == product_id)
+    )
 
 
-def get_products(db: Session, skip: int = 0, limit: int = 100):
+async def get_products(db: AsyncSession, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
     """
-    Retrieve a list of products.
+    Retrieve a list of products with their categories.
 
     Args:
-        db (Session): The database session.
+        db (AsyncSession): The database session.
         skip (int, optional): Number of records to skip. Defaults to 0.
         limit (int, optional): Maximum number of records to return. Defaults to 100.
+        after_id (int, optional): Keyset pagination: return products after this id.
 
     Returns:
         List[models.Product]: A list of product objects.
     """
-    return db.query(models.Product).offset(skip).limit(limit).all()
+    stmt = select(models.Product).options(*PRODUCT_LOAD_OPTIONS)
+    return (await db.scalars(paginate(stmt, models.Product, skip, limit, after_id))).all()
+
+
+async def create_products(db: AsyncSession, products: List[schemas.ProductCreate]):
+    """
+    Create products with a single INSERT.
+
+    Args:
+        db (AsyncSession): The database session.
+        products (List[schemas.ProductCreate]): The products to create.
+
+    Returns:
+        List[models.Product]: The created products with their categories, in order.
+
+    Raises:
+        MissingReference: If a category does not exist; nothing is created.
+    """
+    rows = [product.dict() for product in products]
+    ids = await _insert(db, models.Product.__table__, rows, MissingReference("product_categories"))
+    await db.commit()
+    # Load the categories for the response.
+    return await _get_many(db, models.Product, ids, PRODUCT_LOAD_OPTIONS)
 
 
-def create_product(db: Session, product: schemas.ProductCreate):
+async def create_product(db: AsyncSession, product: schemas.ProductCreate):
     """
     Create a new product.
 
     Args:
-        db (Session): The database session.
+        db (AsyncSession): The database session.
         product (schemas.ProductCreate): The product data to create.
 
     Returns:
         models.Product: The created product object.
+
+    Raises:
+        MissingReference: If the category does not exist.
     """
-    db_product = models.Product(**product.dict())
-    db.add(db_product)
-    db.commit()
-    db.refresh(db_product)
-    return db_product
+    return (await create_products(db, [product]))[0]
 
 
-def get_user(db: Session, user_id: int):
+async def get_user(db: AsyncSession, user_id: int):
     """
     Retrieve a user by their ID.
 
     Args:
-        db (Session): The database session.
+        db (AsyncSession): The database session.
         user_id (int): The ID of the user to retrieve.
 
     Returns:
         models.User: The user object if found, else None.
     """
-    return db.query(models.User).filter(models.User.id == user_id).first()
+    return await db.scalar(
+        select(models.User).options(*USER_LOAD_OPTIONS).where(models.User.id == user_id)
+    )
 
 
-def get_user_by_email(db: Session, email: str):
+async def get_user_by_email(db: AsyncSession, email: str):
     """
     Retrieve a user by their email address.
 
     Args:
-        db (Session): The database session.
+        db (AsyncSession): The database session.
         email (str): The email address of the user to retrieve.
 
     Returns:
         models.User: The user object if found, else None.
     """
-    return db.query(models.User).filter(models.User.email == email).first()
+    return await db.scalar(select(models.User).where(models.User.email == email).limit(1))
 
 
-def get_users(db: Session, skip: int = 0, limit: int = 100):
+async def get_users(db: AsyncSession, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
     """
-    Retrieve a list of users with pagination.
+    Retrieve a list of users with pagination, including their orders and items.
 
     Args:
-        db (Session): The database session.
+        db (AsyncSession): The database session.
         skip (int, optional): The number of users to skip. Defaults to 0.
         limit (int, optional): The maximum number of users to return. Defaults to 100.
+        after_id (int, optional): Keyset pagination: return users after this id.
 
     Returns:
         List[models.User]: A list of user objects.
     """
-    return db.query(models.User).offset(skip).limit(limit).all()
+    stmt = select(models.User).options(*USER_LOAD_OPTIONS)
+    return (await db.scalars(paginate(stmt, models.User, skip, limit, after_id))).all()
 
 
-def create_user(db: Session, user: schemas.UserCreate):
+async def create_users(db: AsyncSession, users: List[schemas.UserCreate]):
+    """
+    Create users with a single INSERT.
+
+    Args:
+        db (AsyncSession): The database session.
+        users (List[schemas.UserCreate]): The users to create.
+
+    Returns:
+        List[models.User]: The created users, in order.
+
+    Raises:
+        DuplicateRow: If an email is already registered; nothing is created.
+    """
+    created_at = datetime.utcnow()
+    rows = [{"email": user.email, "is_active": True, "created_at": created_at} for user in users]
+    ids = await _insert(db, models.User.__table__, rows, DuplicateRow())
+    await db.commit()
+    return [models.User(id=id_, orders=[], **row) for id_, row in zip(ids, rows)]
+
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate):
     """
     Create a new user in the database.
 
+    The unique email constraint rejects duplicates, so there is no lookup
+    beforehand and no window for a concurrent insert of the same email.
+
     Args:
-        db (Session): The database session.
+        db (AsyncSession): The database session.
         user (schemas.UserCreate): The user data to create.
 
     Returns:
         models.User: The created user object.
 
+    Raises:
+        DuplicateRow: If the email is already registered.
     """
-    db_user = models.User(
-        email=user.email, is_active=True, created_at=datetime.utcnow()
-    )
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
+    return (await create_users(db, [user]))[0]
+
+
+async def get_orders(db: AsyncSession, user_id: int):
+    """
+    Retrieve the orders of a user.
+
+    Args:
+        db (AsyncSession): The database session.
+        user_id (int): The ID of the user whose orders to retrieve.
+
+    Returns:
+        List[models.Order]: The user's orders.
+    """
+    stmt = select(models.Order).options(*ORDER_LOAD_OPTIONS).where(models.Order.user_id == user_id)
+    return (await db.scalars(stmt)).all()
+
+
+async def create_orders(db: AsyncSession, orders: List[schemas.OrderBulkCreate]):
+    """
+    Create orders for any users with one INSERT for the orders and one for their items.
+
+    Args:
+        db (AsyncSession): The database session.
+        orders (List[schemas.OrderBulkCreate]): The orders, including their items.
+
+    Returns:
+        List[models.Order]: The created orders with their items, in order.
+
+    Raises:
+        MissingReference: If a user or product does not exist; nothing is created.
+    """
+    rows = [
+        {"user_id": order.user_id, "total_amount": order.total_amount, "status": order.status}
+        for order in orders
+    ]
+    ids = await _insert(db, models.Order.__table__, rows, MissingReference("users"))
+    item_rows = [
+        dict(item.dict(), order_id=order_id)
+        for order_id, order in zip(ids, orders)
+        for item in order.order_items
+    ]
+    await _insert(db, models.OrderItem.__table__, item_rows, MissingReference("products"))
+    await db.commit()
+    # Load the items' products and categories for the response.
+    return await _get_many(db, models.Order, ids, ORDER_LOAD_OPTIONS)
+
+
+async def create_order(db: AsyncSession, user_id: int, order: schemas.OrderCreate):
+    """
+    Create an order and its items for a user.
+
+    Args:
+        db (AsyncSession): The database session.
+        user_id (int): The ID of the user placing the order.
+        order (schemas.OrderCreate): The order data, including its items.
+
+    Returns:
+        models.Order: The created order object.
+
+    Raises:
+        MissingReference: If the user or a product does not exist.
+    """
+    return (await create_orders(db, [schemas.OrderBulkCreate(user_id=user_id, **order.dict())]))[0]
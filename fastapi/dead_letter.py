@@ -0,0 +1,170 @@
+import base64
+import json
+import logging
+import threading
+from datetime import datetime, timezone
+from sqlalchemy import (
+    JSON,
+    BigInteger,
+    Column,
+    DateTime,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    Text,
+    insert,
+)
+
+logger = logging.getLogger(__name__)
+
+# Kept out of Base.metadata so the table is neither created in MySQL nor
+# picked up as a replicated table.
+metadata = MetaData()
+
+dead_letters = Table(
+    "cdc_dead_letters",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("topic", String(255)),
+    Column("partition", Integer),
+    Column("offset", BigInteger),
+    Column("table_name", String(255)),
+    Column("op", String(1)),
+    Column("row", JSON),
+    Column("value", Text),
+    Column("error", Text),
+    Column("failed_at", DateTime),
+)
+
+
+def _raw_value(value):
+    if value is None:
+        return None
+    try:
+        return value.decode("utf-8")
+    except UnicodeDecodeError:
+        return "base64:" + base64.b64encode(value).decode("ascii")
+
+
+def _json_value(value):
+    if isinstance(value, bytes):
+        return _raw_value(value)
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+def dead_letter(error, position=None, event=None, value=None):
+    """
+    Build a dead-letter record for an event or message that could not be applied.
+
+    Args:
+        error (Exception | str): Why the event was rejected.
+        position (Tuple[str, int, int], optional): (topic, partition, offset) of
+            the source message. Defaults to the event's position.
+        event (ChangeEvent, optional): The decoded event, if decoding succeeded.
+        value (bytes, optional): The raw message value, for decode failures.
+
+    Returns:
+        dict: The record, with the same keys as the `cdc_dead_letters` columns.
+    """
+    if position is None and event is not None:
+        position = event.position
+    topic, partition, offset = position or (None, None, None)
+    row = None
+    if event is not None and event.row is not None:
+        # Decoded rows can hold Decimal, bytes or datetime values, which the
+        # JSON column cannot store as they are.
+        row = json.loads(json.dumps(event.row, default=_json_value))
+    return {
+        "topic": topic,
+        "partition": partition,
+        "offset": offset,
+        "table_name": event.table if event is not None else None,
+        "op": event.op if event is not None else None,
+        "row": row,
+        "value": _raw_value(value),
+        "error": f"{type(error).__name__}: {error}" if isinstance(error, Exception) else str(error),
+        "failed_at": datetime.now(timezone.utc),
+    }
+
+
+class JsonlDeadLetterSink:
+    """
+    Append dead-letter records to a local JSON Lines file.
+
+    The file is not part of the batch's transaction, so records are written
+    only once the batch has committed; a batch retried after a failed commit
+    does not write them twice.
+
+    Args:
+        path (str): The file to append to.
+    """
+
+    transactional = False
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, db, records):
+        if not records:
+            return
+        with self._lock, open(self.path, "a") as f:
+            for record in records:
+                f.write(json.dumps(record, default=str) + "\n")
+
+
+class PostgresDeadLetterSink:
+    """
+    Insert dead-letter records into the `cdc_dead_letters` table.
+
+    Records are written on the batch's own session, so they are committed
+    together with the rows that were applied.
+
+    Args:
+        engine (Engine): The PostgreSQL engine, used to create the table.
+    """
+
+    transactional = True
+
+    def __init__(self, engine):
+        metadata.create_all(bind=engine)
+
+    def write(self, db, records):
+        if records:
+            db.execute(insert(dead_letters), records)
+
+
+class LoggingDeadLetterSink:
+    """
+    Only log dead-letter records, matching the behavior before sinks existed.
+    """
+
+    transactional = False
+
+    def write(self, db, records):
+        for record in records:
+            logger.error(f"Dropped event: {record}")
+
+
+def get_dead_letter_sink(kind, path=None, engine=None):
+    """
+    Return the dead-letter sink for a configuration value.
+
+    Args:
+        kind (str): `jsonl`, `postgres` or `log`.
+        path (str, optional): The file for `jsonl`.
+        engine (Engine, optional): The PostgreSQL engine for `postgres`.
+
+    Raises:
+        ValueError: If the kind is unknown.
+    """
+    if kind == "jsonl":
+        return JsonlDeadLetterSink(path)
+    if kind == "postgres":
+        return PostgresDeadLetterSink(engine)
+    if kind == "log":
+        return LoggingDeadLetterSink()
+    raise ValueError(f"Unknown dead letter sink: {kind}")
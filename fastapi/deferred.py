@@ -0,0 +1,348 @@
+import logging
+import time
+from collections import OrderedDict, defaultdict
+from sqlalchemy import any_, bindparam, select
+from sqlalchemy.dialects.postgresql import ARRAY
+from bulk_apply import appliers, TABLE_ORDER, UPSERT_OPS
+
+logger = logging.getLogger(__name__)
+
+# (child column, parent table) pairs for every ForeignKey, per child table.
+FOREIGN_KEYS = {
+    name: [(fk.parent.name, fk.column.table.name) for fk in applier.table.foreign_keys]
+    for name, applier in appliers.items()
+}
+
+_EXISTS_STMTS = {
+    name: select(applier.pk).where(
+        applier.pk == any_(bindparam("ids", type_=ARRAY(applier.pk.type)))
+    )
+    for name, applier in appliers.items()
+}
+
+
+def _key(table, row):
+    return table, row[appliers[table].pk.name]
+
+
+def existing_keys(db, table, ids):
+    """
+    Return the subset of `ids` that already exist in the PostgreSQL `table`.
+    """
+    if not ids:
+        return set()
+    return set(db.execute(_EXISTS_STMTS[table], {"ids": list(ids)}).scalars())
+
+
+class DeferredBuffer:
+    """
+    Hold child upserts whose ForeignKey parent has not been replicated yet.
+
+    Each table is a separate topic, so a child row can arrive one or more
+    batches before its parent. Instead of failing the batch, such rows are
+    parked here, indexed by the missing parent key, and handed back to the
+    apply stage as soon as that parent is upserted. Parents applied outside
+    this buffer's stream (e.g. by another worker) are picked up by checking
+    the waiting parent keys against PostgreSQL every `recheck_interval`.
+
+    Deletes of parent rows that failed because child rows still reference
+    them wait the same way, for their children's deletes or updates, and are
+    retried when a batch touches a referencing table or on the periodic
+    recheck.
+
+    Only the latest image of each child row is kept, and any newer event for
+    a waiting row supersedes it. The buffer lives in memory: rows that wait
+    longer than `max_age` seconds, or are evicted once `max_size` rows are
+    waiting, are logged and handed out by `take_dropped`. Like a session, the
+    buffer must be told whether the batch it resolved was committed or rolled
+    back: a rollback parks the rows it released or dropped again, as their
+    dead letters were not written either.
+    """
+
+    def __init__(self, max_size=10000, max_age=600, recheck_interval=5):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.recheck_interval = recheck_interval
+        self._entries = OrderedDict()
+        self._by_parent = defaultdict(set)
+        self._deletes = defaultdict(set)
+        self._last_recheck = time.monotonic()
+        self._released = []
+        self._dropped = []
+        self._dropped_events = []
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """
+        Return the current depth and age of the buffer.
+
+        Returns:
+            dict: `depth`, `oldest_age_seconds` and the total `dropped` count.
+        """
+        oldest = 0.0
+        if self._entries:
+            _, _, deferred_at = next(iter(self._entries.values()))
+            oldest = time.monotonic() - deferred_at
+        return {"depth": len(self._entries), "oldest_age_seconds": oldest, "dropped": self.dropped}
+
+    def due(self):
+        """
+        Return True when waiting rows are due to be rechecked or expired, so
+        `resolve` has work to do even for an empty batch.
+        """
+        if not self._entries:
+            return False
+        now = time.monotonic()
+        if now - self._last_recheck >= self.recheck_interval:
+            return True
+        _, _, deferred_at = next(iter(self._entries.values()))
+        return deferred_at <= now - self.max_age
+
+    def held_offsets(self):
+        """
+        Return the lowest Kafka offset of a waiting row per partition, which
+        the consumer must not store as consumed while the row is in memory.
+
+        Returns:
+            Dict[Tuple[str, int], int]: Offsets per (topic, partition).
+        """
+        held = {}
+        for event, _, _ in self._entries.values():
+            if event.position is None:
+                continue
+            topic, partition, offset = event.position
+            key = (topic, partition)
+            if offset < held.get(key, offset + 1):
+                held[key] = offset
+        return held
+
+    def _waiting(self, child_key, parent_key):
+        # Deletes wait per table, rows with a missing parent per parent row.
+        if parent_key is None:
+            return self._deletes, child_key[0]
+        return self._by_parent, parent_key
+
+    def _park(self, child_key, entry):
+        _, parent_key, _ = entry
+        self._entries[child_key] = entry
+        waiting, group = self._waiting(child_key, parent_key)
+        waiting[group].add(child_key)
+
+    def _remove(self, child_key):
+        entry = self._entries.pop(child_key, None)
+        if entry is not None:
+            _, parent_key, _ = entry
+            waiting, group = self._waiting(child_key, parent_key)
+            waiting[group].discard(child_key)
+            if not waiting[group]:
+                del waiting[group]
+        return entry
+
+    def _drop(self, child_key, reason):
+        entry = self._remove(child_key)
+        self._dropped.append((child_key, entry))
+        event, parent_key, _ = entry
+        self.dropped += 1
+        waiting_for = "rows referencing it" if parent_key is None else f"{parent_key[0]} {parent_key[1]}"
+        logger.error(f"Dropping deferred {event.table} {event.op} of row {child_key[1]} waiting for {waiting_for}: {reason}")
+        self._dropped_events.append((event, f"{reason} (waiting for {waiting_for})"))
+
+    def _defer(self, child_key, event, parent_key, deferred_at=None):
+        self._remove(child_key)
+        self._park(child_key, (event, parent_key, deferred_at or time.monotonic()))
+        while len(self._entries) > self.max_size:
+            self._drop(next(iter(self._entries)), "deferred buffer full")
+
+    def _expire(self):
+        deadline = time.monotonic() - self.max_age
+        while self._entries:
+            child_key, (_, parent_key, deferred_at) = next(iter(self._entries.items()))
+            if deferred_at > deadline:
+                break
+            if parent_key is None:
+                self._drop(child_key, f"still referenced after {self.max_age}s")
+            else:
+                self._drop(child_key, f"parent not seen within {self.max_age}s")
+
+    def _release(self, parent_keys):
+        released = []
+        pending = list(parent_keys)
+        while pending:
+            parent_key = pending.pop()
+            for child_key in list(self._by_parent.get(parent_key, ())):
+                entry = self._remove(child_key)
+                self._released.append((child_key, entry))
+                released.append(entry[0])
+                # A released child may itself be the parent others wait on.
+                pending.append(child_key)
+        return released
+
+    def defer_delete(self, event):
+        """
+        Park a delete that failed because child rows still reference the row.
+
+        A delete that was released and failed again keeps its original
+        deferral time, so it still expires after `max_age`.
+
+        Args:
+            event (ChangeEvent): The rejected delete.
+        """
+        deferred_at = None
+        for _, (released, _, released_at) in self._released:
+            if released is event:
+                deferred_at = released_at
+        child_key = _key(event.table, event.row)
+        logger.info(f"Deferred delete of {event.table} row {child_key[1]} still referenced by child rows")
+        self._defer(child_key, event, None, deferred_at)
+
+    def _release_deletes(self, tables=None):
+        released = []
+        for table in list(self._deletes if tables is None else tables):
+            for child_key in list(self._deletes.get(table, ())):
+                entry = self._remove(child_key)
+                self._released.append((child_key, entry))
+                released.append(entry[0])
+        return released
+
+    def _recheck(self, db):
+        waiting = defaultdict(set)
+        for table, parent_id in self._by_parent:
+            waiting[table].add(parent_id)
+        found = []
+        for table, ids in waiting.items():
+            found.extend((table, parent_id) for parent_id in existing_keys(db, table, ids))
+        return self._release(found)
+
+    def forget(self, partitions):
+        """
+        Drop the waiting rows read from revoked partitions. Their offsets
+        were never committed, so the partitions' new owner reads them again.
+
+        Args:
+            partitions (Iterable[TopicPartition]): The revoked partitions.
+        """
+        revoked = {(tp.topic, tp.partition) for tp in partitions}
+        forgotten = [
+            child_key for child_key, (event, _, _) in self._entries.items()
+            if event.position is not None and event.position[:2] in revoked
+        ]
+        for child_key in forgotten:
+            self._remove(child_key)
+        if forgotten:
+            logger.info(f"Forgot {len(forgotten)} deferred rows from revoked partitions")
+
+    def take_dropped(self):
+        """
+        Return and forget the rows dropped since the last call.
+
+        Returns:
+            List[Tuple[ChangeEvent, str]]: Each dropped event with the reason.
+        """
+        dropped, self._dropped_events = self._dropped_events, []
+        return dropped
+
+    def commit(self):
+        """
+        Forget the rows released or dropped by `resolve` once their batch has
+        committed.
+        """
+        self._released = []
+        self._dropped = []
+
+    def rollback(self):
+        """
+        Park the rows released or dropped by `resolve` again after their
+        batch failed, so a retry of the batch releases or drops them once
+        more, and their offsets stay held until then.
+        """
+        for child_key, entry in self._released + self._dropped:
+            if child_key not in self._entries:
+                self._park(child_key, entry)
+        # Keep the oldest rows first, as `_expire` relies on it.
+        self._entries = OrderedDict(sorted(self._entries.items(), key=lambda item: item[1][2]))
+        self.dropped -= len(self._dropped)
+        self._released = []
+        self._dropped = []
+        self._dropped_events = []
+
+    def resolve(self, db, events):
+        """
+        Merge released rows into a batch and defer rows with missing parents.
+
+        Args:
+            db (Session | Connection): The PostgreSQL session or connection.
+            events (List[ChangeEvent]): Events with at most one event per row,
+                as produced by `coalesce_events`.
+
+        Returns:
+            List[ChangeEvent]: The events that can be applied now.
+        """
+        self._expire()
+
+        for event in events:
+            if event.table in appliers and event.row is not None:
+                self._remove(_key(event.table, event.row))
+
+        upserted = [
+            _key(event.table, event.row) for event in events
+            if event.table in appliers and event.op in UPSERT_OPS
+        ]
+        released = self._release(upserted)
+        # A child row deleted or moved to another parent may unblock the
+        # delete of its old parent.
+        referenced = {
+            parent for event in events if event.table in appliers
+            for _, parent in FOREIGN_KEYS.get(event.table, ())
+        }
+        released.extend(self._release_deletes(referenced & self._deletes.keys()))
+        if self._entries and time.monotonic() - self._last_recheck >= self.recheck_interval:
+            self._last_recheck = time.monotonic()
+            released.extend(self._recheck(db))
+            released.extend(self._release_deletes())
+        if released:
+            logger.info(f"Released {len(released)} deferred rows to retry")
+        events = released + events
+
+        candidates = [
+            (index, event) for index, event in enumerate(events)
+            if event.table in appliers and event.op in UPSERT_OPS and FOREIGN_KEYS.get(event.table)
+        ]
+        if not candidates:
+            return events
+
+        in_batch = {
+            _key(event.table, event.row) for event in events
+            if event.table in appliers and event.op in UPSERT_OPS
+        }
+        lookups = defaultdict(set)
+        for _, event in candidates:
+            for column, parent in FOREIGN_KEYS[event.table]:
+                parent_id = event.row.get(column)
+                if parent_id is not None and (parent, parent_id) not in in_batch:
+                    lookups[parent].add(parent_id)
+        known = set()
+        for parent, ids in lookups.items():
+            known.update((parent, parent_id) for parent_id in existing_keys(db, parent, ids))
+
+        # Parents are checked before children, so a deferred parent also
+        # defers the children that were counting on it in this batch.
+        deferred = set()
+        candidates.sort(key=lambda item: TABLE_ORDER.index(item[1].table))
+        for index, event in candidates:
+            for column, parent in FOREIGN_KEYS[event.table]:
+                parent_id = event.row.get(column)
+                parent_key = (parent, parent_id)
+                if parent_id is None or parent_key in known or parent_key in in_batch:
+                    continue
+                child_key = _key(event.table, event.row)
+                self._defer(child_key, event, parent_key)
+                in_batch.discard(child_key)
+                deferred.add(index)
+                break
+
+        if deferred:
+            logger.info(f"Deferred {len(deferred)} rows waiting for their parent rows")
+        return [event for index, event in enumerate(events) if index not in deferred]
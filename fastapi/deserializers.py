@@ -0,0 +1,132 @@
+import io
+import json
+import os
+import struct
+
+try:
+    import orjson
+
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+try:
+    import fastavro
+except ImportError:
+    fastavro = None
+
+AVRO_MAGIC_BYTE = 0
+
+
+def json_payload(value):
+    """
+    Decode a Debezium JSON message into its payload.
+
+    Works with both converter settings: with `schemas.enable=true` the value is
+    a `{"schema": ..., "payload": ...}` envelope, and with `schemas.enable=false`
+    the value is the payload itself.
+
+    Args:
+        value (bytes): The raw Kafka message value.
+
+    Returns:
+        dict: The Debezium payload, or None for tombstones.
+    """
+    if value is None:
+        return None
+    data = json_loads(value)
+    if "payload" in data:
+        return data["payload"]
+    return data
+
+
+def json_envelope(value):
+    """
+    Decode a Debezium JSON message into its `schema` block and payload.
+
+    Args:
+        value (bytes): The raw Kafka message value.
+
+    Returns:
+        Tuple[dict, dict]: The schema, or None for schemaless messages, and
+            the payload, or None for tombstones.
+    """
+    if value is None:
+        return None, None
+    data = json_loads(value)
+    if "payload" in data:
+        return data.get("schema"), data["payload"]
+    return None, data
+
+
+class FileSchemaRegistry:
+    """
+    A local stand-in for a schema registry that serves Avro schemas from disk.
+
+    Schemas are read from `<directory>/<schema id>.avsc` on first use and
+    cached by id, so each schema is parsed once per process.
+
+    Args:
+        directory (str): The directory holding the `.avsc` files.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._schemas = {}
+
+    def get(self, schema_id):
+        schema = self._schemas.get(schema_id)
+        if schema is None:
+            path = os.path.join(self.directory, f"{schema_id}.avsc")
+            with open(path) as f:
+                schema = fastavro.parse_schema(json.load(f))
+            self._schemas[schema_id] = schema
+        return schema
+
+
+class AvroDeserializer:
+    """
+    Decode Avro messages in the Confluent wire format.
+
+    Each value is a zero magic byte, a big-endian 4-byte schema id and the
+    Avro binary encoding of the Debezium envelope record, which is the
+    payload itself.
+
+    Args:
+        registry (FileSchemaRegistry): Where to look up writer schemas.
+    """
+
+    def __init__(self, registry):
+        if fastavro is None:
+            raise RuntimeError("MESSAGE_FORMAT=avro requires the fastavro package")
+        self.registry = registry
+
+    def __call__(self, value):
+        if value is None:
+            return None
+        magic, schema_id = struct.unpack(">bI", value[:5])
+        if magic != AVRO_MAGIC_BYTE:
+            raise ValueError(f"Unknown Avro magic byte: {magic}")
+        schema = self.registry.get(schema_id)
+        return fastavro.schemaless_reader(io.BytesIO(value[5:]), schema)
+
+
+def get_deserializer(message_format, schema_dir=None):
+    """
+    Return the payload deserializer for a message format.
+
+    Args:
+        message_format (str): `json` (enveloped or schemaless) or `avro`.
+        schema_dir (str, optional): Directory of `.avsc` files for `avro`.
+
+    Returns:
+        Callable[[bytes], dict]: Turns a raw message value into a payload.
+
+    Raises:
+        ValueError: If the format is unknown.
+    """
+    if message_format == "json":
+        return json_payload
+    if message_format == "avro":
+        return AvroDeserializer(FileSchemaRegistry(schema_dir))
+    raise ValueError(f"Unknown message format: {message_format}")
@@ -0,0 +1,115 @@
+import logging
+import threading
+from sqlalchemy import Column, MetaData, Table, inspect, text
+from sqlalchemy.sql.sqltypes import to_instance
+from bulk_apply import TableApplier, register_applier
+from converters import field_type, schema_row_converter
+from deserializers import json_payload
+
+logger = logging.getLogger(__name__)
+
+# pg_advisory_xact_lock key that serializes schema changes across consumers.
+DDL_LOCK_KEY = 0x43444344
+
+
+class DynamicTables:
+    """
+    Replicate any table from the `schema` block of its Debezium envelopes.
+
+    Each table's layout is derived once per SchemaVersion, so a message of a
+    known version costs a set lookup. For a new version the PostgreSQL table
+    is created, or altered to add the new columns, and the table's
+    TableApplier is rebuilt and registered with `bulk_apply`, so the batch
+    pipeline applies its rows like any other.
+
+    The layout is the union of every version seen, so messages of an older
+    version arriving after a newer one do not drop columns. Columns are
+    never dropped or retyped in PostgreSQL; a MySQL type change keeps the
+    existing column. Each row is decoded by the converter of its own schema
+    version, see `TableApplier.converter`. The primary key is taken from an
+    existing table, or from the fields of the message key; tables without a
+    single-column key are not replicated.
+
+    Args:
+        engine (Engine): The PostgreSQL engine, used for schema changes.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._versions = {}
+        self._fields = {}
+        self._skipped = set()
+        self._lock = threading.Lock()
+
+    def prepare(self, table, schema, key):
+        """
+        Make sure `table` can take rows of a schema version.
+
+        Args:
+            table (str): The source table name.
+            schema (SchemaVersion): The message's schema version, or None for
+                schemaless messages, which keep the current layout.
+            key (bytes): The raw Kafka message key, read for new versions only.
+        """
+        if schema is None or table in self._skipped or schema in self._versions.get(table, ()):
+            return
+        with self._lock:
+            if schema in self._versions.get(table, ()):
+                return
+            self._add_version(table, schema, key)
+
+    def _add_version(self, name, schema, key):
+        merged = dict(self._fields.get(name, {}))
+        for field in schema.fields:
+            merged[field["field"]] = field
+        key_columns = list(json_payload(key) or {}) if key is not None else []
+        table = self._sync(name, merged, key_columns)
+        if table is None:
+            self._skipped.add(name)
+            return
+        register_applier(TableApplier(table, schema_row_converter(table, list(merged.values()))))
+        self._fields[name] = merged
+        self._versions[name] = self._versions.get(name, frozenset()) | {schema}
+
+    def _sync(self, name, fields, key_columns):
+        """
+        Create or alter the PostgreSQL table to hold every field, and return
+        a Table with those columns for the applier.
+        """
+        with self.engine.begin() as conn:
+            conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": DDL_LOCK_KEY})
+            inspector = inspect(conn)
+            if inspector.has_table(name):
+                existing = {column["name"]: column["type"] for column in inspector.get_columns(name)}
+                key_columns = inspector.get_pk_constraint(name)["constrained_columns"]
+            else:
+                existing = None
+            if len(key_columns) != 1 or key_columns[0] not in fields:
+                logger.warning(f"Not replicating {name}: it needs a single-column primary key")
+                return None
+
+            columns = []
+            added = []
+            for column_name, field in fields.items():
+                if existing is not None and column_name in existing:
+                    type_ = existing[column_name]
+                else:
+                    type_ = to_instance(field_type(field)[0])
+                    added.append((column_name, type_))
+                is_key = column_name == key_columns[0]
+                columns.append(Column(column_name, type_, primary_key=is_key, autoincrement=False))
+            table = Table(name, MetaData(), *columns)
+
+            if existing is None:
+                table.create(conn)
+                logger.info(f"Created table {name} with {len(columns)} columns from its Debezium schema")
+            else:
+                quote = conn.dialect.identifier_preparer.quote
+                for column_name, type_ in added:
+                    conn.execute(text(
+                        f"ALTER TABLE {quote(name)} ADD COLUMN IF NOT EXISTS "
+                        f"{quote(column_name)} {type_.compile(dialect=conn.dialect)}"
+                    ))
+                if added:
+                    logger.info(f"Added columns {', '.join(c for c, _ in added)} to {name}")
+        return table
@@ -0,0 +1,122 @@
+import logging
+import time
+from sqlalchemy import BigInteger, Column, MetaData, String, Table, func, select
+from sqlalchemy.dialects.postgresql import insert
+
+logger = logging.getLogger(__name__)
+
+# Kept out of Base.metadata so the table is neither created in MySQL nor
+# picked up as a replicated table.
+metadata = MetaData()
+
+freshness = Table(
+    "cdc_freshness",
+    metadata,
+    Column("table_name", String(255), primary_key=True),
+    # Everything MySQL committed to the table up to this time (epoch ms) has
+    # been applied to PostgreSQL; rows still queued or deferred hold it back.
+    Column("source_ts_ms", BigInteger, nullable=False),
+)
+
+_upsert = insert(freshness)
+_upsert = _upsert.on_conflict_do_update(
+    index_elements=[freshness.c.table_name],
+    set_={"source_ts_ms": func.greatest(freshness.c.source_ts_ms, _upsert.excluded.source_ts_ms)},
+)
+
+
+def create_table(engine):
+    metadata.create_all(bind=engine)
+
+
+def record_applied(db, events, unapplied=None):
+    """
+    Advance the per-table watermarks to the newest MySQL commit applied.
+
+    Called inside the batch's transaction, so the watermark never gets ahead
+    of the rows it describes. Events read after an older message that is
+    not yet applied, such as a row another worker has queued or a row parked
+    in a DeferredBuffer, do not count, so the watermark stays a low
+    watermark. Rows are written in table-name order, so concurrent workers
+    always lock them in the same order.
+
+    Args:
+        db (Session): The PostgreSQL session applying the batch.
+        events (Iterable[ChangeEvent]): The events being committed.
+        unapplied (Dict[Tuple[str, int], int], optional): Per (topic,
+            partition), the lowest offset outside the batch that is not
+            applied yet.
+    """
+    unapplied = unapplied or {}
+    latest = {}
+    for event in events:
+        if event.position is not None:
+            topic, partition, offset = event.position
+            if offset >= unapplied.get((topic, partition), offset + 1):
+                continue
+        if event.source_ts_ms and event.source_ts_ms > latest.get(event.table, 0):
+            latest[event.table] = event.source_ts_ms
+    if latest:
+        db.execute(_upsert, [
+            {"table_name": table, "source_ts_ms": latest[table]} for table in sorted(latest)
+        ])
+
+
+def record_caught_up(engine, tables, now_ms=None):
+    """
+    Mark the tables fresh as of now, once the consumer has applied every
+    message in its topics. Without this an idle table would look stale.
+
+    Args:
+        engine (Engine): The PostgreSQL engine.
+        tables (Iterable[str]): The tables of the topics that are caught up.
+        now_ms (int, optional): The time to record, in epoch milliseconds.
+    """
+    now_ms = now_ms or int(time.time() * 1000)
+    with engine.begin() as conn:
+        conn.execute(_upsert, [
+            {"table_name": table, "source_ts_ms": now_ms} for table in sorted(tables)
+        ])
+
+
+class FreshnessCache:
+    """
+    Read the replica's per-table watermarks, refreshed at most every `ttl` seconds.
+
+    Callers arriving while a refresh is in flight use the previous reading
+    instead of waiting for it.
+
+    Args:
+        engine (AsyncEngine): The async PostgreSQL engine.
+        ttl (float): Seconds to reuse a reading.
+    """
+
+    def __init__(self, engine, ttl=0.5):
+        self.engine = engine
+        self.ttl = ttl
+        self._watermarks = {}
+        self._read_at = float("-inf")
+
+    async def watermarks(self):
+        """
+        Return {table: source_ts_ms}; empty if the replica cannot be read.
+        """
+        if time.monotonic() - self._read_at >= self.ttl:
+            self._read_at = time.monotonic()
+            try:
+                async with self.engine.connect() as conn:
+                    self._watermarks = dict((await conn.execute(select(freshness))).all())
+            except Exception as e:
+                logger.warning(f"Could not read replica freshness: {e}")
+                self._watermarks = {}
+        return self._watermarks
+
+    async def fresh_as_of(self, tables):
+        """
+        Return the time (epoch ms) up to which all `tables` are replicated, or None.
+        """
+        watermarks = await self.watermarks()
+        values = [watermarks.get(table) for table in tables]
+        if not values or None in values:
+            return None
+        return min(values)
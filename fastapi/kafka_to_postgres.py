@@ -1,20 +1,126 @@
 from kafka import KafkaConsumer
+from kafka.errors import CommitFailedError
 import json
-from database import get_postgres_db
+import os
+import queue
+import signal
+import threading
+import time
+from functools import partial
+from database import get_postgres_db, PostgresSessionLocal, postgres_engine
 import logging
-from message_processors import processors
+from bulk_apply import (
+    DELETE_OPS,
+    ChangeEvent,
+    appliers,
+    apply_isolated,
+    is_foreign_key_violation,
+    order_events,
+)
+from coalesce import coalesce_events
+from snapshot import SNAPSHOT_OPS, load_snapshot
+from parallel_apply import WorkerPool
+from deferred import DeferredBuffer
+from deserializers import get_deserializer, json_envelope
+from dynamic_tables import DynamicTables
+from converters import schema_versions
+from dead_letter import dead_letter, get_dead_letter_sink
+import consumer_metrics as metrics
+import freshness
+import cache_invalidation
+import offset_store
+from consumer_config import (
+    DYNAMIC_TABLES,
+    KAFKA_BOOTSTRAP_SERVERS,
+    KAFKA_GROUP_ID,
+    KAFKA_TOPIC_PATTERN,
+    KAFKA_TOPICS,
+    METRICS_PORT,
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-KAFKA_BOOTSTRAP_SERVERS = ['kafka:9092']
-KAFKA_TOPICS = [
-    'mysql.fastapi_db.users', 
-    'mysql.fastapi_db.products', 
-    'mysql.fastapi_db.orders', 
-    'mysql.fastapi_db.order_items',
-    'mysql.fastapi_db.product_categories'
-]
+# "json" handles both enveloped and schemaless JSON; "avro" reads the Confluent
+# wire format with schemas served from AVRO_SCHEMA_DIR.
+MESSAGE_FORMAT = os.getenv("MESSAGE_FORMAT", "json")
+AVRO_SCHEMA_DIR = os.getenv("AVRO_SCHEMA_DIR", "/app/avro-schemas")
+
+# "batch" applies up to BATCH_SIZE events per Postgres transaction and commits
+# Kafka offsets afterwards; "parallel" spreads batches over APPLY_WORKERS
+# connections keyed by row; "message" keeps the original one-event-per-commit loop.
+CONSUMER_MODE = os.getenv("CONSUMER_MODE", "batch")
+APPLY_WORKERS = int(os.getenv("APPLY_WORKERS", "4"))
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "500"))
+BATCH_LINGER_MS = int(os.getenv("BATCH_LINGER_MS", "200"))
+# Fold repeated changes to the same row within a batch into their net effect.
+COALESCE_EVENTS = os.getenv("COALESCE_EVENTS", "true").lower() == "true"
+# Park child rows whose ForeignKey parent has not been replicated yet.
+DEFER_ORPHANS = os.getenv("DEFER_ORPHANS", "true").lower() == "true"
+DEFERRED_MAX_SIZE = int(os.getenv("DEFERRED_MAX_SIZE", "10000"))
+DEFERRED_MAX_AGE_S = int(os.getenv("DEFERRED_MAX_AGE_S", "600"))
+# Load Debezium snapshot reads ('r') with COPY, and poll larger batches from
+# the first snapshot record until the one marked `source.snapshot = "last"`.
+# Skipping FK checks needs a superuser.
+SNAPSHOT_COPY = os.getenv("SNAPSHOT_COPY", "true").lower() == "true"
+SNAPSHOT_BATCH_SIZE = int(os.getenv("SNAPSHOT_BATCH_SIZE", "20000"))
+SNAPSHOT_LINGER_MS = int(os.getenv("SNAPSHOT_LINGER_MS", "1000"))
+SNAPSHOT_SKIP_FK_CHECKS = os.getenv("SNAPSHOT_SKIP_FK_CHECKS", "true").lower() == "true"
+# Where events that cannot be applied go: "jsonl", "postgres" or "log".
+DEAD_LETTER_SINK = os.getenv("DEAD_LETTER_SINK", "jsonl")
+DEAD_LETTER_PATH = os.getenv("DEAD_LETTER_PATH", "/app/dead_letters.jsonl")
+RETRY_INTERVAL_S = int(os.getenv("RETRY_INTERVAL_S", "5"))
+# How often an idle, caught-up consumer marks the tables of its assigned
+# partitions fresh for read routing.
+FRESHNESS_HEARTBEAT_S = float(os.getenv("FRESHNESS_HEARTBEAT_S", "1"))
+# Where the consumer resumes from: "postgres" stores offsets in cdc_offsets in
+# the same transaction as the applied rows and seeks to them on assignment
+# (Kafka commits are still made, for monitoring); "kafka" relies on the
+# consumer group's commits alone.
+OFFSET_STORE = os.getenv("OFFSET_STORE", "postgres")
+# Announce applied rows to the API response caches with NOTIFY.
+CACHE_INVALIDATION = os.getenv("CACHE_INVALIDATION", "true").lower() == "true"
+
+deserialize = get_deserializer(MESSAGE_FORMAT, AVRO_SCHEMA_DIR)
+dead_letter_sink = get_dead_letter_sink(DEAD_LETTER_SINK, DEAD_LETTER_PATH, postgres_engine)
+# Set while Debezium's initial snapshot is being consumed; switches polling to
+# snapshot batches. Only the polling thread updates it, from the markers that
+# apply_batch puts on `snapshot_markers`, wherever that runs.
+snapshot_in_progress = threading.Event()
+snapshot_markers = queue.SimpleQueue()
+# Offsets consumed and stored by the batch and message loops.
+offset_ledger = offset_store.OffsetLedger()
+dynamic_tables = DynamicTables(postgres_engine) if DYNAMIC_TABLES else None
+
+
+def parse_message(message):
+    """
+    Decode a Kafka message into its Debezium payload and schema version.
+
+    JSON messages that carry a `schema` block get the SchemaVersion of their
+    row schema, whose precompiled converter decodes Debezium's logical types.
+    With DYNAMIC_TABLES enabled, the message's table is also created or
+    altered in PostgreSQL when its schema version has not been seen yet.
+
+    Args:
+        message (KafkaMessage): The Kafka message to decode.
+
+    Returns:
+        Tuple[dict, SchemaVersion]: The envelope payload, or None for
+            tombstones, and the schema version, or None if the message has
+            no schema.
+    """
+    if MESSAGE_FORMAT != "json":
+        return deserialize(message.value), None
+    schema, payload = json_envelope(message.value)
+    if payload is None:
+        return None, None
+    table = payload['source']['table']
+    version = schema_versions.get(table, schema)
+    if dynamic_tables is not None:
+        dynamic_tables.prepare(table, version, message.key)
+    return payload, version
+
 
 def process_message(message):
     """
@@ -34,25 +140,37 @@ def process_message(message):
         Exception: For any other processing errors.
     """
     try:
-        data = json.loads(message.value)
-        logger.info(f"Parsed JSON data: {json.dumps(data, indent=2)}")
+        payload, version = parse_message(message)
+        if payload is None:
+            return
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Parsed payload: {json.dumps(payload, indent=2, default=str)}")
 
-        payload = data['payload']
         table = payload['source']['table']
         operation = payload['op']
 
-        if table not in processors:
+        applier = appliers.get(table)
+        if applier is None:
             logger.warning(f"No processor found for table: {table}")
             return
 
+        metrics.CONVERT_SECONDS.reset()
         db = next(get_postgres_db())
         try:
-            if operation in ('c', 'u'):
-                processors[table](db, operation, payload['after'])
+            if operation in ('c', 'u', 'r'):
+                applier.process(db, operation, payload['after'], version)
             elif operation == 'd':
-                processors[table](db, operation, payload['before'])
-            
+                applier.process(db, operation, payload['before'], version)
+
+            if CACHE_INVALIDATION:
+                cache_invalidation.notify(db, cache_invalidation.event_tags([event_from_payload(payload)]))
+            offsets = {}
+            if OFFSET_STORE == "postgres":
+                offsets = offset_ledger.pending([message])
+                offset_store.record(db, KAFKA_GROUP_ID, offsets)
             db.commit()
+            offset_ledger.committed(offsets)
+            metrics.CONVERT_SECONDS.observe()
             logger.info(f"Processed {operation} operation for table {table}")
         except Exception as e:
             logger.error(f"Error processing {operation} for table {table}: {e}")
@@ -65,19 +183,504 @@ def process_message(message):
     except Exception as e:
         logger.error(f"Error processing message: {e}")
 
+
+def poll_batch(consumer, batch_size=BATCH_SIZE, linger_ms=BATCH_LINGER_MS):
+    """
+    Collect up to `batch_size` messages, waiting at most `linger_ms`.
+
+    `KafkaConsumer.poll` returns as soon as any records are buffered, so it is
+    called repeatedly until the batch is full or the linger window expires.
+
+    Args:
+        consumer (KafkaConsumer): The consumer to poll.
+        batch_size (int): Maximum number of messages in the batch.
+        linger_ms (int): Maximum time to wait for the batch to fill.
+
+    Returns:
+        List[KafkaMessage]: The polled messages, in partition order.
+    """
+    messages = []
+    deadline = time.monotonic() + linger_ms / 1000
+    while len(messages) < batch_size:
+        remaining_ms = int((deadline - time.monotonic()) * 1000)
+        if remaining_ms <= 0:
+            break
+        records = consumer.poll(
+            timeout_ms=remaining_ms, max_records=batch_size - len(messages)
+        )
+        for partition_messages in records.values():
+            messages.extend(partition_messages)
+    return messages
+
+
+def batch_limits():
+    """
+    Return the (batch size, linger ms) to poll with, larger during a snapshot.
+    """
+    if snapshot_in_progress.is_set():
+        return SNAPSHOT_BATCH_SIZE, SNAPSHOT_LINGER_MS
+    return BATCH_SIZE, BATCH_LINGER_MS
+
+
+def snapshot_marker(payload):
+    """
+    Return "last" for the final record of Debezium's initial snapshot, "true"
+    for its other records, and None for streamed changes.
+
+    Incremental snapshot reads are interleaved with streaming, so they do
+    not switch to snapshot batches.
+    """
+    value = payload['source'].get('snapshot')
+    if value == "last":
+        return "last"
+    if value in (None, False, "false", "incremental"):
+        return None
+    return "true"
+
+
+def track_snapshot():
+    """
+    Switch between snapshot and incremental batching on the snapshot
+    markers seen since the last call. Called from the polling thread only.
+    """
+    while True:
+        try:
+            marker = snapshot_markers.get_nowait()
+        except queue.Empty:
+            return
+        if marker == "true" and not snapshot_in_progress.is_set():
+            logger.info(f"Snapshot detected, loading with COPY in batches of {SNAPSHOT_BATCH_SIZE}")
+            snapshot_in_progress.set()
+        elif marker == "last" and snapshot_in_progress.is_set():
+            logger.info("Snapshot complete, switching back to incremental apply")
+            snapshot_in_progress.clear()
+
+
+def event_from_payload(payload, position=None, schema=None):
+    """
+    Reduce a Debezium payload to a ChangeEvent.
+
+    Args:
+        payload (dict): The Debezium envelope payload.
+        position (Tuple[str, int, int], optional): (topic, partition, offset)
+            of the message the payload came from.
+        schema (SchemaVersion, optional): The message's schema version.
+
+    Returns:
+        ChangeEvent: The table, operation and relevant row image.
+    """
+    operation = payload['op']
+    row = payload['before'] if operation == 'd' else payload['after']
+    source = payload['source']
+    return ChangeEvent(
+        source['table'], operation, row, position, source.get('ts_ms'), payload.get('ts_ms'), schema
+    )
+
+
+def deferred_buffer(db):
+    """
+    Return the DeferredBuffer attached to a long-lived session, creating it if needed.
+    """
+    if "deferred" not in db.info:
+        db.info["deferred"] = DeferredBuffer(
+            max_size=DEFERRED_MAX_SIZE, max_age=DEFERRED_MAX_AGE_S
+        )
+    return db.info["deferred"]
+
+
+def apply_batch(db, messages, store_offsets=True, in_flight=None):
+    """
+    Apply a batch of messages to PostgreSQL in a single transaction.
+
+    Events are written with the bulk upsert and delete statements of
+    `bulk_apply`, one statement per table and kind of operation, with upserts
+    applied parent-first and deletes child-first.
+
+    With COALESCE_EVENTS enabled, events for the same row are first folded
+    into their final state so intermediate versions are never written.
+
+    With SNAPSHOT_COPY enabled, snapshot reads (`r`) are then bulk-loaded
+    with COPY ahead of the other events; rows the COPY rejects fall back to
+    the normal upsert path.
+
+    With DEFER_ORPHANS enabled, child rows whose parent is neither in
+    PostgreSQL nor in the batch are parked in a per-session DeferredBuffer
+    and released in a later batch once the parent is applied. Deletes that
+    fail because child rows still reference the row are parked there too,
+    and retried once the children may have been deleted.
+
+    The newest MySQL commit time applied per table is recorded in
+    `cdc_freshness` in the same transaction, for the API's read routing,
+    stopping short of rows still waiting in the DeferredBuffer or in flight
+    elsewhere, and
+    with CACHE_INVALIDATION enabled the applied rows are announced to the
+    API's response caches when the transaction commits.
+
+    With `store_offsets`, the offsets to resume each partition from are
+    noted in `offset_ledger`, held back to the oldest row still waiting in
+    the DeferredBuffer so that a crash cannot lose it; with OFFSET_STORE set
+    to "postgres" they are written to `cdc_offsets` in the same transaction.
+
+    An empty batch only rechecks and expires the rows waiting in the
+    DeferredBuffer, and returns at once when none are due.
+
+    Events that cannot be applied are isolated by bisecting the batch, and
+    are written to the dead-letter sink together with undecodable messages
+    and deferred rows that were dropped: in the batch's transaction for the
+    `postgres` sink, after it commits for the others. Everything else is
+    still applied in bulk and committed.
+
+    Args:
+        db (Session): A long-lived PostgreSQL session.
+        messages (List[KafkaMessage]): The messages to apply.
+        store_offsets (bool): Whether the messages are the whole batch of
+            their partitions, so their offsets can be stored.
+        in_flight (Callable[[List[KafkaMessage]], Dict[Tuple[str, int], int]], optional):
+            Returns, per (topic, partition), the lowest offset outside the
+            batch that other workers have not applied yet.
+
+    Returns:
+        Tuple[int, int]: The number of events applied and the number of
+            events collapsed by coalescing.
+
+    Raises:
+        OperationalError, InterfaceError: If PostgreSQL is unavailable. The
+            transaction is rolled back and the batch can be retried as a whole.
+    """
+    buffer = deferred_buffer(db)
+    if not messages and not buffer.due():
+        return 0, 0
+    started = time.perf_counter()
+    metrics.CONVERT_SECONDS.reset()
+    events = []
+    rejected = []
+    marker = None
+    for message in messages:
+        position = (message.topic, message.partition, message.offset)
+        try:
+            payload, version = parse_message(message)
+            if payload is not None:
+                events.append(event_from_payload(payload, position, version))
+                state = snapshot_marker(payload)
+                if state is not None and state != marker:
+                    marker = state
+                    snapshot_markers.put(marker)
+        except Exception as e:
+            logger.error(f"Skipping undecodable message at {message.topic}[{message.partition}]@{message.offset}: {e}")
+            rejected.append(dead_letter(e, position=position, value=message.value))
+    decoded = time.perf_counter()
+    metrics.DECODE_SECONDS.observe(decoded - started)
+
+    collapsed = 0
+    copied = []
+    offsets = {}
+    try:
+        if COALESCE_EVENTS:
+            events, collapsed = coalesce_events(events)
+        snapshot = [event for event in events if event.op in SNAPSHOT_OPS]
+        if SNAPSHOT_COPY and snapshot:
+            events = [event for event in events if event.op not in SNAPSHOT_OPS]
+            copied, leftover = load_snapshot(db, snapshot, SNAPSHOT_SKIP_FK_CHECKS)
+            events = leftover + events
+            snapshot_loaded = time.perf_counter()
+            metrics.SNAPSHOT_SECONDS.observe(snapshot_loaded - decoded)
+            decoded = snapshot_loaded
+        if DEFER_ORPHANS:
+            events = buffer.resolve(db, events)
+            rejected.extend(dead_letter(reason, event=event) for event, reason in buffer.take_dropped())
+        events = order_events(events)
+        prepared = time.perf_counter()
+        metrics.PREPARE_SECONDS.observe(prepared - decoded)
+
+        applied, failed = apply_isolated(db, events)
+        for event, error in failed:
+            if DEFER_ORPHANS and event.op in DELETE_OPS and is_foreign_key_violation(error):
+                # Child rows still reference it; their deletes may come later.
+                buffer.defer_delete(event)
+                continue
+            logger.error(f"Error processing {event.op} for table {event.table} at {event.position}: {error}")
+            rejected.append(dead_letter(error, event=event))
+        written = time.perf_counter()
+        metrics.APPLY_SECONDS.observe(written - prepared)
+
+        failed_ids = {id(event) for event, _ in failed}
+        committed = copied + [event for event in events if id(event) not in failed_ids]
+        unapplied = buffer.held_offsets()
+        if in_flight is not None:
+            for key, offset in in_flight(messages).items():
+                unapplied[key] = min(offset, unapplied.get(key, offset))
+        freshness.record_applied(db, committed, unapplied)
+        if CACHE_INVALIDATION:
+            cache_invalidation.notify(db, cache_invalidation.event_tags(committed))
+        if dead_letter_sink.transactional:
+            dead_letter_sink.write(db, rejected)
+        if store_offsets:
+            offsets = offset_ledger.pending(messages, buffer.held_offsets())
+            if OFFSET_STORE == "postgres":
+                offset_store.record(db, KAFKA_GROUP_ID, offsets)
+        db.commit()
+        metrics.COMMIT_SECONDS.observe(time.perf_counter() - written)
+    except Exception:
+        db.rollback()
+        buffer.rollback()
+        raise
+    buffer.commit()
+    offset_ledger.committed(offsets)
+    if not dead_letter_sink.transactional:
+        try:
+            dead_letter_sink.write(db, rejected)
+        except Exception as e:
+            # The batch is committed; retrying it would apply it twice.
+            logger.error(f"Could not write {len(rejected)} dead letters: {e}: {rejected}")
+
+    metrics.CONVERT_SECONDS.observe()
+    metrics.observe_applied(committed)
+    metrics.EVENTS_COALESCED.inc(collapsed)
+    metrics.DEAD_LETTERS.inc(len(rejected))
+    metrics.observe_deferred(buffer.stats())
+    return applied + len(copied), collapsed
+
+
+def assigned_tables(consumer):
+    """
+    Return the tables whose topics are assigned to this consumer.
+
+    Debezium names topics `<server>.<database>.<table>`.
+    """
+    return {tp.topic.rsplit('.', 1)[-1] for tp in consumer.assignment()}
+
+
+def publish_caught_up(consumer, last_published):
+    """
+    Mark the tables of the consumer's assigned partitions fresh as of now,
+    at most every FRESHNESS_HEARTBEAT_S.
+
+    Other processes of the group own the other tables, and may be behind.
+
+    Only called when every polled message has been applied and no row is
+    waiting in a DeferredBuffer, so an idle table does not look stale to
+    read routing while a table with parked rows is not advertised fresh.
+
+    Args:
+        consumer (KafkaConsumer): The consumer; must be called from its thread.
+        last_published (float): `time.monotonic()` of the previous mark.
+
+    Returns:
+        float: `time.monotonic()` of the latest mark.
+    """
+    now = time.monotonic()
+    if now - last_published < FRESHNESS_HEARTBEAT_S:
+        return last_published
+    tables = assigned_tables(consumer)
+    if not tables:
+        return now
+    try:
+        freshness.record_caught_up(postgres_engine, tables)
+    except Exception as e:
+        logger.warning(f"Could not publish replica freshness: {e}")
+    return now
+
+
+def subscribe(consumer, on_revoke=None):
+    """
+    Subscribe to the replicated topics.
+
+    Args:
+        consumer (KafkaConsumer): The consumer to subscribe.
+        on_revoke (Callable[[Set[TopicPartition]], Any], optional): Finishes
+            or drops the work in memory for revoked partitions.
+    """
+    if OFFSET_STORE == "postgres":
+        listener = offset_store.SeekToStoredOffsets(
+            consumer, postgres_engine, KAFKA_GROUP_ID, offset_ledger, on_revoke
+        )
+    else:
+        listener = offset_store.ForgetRevoked(offset_ledger, on_revoke)
+    if DYNAMIC_TABLES:
+        consumer.subscribe(pattern=KAFKA_TOPIC_PATTERN, listener=listener)
+    else:
+        consumer.subscribe(KAFKA_TOPICS, listener=listener)
+
+
+def run_batch_consumer(consumer):
+    """
+    Consume in micro-batches, committing offsets only after Postgres commits.
+
+    The offsets committed never pass a row waiting in the DeferredBuffer.
+    With OFFSET_STORE set to "postgres" they are already stored with the
+    batch, and the Kafka commit is only sent in the background. Empty polls
+    still run an empty batch, so waiting rows are rechecked and expired.
+    Waiting rows from revoked partitions are dropped, for their new owner
+    to read again.
+    """
+    db = PostgresSessionLocal()
+    subscribe(consumer, on_revoke=lambda revoked: deferred_buffer(db).forget(revoked))
+    total_events = 0
+    total_collapsed = 0
+    last_heartbeat = 0.0
+    try:
+        while True:
+            messages = poll_batch(consumer, *batch_limits())
+            while True:
+                try:
+                    applied, collapsed = apply_batch(db, messages)
+                    break
+                except Exception as e:
+                    logger.error(f"Failed to apply batch of {len(messages)} events, retrying: {e}")
+                    time.sleep(RETRY_INTERVAL_S)
+            track_snapshot()
+            offsets = offset_ledger.take_unsent()
+            if offsets and OFFSET_STORE == "postgres":
+                consumer.commit_async(offsets=offsets)
+            elif offsets:
+                try:
+                    consumer.commit(offsets=offsets)
+                except CommitFailedError as e:
+                    # The group rebalanced; the new owner resumes from the last
+                    # committed offset and re-applies the batch.
+                    logger.warning(f"Offset commit failed after rebalance: {e}")
+            if not messages:
+                if not len(deferred_buffer(db)):
+                    last_heartbeat = publish_caught_up(consumer, last_heartbeat)
+                continue
+            metrics.observe_lag(consumer)
+            total_events += len(messages)
+            total_collapsed += collapsed
+            deferred = deferred_buffer(db).stats()
+            logger.info(
+                f"Applied {applied}/{len(messages)} events in batch, {collapsed} coalesced "
+                f"({total_collapsed}/{total_events} collapsed since start), "
+                f"{deferred['depth']} deferred (oldest {deferred['oldest_age_seconds']:.1f}s)"
+            )
+    finally:
+        db.close()
+
+
+def store_committable(offsets):
+    """
+    Store offsets every worker has finished in `cdc_offsets`, retrying until
+    PostgreSQL accepts them so the stored position never falls behind for long.
+    """
+    while True:
+        try:
+            with postgres_engine.begin() as conn:
+                offset_store.record(
+                    conn, KAFKA_GROUP_ID, {tp: meta.offset for tp, meta in offsets.items()}
+                )
+            return
+        except Exception as e:
+            logger.error(f"Failed to store offsets, retrying: {e}")
+            time.sleep(RETRY_INTERVAL_S)
+
+
+def commit_finished(consumer, pool):
+    """
+    Store and commit the offsets that advanced since the last call.
+    """
+    offsets = pool.tracker.committable()
+    if offsets and OFFSET_STORE == "postgres":
+        store_committable(offsets)
+    if offsets:
+        try:
+            consumer.commit(offsets=offsets)
+        except CommitFailedError as e:
+            # The group rebalanced; the new owner resumes from the last
+            # committed offset and re-applies the in-flight events.
+            logger.warning(f"Offset commit failed after rebalance: {e}")
+
+
+def run_parallel_consumer(consumer):
+    """
+    Consume in micro-batches applied by a pool of key-partitioned workers.
+
+    Offsets are committed per partition up to the lowest offset that every
+    worker has finished and no worker holds in its DeferredBuffer, so a crash
+    never skips an unapplied event. While
+    the workers are backlogged, the assigned partitions are paused: polling
+    goes on, so the consumer stays in the group, but fetches nothing. Workers
+    only see part of each partition, so with OFFSET_STORE set to "postgres"
+    these offsets are stored after the workers' transactions rather than in
+    them, and a restart re-applies at most the batches that were in flight.
+    On a rebalance the pool is drained and its offsets committed before the
+    partitions are given up, and rows held for them are dropped.
+    """
+    def apply_shard(db, messages):
+        in_flight = partial(pool.tracker.in_flight, worker=threading.current_thread().name)
+        return apply_batch(db, messages, store_offsets=False, in_flight=in_flight)
+
+    pool = WorkerPool(
+        APPLY_WORKERS, apply_shard, retry_interval=RETRY_INTERVAL_S,
+        held_fn=lambda db: deferred_buffer(db).held_offsets(),
+        revoke_fn=lambda db, revoked: deferred_buffer(db).forget(revoked),
+    )
+
+    def on_revoke(revoked):
+        pool.drain()
+        commit_finished(consumer, pool)
+        pool.forget(revoked)
+
+    pool.start()
+    subscribe(consumer, on_revoke)
+    last_heartbeat = 0.0
+    try:
+        while True:
+            track_snapshot()
+            if pool.flush():
+                consumer.resume(*consumer.paused())
+            else:
+                consumer.pause(*consumer.assignment())
+            messages = poll_batch(consumer, *batch_limits())
+            if messages:
+                pool.submit(messages)
+                metrics.observe_lag(consumer)
+            else:
+                pool.tick()
+                if pool.tracker.idle():
+                    last_heartbeat = publish_caught_up(consumer, last_heartbeat)
+            commit_finished(consumer, pool)
+    finally:
+        pool.stop()
+
+
+def exit_on_sigterm(signum, frame):
+    """
+    Turn SIGTERM into SystemExit, so a stopped consumer rolls back its open
+    batch and leaves the group at once instead of after the session timeout.
+    """
+    raise SystemExit(0)
+
+
 def main():
+    signal.signal(signal.SIGTERM, exit_on_sigterm)
+    if DYNAMIC_TABLES and MESSAGE_FORMAT != "json":
+        raise ValueError("DYNAMIC_TABLES requires MESSAGE_FORMAT=json with schemas enabled")
+    manual_commit = CONSUMER_MODE in ("batch", "parallel")
     consumer = KafkaConsumer(
-        *KAFKA_TOPICS,
         bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
         auto_offset_reset='earliest',
-        enable_auto_commit=True,
-        group_id='my-group',
-        value_deserializer=lambda x: x.decode('utf-8')
+        enable_auto_commit=not manual_commit,
+        group_id=KAFKA_GROUP_ID,
     )
 
-    logger.info("Starting Kafka to PostgreSQL consumer...")
-    for message in consumer:
-        process_message(message)
+    if METRICS_PORT:
+        metrics.start_metrics_server(METRICS_PORT)
+    if manual_commit:
+        freshness.create_table(postgres_engine)
+    if OFFSET_STORE == "postgres":
+        offset_store.create_table(postgres_engine)
+
+    logger.info(f"Starting Kafka to PostgreSQL consumer in {CONSUMER_MODE} mode...")
+    try:
+        if CONSUMER_MODE == "parallel":
+            run_parallel_consumer(consumer)
+        elif CONSUMER_MODE == "batch":
+            run_batch_consumer(consumer)
+        else:
+            subscribe(consumer)
+            for message in consumer:
+                process_message(message)
+    finally:
+        consumer.close(autocommit=not manual_commit)
 
 if __name__ == "__main__":
     main()
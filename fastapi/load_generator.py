@@ -0,0 +1,379 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import random
+import time
+import uuid
+from collections import defaultdict
+import httpx
+from sqlalchemy import select
+from database import Base, postgres_engine
+import models  # noqa: F401  (registers the tables on Base.metadata)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+# httpx logs every request at INFO.
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+# Relative weights of the operations in the steady-state mix. Orders carry
+# 1-5 items each, so they write the most rows.
+MIX = {
+    "create_user": 20,
+    "create_order": 35,
+    "create_product": 8,
+    "create_category": 2,
+    "read_user": 20,
+    "read_product": 15,
+}
+WRITE_OPS = {name for name in MIX if name.startswith("create_")}
+
+
+def percentile(sorted_values, q):
+    """
+    Return the q-th percentile (0-100) of an already sorted list by nearest rank.
+    """
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, round(q / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def latency_summary(values):
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50_ms": _ms(percentile(values, 50)),
+        "p90_ms": _ms(percentile(values, 90)),
+        "p99_ms": _ms(percentile(values, 99)),
+        "max_ms": _ms(values[-1] if values else None),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+class Workload:
+    """
+    Issue API requests for the load mix, remembering the rows it created so
+    later orders, products and reads can refer to them.
+
+    Args:
+        client (httpx.AsyncClient): Client for the API, in-process or over the network.
+        rng (random.Random): Source of randomness, seeded for repeatable runs.
+    """
+
+    def __init__(self, client, rng):
+        self.client = client
+        self.rng = rng
+        self.run_id = uuid.uuid4().hex[:8]
+        self.sequence = itertools.count()
+        self.users = []
+        self.categories = []
+        self.products = []
+        # X-Write-Ts of the latest write to each (table, id), sent back as
+        # X-Read-After so reads routed to the replica see the row.
+        self.write_ts = {}
+
+    async def _post(self, path, body):
+        response = await self.client.post(path, json=body)
+        if response.status_code != 200:
+            return response.status_code, None, None
+        return response.status_code, response.json(), response.headers.get("x-write-ts")
+
+    async def _get(self, path, key):
+        write_ts = self.write_ts.get(key)
+        headers = {"X-Read-After": write_ts} if write_ts else None
+        response = await self.client.get(path, headers=headers)
+        return response.status_code, []
+
+    async def create_category(self):
+        status, category, _ = await self._post(
+            "/api/categories", {"name": f"Category {self.run_id}-{next(self.sequence)}"}
+        )
+        if category is None:
+            return status, []
+        self.categories.append(category["id"])
+        return status, [("product_categories", category["id"])]
+
+    async def create_product(self):
+        n = next(self.sequence)
+        status, product, write_ts = await self._post("/api/products", {
+            "name": f"Product {self.run_id}-{n}",
+            "description": f"Load test product {n}",
+            "price": round(self.rng.uniform(1.0, 500.0), 2),
+            "category_id": self.rng.choice(self.categories),
+        })
+        if product is None:
+            return status, []
+        self.products.append((product["id"], product["price"]))
+        self.write_ts[("products", product["id"])] = write_ts
+        return status, [("products", product["id"])]
+
+    async def create_user(self):
+        status, user, write_ts = await self._post(
+            "/api/users/", {"email": f"load-{self.run_id}-{next(self.sequence)}@example.com"}
+        )
+        if user is None:
+            return status, []
+        self.users.append(user["id"])
+        self.write_ts[("users", user["id"])] = write_ts
+        return status, [("users", user["id"])]
+
+    async def create_order(self):
+        items = []
+        for product_id, price in self.rng.sample(self.products, min(len(self.products), self.rng.randint(1, 5))):
+            items.append({"product_id": product_id, "quantity": self.rng.randint(1, 5), "price": price})
+        user_id = self.rng.choice(self.users)
+        status, order, write_ts = await self._post(f"/api/users/{user_id}/orders", {
+            "total_amount": round(sum(item["quantity"] * item["price"] for item in items), 2),
+            "status": "pending",
+            "order_items": items,
+        })
+        if order is None:
+            return status, []
+        self.write_ts[("users", user_id)] = write_ts
+        return status, [("orders", order["id"])] + [("order_items", item["id"]) for item in order["order_items"]]
+
+    async def read_user(self):
+        user_id = self.rng.choice(self.users)
+        return await self._get(f"/api/users/{user_id}", ("users", user_id))
+
+    async def read_product(self):
+        product_id = self.rng.choice(self.products)[0]
+        return await self._get(f"/api/products/{product_id}", ("products", product_id))
+
+    async def setup(self, categories, products, users):
+        """
+        Create the categories, products and users the mix builds on.
+        """
+        await asyncio.gather(*(self.create_category() for _ in range(categories)))
+        await asyncio.gather(*(self.create_product() for _ in range(products)))
+        await asyncio.gather(*(self.create_user() for _ in range(users)))
+        if not (self.categories and self.products and self.users):
+            raise RuntimeError("Setup failed: could not create categories, products and users")
+
+
+class ReplicaProbe:
+    """
+    Measure end-to-end CDC latency by polling PostgreSQL for written rows.
+
+    Rows are looked up in batches per table, one query per table and poll,
+    and the time from the API response to the row's first sighting in the
+    replica is recorded.
+
+    Args:
+        poll_interval (float): Seconds between polls.
+    """
+
+    def __init__(self, poll_interval=0.1):
+        self.poll_interval = poll_interval
+        self.pending = defaultdict(dict)
+        self.latencies = []
+        self.tables = {table.name: table for table in Base.metadata.sorted_tables}
+
+    def track(self, rows, written_at):
+        for table, row_id in rows:
+            self.pending[table][row_id] = written_at
+
+    def _poll_once(self, pending_ids):
+        found = []
+        with postgres_engine.connect() as conn:
+            for name, ids in pending_ids.items():
+                table = self.tables[name]
+                for start in range(0, len(ids), 1000):
+                    chunk = ids[start:start + 1000]
+                    rows = conn.execute(select(table.c.id).where(table.c.id.in_(chunk)))
+                    found.extend((name, row_id) for row_id, in rows)
+        return found
+
+    def pending_count(self):
+        return sum(len(pending) for pending in self.pending.values())
+
+    async def run(self, stop):
+        """
+        Poll until `stop` is set and nothing is pending.
+        """
+        while not (stop.is_set() and self.pending_count() == 0):
+            if self.pending_count():
+                # Copied here, since track() keeps adding rows while the thread runs.
+                pending_ids = {name: list(pending) for name, pending in self.pending.items() if pending}
+                found = await asyncio.to_thread(self._poll_once, pending_ids)
+                now = time.perf_counter()
+                for table, row_id in found:
+                    self.latencies.append(now - self.pending[table].pop(row_id))
+            await asyncio.sleep(self.poll_interval)
+
+
+async def run_load(client, concurrency=16, rate=None, duration=None, total=None,
+                   seed=None, cdc_latency=False, cdc_timeout=60.0, setup_size=(5, 50, 50)):
+    """
+    Run the load mix against the API and summarize latency and throughput.
+
+    With `rate`, requests are started on a fixed schedule (open loop) and
+    their latency is measured from the scheduled start, so time spent
+    queued behind slow requests counts against the server. Without it,
+    `concurrency` workers send requests back to back (closed loop).
+
+    Args:
+        client (httpx.AsyncClient): Client for the API.
+        concurrency (int): Maximum number of requests in flight.
+        rate (float, optional): Target requests per second.
+        duration (float, optional): Seconds to run for.
+        total (int, optional): Number of requests to send.
+        seed (int, optional): Seed for the operation mix and payloads.
+        cdc_latency (bool): Poll the PostgreSQL replica for every written row.
+        cdc_timeout (float): Seconds to wait for rows still missing from the
+            replica after the load stops.
+        setup_size (Tuple[int, int, int]): Categories, products and users to
+            create before the mix starts.
+
+    Returns:
+        dict: Per-operation latency percentiles and errors, requests and
+            writes per second, and CDC latency when measured.
+    """
+    if duration is None and total is None:
+        raise ValueError("Either duration or total must be set")
+    rng = random.Random(seed)
+    workload = Workload(client, rng)
+    await workload.setup(*setup_size)
+
+    names = list(MIX)
+    weights = [MIX[name] for name in names]
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    rows_written = 0
+    counter = itertools.count()
+    probe = ReplicaProbe() if cdc_latency else None
+    stop = asyncio.Event()
+    probe_task = asyncio.create_task(probe.run(stop)) if probe else None
+
+    started = time.perf_counter()
+    deadline = started + duration if duration is not None else None
+
+    async def worker():
+        nonlocal rows_written
+        while True:
+            i = next(counter)
+            if total is not None and i >= total:
+                return
+            if rate:
+                scheduled = started + i / rate
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            else:
+                scheduled = time.perf_counter()
+            if deadline is not None and scheduled >= deadline:
+                return
+            name = rng.choices(names, weights)[0]
+            try:
+                status, rows = await getattr(workload, name)()
+            except httpx.HTTPError as e:
+                status, rows = type(e).__name__, []
+            finished = time.perf_counter()
+            latencies[name].append(finished - scheduled)
+            if status != 200:
+                errors[f"{name} {status}"] += 1
+            rows_written += len(rows)
+            if probe and rows:
+                probe.track(rows, finished)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    summary = {
+        "elapsed_s": round(elapsed, 3),
+        "requests": sum(len(values) for values in latencies.values()),
+        "errors": dict(errors),
+        "operations": {name: latency_summary(values) for name, values in latencies.items()},
+        "all": latency_summary([v for values in latencies.values() for v in values]),
+    }
+    writes = sum(len(latencies[name]) for name in WRITE_OPS)
+    summary["requests_per_s"] = round(summary["requests"] / elapsed, 1)
+    summary["writes_per_s"] = round(writes / elapsed, 1)
+    summary["rows_written_per_s"] = round(rows_written / elapsed, 1)
+
+    if probe:
+        stop.set()
+        try:
+            await asyncio.wait_for(probe_task, timeout=cdc_timeout)
+        except asyncio.TimeoutError:
+            pass
+        summary["cdc"] = latency_summary(probe.latencies)
+        summary["cdc"]["not_replicated"] = probe.pending_count()
+    return summary
+
+
+def log_summary(summary):
+    logger.info(
+        f"{summary['requests']} requests in {summary['elapsed_s']}s: "
+        f"{summary['requests_per_s']} requests/s, {summary['writes_per_s']} writes/s, "
+        f"{summary['rows_written_per_s']} rows written/s"
+    )
+    for name, stats in sorted(summary["operations"].items()) + [("all", summary["all"])]:
+        logger.info(
+            f"  {name:<16} n={stats['count']:<7} p50={stats['p50_ms']}ms p90={stats['p90_ms']}ms "
+            f"p99={stats['p99_ms']}ms max={stats['max_ms']}ms"
+        )
+    for error, count in sorted(summary["errors"].items()):
+        logger.warning(f"  {count} x {error}")
+    if "cdc" in summary:
+        cdc = summary["cdc"]
+        logger.info(
+            f"CDC latency over {cdc['count']} rows: p50={cdc['p50_ms']}ms p90={cdc['p90_ms']}ms "
+            f"p99={cdc['p99_ms']}ms max={cdc['max_ms']}ms, {cdc['not_replicated']} not replicated"
+        )
+
+
+async def main(args):
+    if args.base_url:
+        client = httpx.AsyncClient(
+            base_url=args.base_url,
+            timeout=30.0,
+            limits=httpx.Limits(max_connections=args.concurrency),
+        )
+    else:
+        from main import app
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://loadgen")
+
+    async with client:
+        summary = await run_load(
+            client,
+            concurrency=args.concurrency,
+            rate=args.rate,
+            duration=args.duration,
+            total=args.requests,
+            seed=args.seed,
+            cdc_latency=args.cdc_latency,
+            cdc_timeout=args.cdc_timeout,
+        )
+    log_summary(summary)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate API load and measure latency")
+    parser.add_argument(
+        "--base-url",
+        help="API root, e.g. http://app:8000; runs the app in-process when omitted",
+    )
+    parser.add_argument("--concurrency", type=int, default=16, help="maximum requests in flight")
+    parser.add_argument("--rate", type=float, help="target requests per second (open loop)")
+    parser.add_argument("--duration", type=float, help="seconds to run")
+    parser.add_argument("--requests", type=int, help="number of requests to send")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument(
+        "--cdc-latency", action="store_true",
+        help="poll the PostgreSQL replica for every written row",
+    )
+    parser.add_argument("--cdc-timeout", type=float, default=60.0)
+    parser.add_argument("--output", help="write the summary as JSON to this file")
+    args = parser.parse_args()
+    if args.duration is None and args.requests is None:
+        args.duration = 30.0
+    asyncio.run(main(args))
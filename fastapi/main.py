@@ -1,10 +1,18 @@
 from fastapi import FastAPI
 from api import router
+from api_metrics import setup_metrics
+from database import async_mysql_engine, async_postgres_engine
+from read_routing import write_timestamp_middleware
+from response_cache import setup_response_cache
 import uvicorn
 
 app = FastAPI()
 
 app.include_router(router, prefix="/api")
+app.middleware("http")(write_timestamp_middleware)
+# Added before the metrics middleware, which must wrap it to time cache hits.
+setup_response_cache(app)
+setup_metrics(app, {"mysql": async_mysql_engine.sync_engine, "postgres": async_postgres_engine.sync_engine})
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
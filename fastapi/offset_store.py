@@ -0,0 +1,206 @@
+import logging
+from kafka import ConsumerRebalanceListener, TopicPartition
+from kafka.structs import OffsetAndMetadata
+from sqlalchemy import BigInteger, Column, Integer, MetaData, String, Table, select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+
+logger = logging.getLogger(__name__)
+
+# Kept out of Base.metadata so the table is neither created in MySQL nor
+# picked up as a replicated table.
+metadata = MetaData()
+
+offsets = Table(
+    "cdc_offsets",
+    metadata,
+    Column("group_id", String(255), primary_key=True),
+    Column("topic", String(255), primary_key=True),
+    Column("partition", Integer, primary_key=True),
+    # Offset of the next message to consume; everything before it has been
+    # applied, or is written elsewhere in the same transaction.
+    Column("next_offset", BigInteger, nullable=False),
+)
+
+_upsert = insert(offsets)
+_upsert = _upsert.on_conflict_do_update(
+    index_elements=[offsets.c.group_id, offsets.c.topic, offsets.c.partition],
+    set_={"next_offset": _upsert.excluded.next_offset},
+)
+
+
+def create_table(engine):
+    metadata.create_all(bind=engine)
+
+
+class OffsetLedger:
+    """
+    Track how far each partition has been consumed and what is stored for it.
+
+    The offset stored for a partition is one past its last consumed message,
+    held back to the oldest event that is consumed but not yet written, such
+    as a row parked in a DeferredBuffer, so the event is read again after a
+    crash. Once that event is written the partition moves forward on the
+    next batch, even if the batch has no messages from it.
+
+    The same offsets are committed to Kafka, whichever OFFSET_STORE is used,
+    so the group's commits never skip a parked row either.
+    """
+
+    def __init__(self):
+        self.consumed = {}
+        self.stored = {}
+        self._unsent = {}
+
+    def pending(self, messages, held=None):
+        """
+        Return the offsets to store with a batch.
+
+        Args:
+            messages (Iterable[KafkaMessage]): The messages of the batch.
+            held (Dict[Tuple[str, int], int], optional): Per (topic,
+                partition), the lowest offset of an event not yet written.
+
+        Returns:
+            Dict[Tuple[str, int], int]: The next offset of every
+                (topic, partition) whose stored offset changes.
+        """
+        for message in messages:
+            key = (message.topic, message.partition)
+            if message.offset + 1 > self.consumed.get(key, -1):
+                self.consumed[key] = message.offset + 1
+        held = held or {}
+        changed = {}
+        for key, offset in self.consumed.items():
+            offset = min(offset, held.get(key, offset))
+            if self.stored.get(key) != offset:
+                changed[key] = offset
+        return changed
+
+    def committed(self, offsets):
+        """
+        Note offsets from `pending` once their transaction has committed.
+        """
+        self.stored.update(offsets)
+        self._unsent.update(offsets)
+
+    def take_unsent(self):
+        """
+        Return and forget the offsets noted since the last call, for a Kafka commit.
+
+        Returns:
+            Dict[TopicPartition, OffsetAndMetadata]: The offsets to commit.
+        """
+        unsent, self._unsent = self._unsent, {}
+        return {
+            TopicPartition(topic, partition): OffsetAndMetadata(offset, None)
+            for (topic, partition), offset in unsent.items()
+        }
+
+    def forget(self, partitions):
+        """
+        Drop revoked partitions, whose offsets now belong to another consumer.
+        """
+        for tp in partitions:
+            self.consumed.pop((tp.topic, tp.partition), None)
+            self.stored.pop((tp.topic, tp.partition), None)
+            self._unsent.pop((tp.topic, tp.partition), None)
+
+
+def record(db, group_id, next_offset):
+    """
+    Store the offsets to resume from, in the transaction applying the batch.
+
+    The offsets commit together with the rows they cover, so after a crash
+    the consumer neither skips an applied-looking batch nor re-applies a
+    committed one. Rows are written in partition order, so concurrent
+    writers always lock them in the same order.
+
+    Args:
+        db (Session | Connection): The PostgreSQL session applying the batch.
+        group_id (str): The Kafka consumer group.
+        next_offset (Dict[Tuple[str, int], int]): Offsets keyed by
+            (topic, partition) or TopicPartition.
+    """
+    if next_offset:
+        db.execute(_upsert, [
+            {"group_id": group_id, "topic": topic, "partition": partition, "next_offset": offset}
+            for (topic, partition), offset in sorted(next_offset.items())
+        ])
+
+
+def load(engine, group_id, partitions):
+    """
+    Read the stored offsets of some partitions.
+
+    Args:
+        engine (Engine): The PostgreSQL engine.
+        group_id (str): The Kafka consumer group.
+        partitions (Iterable[TopicPartition]): The partitions to look up.
+
+    Returns:
+        Dict[TopicPartition, int]: The next offset of each partition that has one.
+    """
+    keys = [(tp.topic, tp.partition) for tp in partitions]
+    if not keys:
+        return {}
+    stmt = select(offsets.c.topic, offsets.c.partition, offsets.c.next_offset).where(
+        offsets.c.group_id == group_id,
+        tuple_(offsets.c.topic, offsets.c.partition).in_(keys),
+    )
+    with engine.connect() as conn:
+        return {TopicPartition(topic, partition): offset for topic, partition, offset in conn.execute(stmt)}
+
+
+class ForgetRevoked(ConsumerRebalanceListener):
+    """
+    Drop what the consumer keeps about partitions it no longer owns.
+
+    Args:
+        ledger (OffsetLedger, optional): Forgets revoked partitions.
+        on_revoke (Callable[[Set[TopicPartition]], Any], optional): Called
+            first with the revoked partitions, to finish or drop the work
+            still in memory for them.
+    """
+
+    def __init__(self, ledger=None, on_revoke=None):
+        self.ledger = ledger
+        self.on_revoke = on_revoke
+
+    def on_partitions_revoked(self, revoked):
+        if self.on_revoke is not None:
+            self.on_revoke(revoked)
+        if self.ledger is not None:
+            self.ledger.forget(revoked)
+
+    def on_partitions_assigned(self, assigned):
+        pass
+
+
+class SeekToStoredOffsets(ForgetRevoked):
+    """
+    Position newly assigned partitions at the offsets stored in PostgreSQL.
+
+    Partitions without a stored offset start from the group's Kafka commit,
+    or `auto_offset_reset` when there is none, as before.
+
+    Args:
+        consumer (KafkaConsumer): The consumer the listener is registered on.
+        engine (Engine): The PostgreSQL engine.
+        group_id (str): The Kafka consumer group.
+        ledger (OffsetLedger, optional): Forgets revoked partitions.
+        on_revoke (Callable[[Set[TopicPartition]], Any], optional): See
+            `ForgetRevoked`.
+    """
+
+    def __init__(self, consumer, engine, group_id, ledger=None, on_revoke=None):
+        super().__init__(ledger, on_revoke)
+        self.consumer = consumer
+        self.engine = engine
+        self.group_id = group_id
+
+    def on_partitions_assigned(self, assigned):
+        stored = load(self.engine, self.group_id, assigned)
+        for tp, offset in stored.items():
+            self.consumer.seek(tp, offset)
+        if stored:
+            logger.info(f"Resuming {len(stored)}/{len(assigned)} assigned partitions from stored offsets")
@@ -0,0 +1,282 @@
+import logging
+import queue
+import threading
+import time
+import zlib
+from collections import defaultdict, deque
+from kafka import TopicPartition
+from kafka.structs import OffsetAndMetadata
+from database import PostgresSessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+def route(message, num_workers):
+    """
+    Pick the worker for a message by hashing its topic and Debezium key.
+
+    Debezium keys each message by the row's primary key, so every change to
+    the same (table, id) lands on the same worker and stays in order.
+    """
+    key = message.key if message.key is not None else str(message.partition).encode()
+    return zlib.crc32(message.topic.encode() + b"\0" + key) % num_workers
+
+
+class OffsetTracker:
+    """
+    Track in-flight offsets per partition and compute the safe commit point.
+
+    The committable offset of a partition is the lowest offset still being
+    applied by any worker, or one past the highest dispatched offset when
+    nothing is in flight, and never past a row a worker still holds in
+    memory, such as one parked in its DeferredBuffer.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = defaultdict(set)
+        self._next = {}
+        self._committed = {}
+        self._held = {}
+
+    def dispatched(self, messages):
+        with self._lock:
+            for message in messages:
+                tp = TopicPartition(message.topic, message.partition)
+                self._pending[tp].add(message.offset)
+                self._next[tp] = max(self._next.get(tp, 0), message.offset + 1)
+
+    def finished(self, messages, worker=None, held=None):
+        """
+        Mark messages applied, and replace the offsets `worker` holds.
+
+        Args:
+            messages (List[KafkaMessage]): The messages the worker applied.
+            worker (str, optional): The worker's name.
+            held (Dict[Tuple[str, int], int], optional): Per (topic,
+                partition), the lowest offset the worker has not written yet.
+        """
+        with self._lock:
+            for message in messages:
+                tp = TopicPartition(message.topic, message.partition)
+                self._pending[tp].discard(message.offset)
+            if worker is not None:
+                self._held[worker] = held or {}
+
+    def in_flight(self, messages, worker=None):
+        """
+        Return the offsets not yet applied outside a worker's own batch.
+
+        Args:
+            messages (List[KafkaMessage]): The batch the worker is applying.
+            worker (str, optional): The worker's name, whose held rows are
+                left out as well.
+
+        Returns:
+            Dict[Tuple[str, int], int]: Per (topic, partition), the lowest
+                offset dispatched to or held by another worker.
+        """
+        own = defaultdict(set)
+        for message in messages:
+            own[(message.topic, message.partition)].add(message.offset)
+        lowest = {}
+        with self._lock:
+            for tp, pending in self._pending.items():
+                key = (tp.topic, tp.partition)
+                others = pending - own[key] if key in own else pending
+                if others:
+                    lowest[key] = min(others)
+            for name, worker_held in self._held.items():
+                if name == worker:
+                    continue
+                for key, offset in worker_held.items():
+                    lowest[key] = min(offset, lowest.get(key, offset))
+        return lowest
+
+    def idle(self):
+        """
+        Return True when no dispatched message is still being applied, and
+        no worker holds a row it has not written.
+        """
+        with self._lock:
+            return not any(self._pending.values()) and not any(self._held.values())
+
+    def forget(self, partitions):
+        """
+        Stop tracking revoked partitions, once nothing for them is in flight.
+        """
+        with self._lock:
+            for tp in partitions:
+                tp = TopicPartition(tp.topic, tp.partition)
+                self._pending.pop(tp, None)
+                self._next.pop(tp, None)
+                self._committed.pop(tp, None)
+                for worker_held in self._held.values():
+                    worker_held.pop((tp.topic, tp.partition), None)
+
+    def committable(self):
+        """
+        Return the offsets that advanced since the last call.
+
+        Returns:
+            Dict[TopicPartition, OffsetAndMetadata]: Offsets safe to commit.
+        """
+        offsets = {}
+        with self._lock:
+            held = {}
+            for worker_held in self._held.values():
+                for key, offset in worker_held.items():
+                    held[key] = min(offset, held.get(key, offset))
+            for tp, next_offset in self._next.items():
+                pending = self._pending[tp]
+                offset = min(pending) if pending else next_offset
+                offset = min(offset, held.get((tp.topic, tp.partition), offset))
+                if self._committed.get(tp) != offset:
+                    offsets[tp] = OffsetAndMetadata(offset, None)
+                    self._committed[tp] = offset
+        return offsets
+
+
+class ApplyWorker(threading.Thread):
+    """
+    A thread that applies message batches on its own PostgreSQL connection.
+    """
+
+    def __init__(self, index, apply_fn, tracker, queue_size=4, retry_interval=5, held_fn=None):
+        super().__init__(name=f"apply-worker-{index}", daemon=True)
+        self.apply_fn = apply_fn
+        self.tracker = tracker
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.retry_interval = retry_interval
+        self.held_fn = held_fn
+        self.db = None
+
+    def run(self):
+        db = self.db = PostgresSessionLocal()
+        try:
+            while True:
+                messages = self.queue.get()
+                if messages is None:
+                    self.queue.task_done()
+                    return
+                while True:
+                    try:
+                        self.apply_fn(db, messages)
+                        break
+                    except Exception as e:
+                        # apply_fn isolates bad events itself; anything reaching
+                        # here (e.g. a lost connection) is retried, not skipped.
+                        logger.error(f"{self.name} failed to apply {len(messages)} events, retrying: {e}")
+                        db.rollback()
+                        time.sleep(self.retry_interval)
+                held = self.held_fn(db) if self.held_fn else None
+                self.tracker.finished(messages, self.name, held)
+                self.queue.task_done()
+        finally:
+            db.close()
+
+
+class WorkerPool:
+    """
+    Apply batches on N workers, partitioned by (table, primary key).
+
+    Submitting never blocks: shards that do not fit in a worker's queue wait
+    in its backlog, so the caller can keep polling Kafka (with its
+    partitions paused) instead of overrunning `max_poll_interval_ms`.
+
+    Args:
+        num_workers (int): Number of worker threads and PostgreSQL connections.
+        apply_fn (Callable[[Session, List[KafkaMessage]], Any]): Applies and
+            commits one batch of messages on the given session; it is also
+            called with an empty batch by `tick`.
+        retry_interval (int): Seconds to wait before retrying a failed batch.
+        held_fn (Callable[[Session], Dict[Tuple[str, int], int]], optional):
+            Returns the lowest offset per (topic, partition) that a worker's
+            session still holds unwritten, which is never committed past.
+        revoke_fn (Callable[[Session, Set[TopicPartition]], Any], optional):
+            Drops what a worker's session still holds for revoked partitions.
+    """
+
+    def __init__(self, num_workers, apply_fn, retry_interval=5, held_fn=None, revoke_fn=None):
+        self.tracker = OffsetTracker()
+        self.workers = [
+            ApplyWorker(i, apply_fn, self.tracker, retry_interval=retry_interval, held_fn=held_fn)
+            for i in range(num_workers)
+        ]
+        self.backlogs = [deque() for _ in self.workers]
+        self.revoke_fn = revoke_fn
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, messages):
+        """
+        Split a polled batch across the workers' backlogs and hand out what fits.
+        """
+        self.tracker.dispatched(messages)
+        shards = defaultdict(list)
+        for message in messages:
+            shards[route(message, len(self.workers))].append(message)
+        for index, shard in shards.items():
+            self.backlogs[index].append(shard)
+        self.flush()
+
+    def flush(self):
+        """
+        Move backlogged shards into the worker queues that have room.
+
+        Returns:
+            bool: True when every backlog is empty, so more can be polled.
+        """
+        for worker, backlog in zip(self.workers, self.backlogs):
+            while backlog:
+                try:
+                    worker.queue.put_nowait(backlog[0])
+                except queue.Full:
+                    break
+                backlog.popleft()
+        return not any(self.backlogs)
+
+    def tick(self):
+        """
+        Hand each idle worker an empty batch, so rows it holds are rechecked
+        and expired while no messages arrive.
+        """
+        for worker, backlog in zip(self.workers, self.backlogs):
+            if not backlog and worker.queue.empty():
+                try:
+                    worker.queue.put_nowait([])
+                except queue.Full:
+                    pass
+
+    def drain(self):
+        """
+        Hand every backlogged shard to its worker and wait until all of them,
+        and everything already queued, are applied.
+        """
+        for worker, backlog in zip(self.workers, self.backlogs):
+            while backlog:
+                worker.queue.put(backlog.popleft())
+        for worker in self.workers:
+            worker.queue.join()
+
+    def forget(self, partitions):
+        """
+        Drop all state kept for revoked partitions. Call `drain` first, so
+        no worker is applying messages from them.
+
+        Args:
+            partitions (Iterable[TopicPartition]): The revoked partitions.
+        """
+        if self.revoke_fn is not None:
+            for worker in self.workers:
+                if worker.db is not None:
+                    self.revoke_fn(worker.db, partitions)
+        self.tracker.forget(partitions)
+
+    def stop(self):
+        for worker in self.workers:
+            worker.queue.put(None)
+        for worker in self.workers:
+            worker.join()
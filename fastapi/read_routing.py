@@ -0,0 +1,118 @@
+import math
+import os
+import time
+from fastapi import Request, Response
+from api_metrics import READ_ROUTING
+from database import (
+    AsyncMySQLSessionLocal, AsyncPostgresSessionLocal, async_mysql_engine, async_postgres_engine,
+)
+from freshness import FreshnessCache
+
+# Serve read endpoints from the PostgreSQL replica when its watermark for
+# the tables a route reads is within the route's staleness budget.
+REPLICA_READS = os.getenv("REPLICA_READS", "true").lower() == "true"
+REPLICA_MAX_STALENESS_S = float(os.getenv("REPLICA_MAX_STALENESS_S", "5"))
+FRESHNESS_CACHE_S = float(os.getenv("FRESHNESS_CACHE_S", "0.5"))
+
+freshness_cache = FreshnessCache(async_postgres_engine, ttl=FRESHNESS_CACHE_S)
+
+
+def _read_after(request):
+    value = request.headers.get("x-read-after")
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        # Anything but a timestamp asks for the primary.
+        return math.inf
+
+
+async def choose_database(tables, max_staleness_s, read_after_ms=None, now_ms=None):
+    """
+    Decide whether a read can be served by the replica.
+
+    Args:
+        tables (Iterable[str]): The tables the route reads.
+        max_staleness_s (float): How far behind MySQL the replica may be.
+        read_after_ms (float, optional): A write time (epoch ms) the read must
+            observe, for read-your-writes.
+        now_ms (float, optional): The current time in epoch milliseconds.
+
+    Returns:
+        Tuple[str, str]: The database (`postgres` or `mysql`) and the reason.
+    """
+    if not REPLICA_READS:
+        return "mysql", "disabled"
+    fresh_as_of = await freshness_cache.fresh_as_of(tables)
+    if fresh_as_of is None:
+        return "mysql", "unknown"
+    if read_after_ms is not None and fresh_as_of < read_after_ms:
+        return "mysql", "read_your_writes"
+    now_ms = now_ms or time.time() * 1000
+    if now_ms - fresh_as_of > max_staleness_s * 1000:
+        return "mysql", "stale"
+    return "postgres", "fresh"
+
+
+async def route_read(request, tables, max_staleness_s=None):
+    """
+    Choose the database for a read and count the decision.
+
+    Args:
+        request (Request): The request, for its `X-Read-After` header.
+        tables (Tuple[str, ...]): The tables the read covers.
+        max_staleness_s (float, optional): The staleness budget. Defaults to
+            REPLICA_MAX_STALENESS_S.
+
+    Returns:
+        str: `postgres` or `mysql`.
+    """
+    budget = REPLICA_MAX_STALENESS_S if max_staleness_s is None else max_staleness_s
+    database, reason = await choose_database(tables, budget, _read_after(request))
+    READ_ROUTING.labels(database, reason).inc()
+    return database
+
+
+def read_engine(database):
+    return async_postgres_engine if database == "postgres" else async_mysql_engine
+
+
+def read_db(tables, max_staleness_s=None):
+    """
+    Build a dependency that opens an async session on the replica or the primary.
+
+    The choice is reported in the `X-Read-From` response header. Clients
+    that need to see their own writes send the `X-Write-Ts` of the write
+    response back as `X-Read-After`. The budget is also kept on the request
+    state, where the response cache caps its TTL with it.
+
+    Args:
+        tables (Tuple[str, ...]): The tables the route reads.
+        max_staleness_s (float, optional): The route's staleness budget.
+            Defaults to REPLICA_MAX_STALENESS_S.
+
+    Returns:
+        Callable: A FastAPI dependency yielding an AsyncSession.
+    """
+    budget = REPLICA_MAX_STALENESS_S if max_staleness_s is None else max_staleness_s
+
+    async def get_read_db(request: Request, response: Response):
+        request.state.max_staleness_s = budget
+        database = await route_read(request, tables, budget)
+        response.headers["X-Read-From"] = database
+        session_factory = AsyncPostgresSessionLocal if database == "postgres" else AsyncMySQLSessionLocal
+        async with session_factory() as db:
+            yield db
+
+    return get_read_db
+
+
+async def write_timestamp_middleware(request: Request, call_next):
+    """
+    Stamp successful writes with `X-Write-Ts` (epoch ms) for read-your-writes.
+    """
+    response = await call_next(request)
+    if request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+        response.headers["X-Write-Ts"] = str(int(time.time() * 1000))
+    return response
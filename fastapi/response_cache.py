@@ -0,0 +1,464 @@
+import json
+import logging
+import os
+import select
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque, namedtuple
+from typing import get_args
+from urllib.parse import urlencode
+from fastapi import Request, Response
+from pydantic import BaseModel
+from sqlalchemy import inspect
+from starlette.concurrency import run_in_threadpool
+from api_metrics import CACHE_ENTRIES, CACHE_EVICTIONS, CACHE_HIT_RATIO, CACHE_REQUESTS
+from cache_invalidation import ALL, CHANNEL, collection_tag, row_tag
+from database import postgres_engine
+
+logger = logging.getLogger(__name__)
+
+# Cache GET responses until the consumer reports a change to a row they
+# embed. "memory" keeps them per process; "redis" shares them between
+# processes (needs the `redis` package).
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "true").lower() == "true"
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://redis:6379/0")
+# Upper bound on an entry's age, should an invalidation ever be lost. Routes
+# with a shorter staleness budget (see `read_routing.read_db`) keep their
+# entries for that long at most, as invalidations stop when the consumer stalls.
+CACHE_TTL_S = float(os.getenv("CACHE_TTL_S", "60"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+CACHE_RECONNECT_S = float(os.getenv("CACHE_RECONNECT_S", "5"))
+
+# A cached response body and the route template it was served by.
+CachedResponse = namedtuple("CachedResponse", ["body", "route"])
+# Stands in for the matched route on a hit, so metrics keep the route label.
+CachedRoute = namedtuple("CachedRoute", ["path"])
+_Entry = namedtuple("_Entry", ["response", "expires_at", "tags"])
+
+
+class MemoryBackend:
+    """
+    An LRU of responses with a TTL, indexed by tag.
+
+    Args:
+        max_entries (int): Entries kept before the least recently used is evicted.
+        ttl (float): Seconds an entry may be served.
+    """
+
+    blocking = False
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._keys_by_tag = defaultdict(set)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.monotonic():
+                self._remove(key)
+                CACHE_EVICTIONS.labels("expired").inc()
+                return None
+            self._entries.move_to_end(key)
+            return entry.response
+
+    def set(self, key, response, tags, ttl=None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(response, time.monotonic() + ttl, tags)
+            for tag in tags:
+                self._keys_by_tag[tag].add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                CACHE_EVICTIONS.labels("capacity").inc()
+
+    def invalidate(self, tags):
+        """
+        Remove the entries carrying any of `tags`.
+
+        Returns:
+            int: The number of entries removed.
+        """
+        with self._lock:
+            keys = set()
+            for tag in tags:
+                keys.update(self._keys_by_tag.get(tag, ()))
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+            self._keys_by_tag.clear()
+            return count
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        for tag in entry.tags:
+            keys = self._keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_tag[tag]
+
+
+class RedisBackend:
+    """
+    Responses shared between API processes in Redis, with a set of keys per tag.
+
+    Every process listens for invalidations and deletes the same keys, which
+    is idempotent. Capacity is left to Redis' `maxmemory` policy.
+
+    Args:
+        url (str): The Redis URL.
+        ttl (float): Seconds an entry may be served.
+        prefix (str): Prefix of every key the cache writes.
+    """
+
+    blocking = True
+
+    def __init__(self, url, ttl, prefix="api-cache:"):
+        import redis
+
+        self.redis = redis.Redis.from_url(url)
+        self.ttl = max(1, int(ttl))
+        self.prefix = prefix
+
+    def _tag_key(self, tag):
+        return f"{self.prefix}tag:{tag}"
+
+    def get(self, key):
+        value = self.redis.get(self.prefix + key)
+        if value is None:
+            return None
+        route, _, body = value.partition(b"\n")
+        return CachedResponse(body, route.decode())
+
+    def set(self, key, response, tags, ttl=None):
+        name = self.prefix + key
+        ttl_ms = int(1000 * (self.ttl if ttl is None else min(ttl, self.ttl)))
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.set(name, response.route.encode() + b"\n" + response.body, px=max(1, ttl_ms))
+        for tag in tags:
+            pipe.sadd(self._tag_key(tag), name)
+            pipe.expire(self._tag_key(tag), self.ttl)
+        pipe.execute()
+
+    def invalidate(self, tags):
+        tag_keys = [self._tag_key(tag) for tag in tags]
+        pipe = self.redis.pipeline(transaction=False)
+        for tag_key in tag_keys:
+            pipe.smembers(tag_key)
+        names = set().union(*pipe.execute())
+        if not names:
+            return 0
+        removed = self.redis.delete(*names)
+        self.redis.delete(*tag_keys)
+        return removed
+
+    def clear(self):
+        count = 0
+        names = list(self.redis.scan_iter(match=self.prefix + "*", count=1000))
+        for start in range(0, len(names), 1000):
+            count += self.redis.delete(*names[start:start + 1000])
+        return count
+
+
+class ResponseCache:
+    """
+    Cache of serialized GET responses, invalidated by the consumer's change events.
+
+    Entries are only served while the invalidation listener is connected;
+    whenever it (re)connects the cache starts empty, since notifications
+    sent in between are lost.
+
+    Stores race with invalidations: a response read from the database
+    before a change committed may only be stored after the change's
+    notification arrived. `sequence()` is taken before the endpoint runs and
+    the store is dropped if any invalidation since then carried its tags.
+
+    Args:
+        backend (MemoryBackend | RedisBackend): Where entries are kept.
+        history (int): Invalidations remembered for that check.
+    """
+
+    def __init__(self, backend, history=1000):
+        self.backend = backend
+        self.listening = False
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._sequence = 0
+        self._recent = deque(maxlen=history)
+
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def sequence(self):
+        return self._sequence
+
+    def get(self, key):
+        return self.backend.get(key) if self.listening else None
+
+    def set(self, key, response, tags, since, ttl=None):
+        """
+        Store a response unless one of `tags` was invalidated after `since`.
+
+        `ttl` shortens the backend's TTL for this entry.
+        """
+        with self._lock:
+            if not self.listening:
+                return
+            if self._sequence != since:
+                if not self._recent or self._recent[0][0] > since + 1:
+                    return
+                if any(seq > since and (ALL in changed or not changed.isdisjoint(tags))
+                       for seq, changed in self._recent):
+                    return
+            self.backend.set(key, response, tags, ttl)
+
+    def invalidate(self, tags):
+        tags = frozenset(tags)
+        with self._lock:
+            self._sequence += 1
+            self._recent.append((self._sequence, tags))
+        if ALL in tags:
+            removed = self.backend.clear()
+        else:
+            removed = self.backend.invalidate(tags)
+        CACHE_EVICTIONS.labels("invalidated").inc(removed)
+
+    def set_listening(self, listening):
+        """
+        Enable or disable the cache, emptying it either way.
+        """
+        with self._lock:
+            self._sequence += 1
+            self._recent.append((self._sequence, frozenset([ALL])))
+            self.listening = listening
+        try:
+            CACHE_EVICTIONS.labels("reset").inc(self.backend.clear())
+        except Exception as e:
+            logger.warning(f"Could not clear the response cache: {e}")
+
+
+class InvalidationListener(threading.Thread):
+    """
+    LISTEN for the consumer's invalidations and apply them to a ResponseCache.
+
+    Args:
+        engine (Engine): The PostgreSQL engine the consumer writes to.
+        cache (ResponseCache): The cache to invalidate.
+        reconnect_s (float): Seconds to wait before reconnecting.
+        keepalive_s (float): Seconds without notifications before the
+            connection is checked.
+    """
+
+    def __init__(self, engine, cache, reconnect_s=5, keepalive_s=30):
+        super().__init__(name="cache-invalidation", daemon=True)
+        self.engine = engine
+        self.cache = cache
+        self.reconnect_s = reconnect_s
+        self.keepalive_s = keepalive_s
+
+    def run(self):
+        while True:
+            try:
+                self._listen()
+            except Exception as e:
+                logger.warning(f"Response cache invalidation listener disconnected: {e}")
+            self.cache.set_listening(False)
+            time.sleep(self.reconnect_s)
+
+    def _listen(self):
+        # A dedicated connection, taken out of the pool for good.
+        connection = self.engine.raw_connection()
+        conn = connection.driver_connection
+        connection.detach()
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANNEL}")
+            self.cache.set_listening(True)
+            logger.info(f"Listening for response cache invalidations on {CHANNEL}")
+            while True:
+                if select.select([conn], [], [], self.keepalive_s) == ([], [], []):
+                    with conn.cursor() as cursor:
+                        cursor.execute("SELECT 1")
+                    continue
+                conn.poll()
+                tags = set()
+                while conn.notifies:
+                    tags.update(json.loads(conn.notifies.pop(0).payload))
+                if tags:
+                    self.cache.invalidate(tags)
+        finally:
+            connection.close()
+
+
+def _nested_schema(annotation):
+    for arg in get_args(annotation) or (annotation,):
+        if isinstance(arg, type) and issubclass(arg, BaseModel):
+            return arg
+    return None
+
+
+def _collect_tags(obj, schema, tags):
+    state = inspect(obj)
+    mapper = state.mapper
+    key = mapper.primary_key_from_instance(obj)[0]
+    tag = row_tag(mapper.local_table.name, key)
+    if tag in tags:
+        return
+    tags.add(tag)
+    for relationship in mapper.relationships:
+        field = schema.model_fields.get(relationship.key)
+        if field is None:
+            continue
+        nested = _nested_schema(field.annotation)
+        value = getattr(obj, relationship.key)
+        if relationship.uselist:
+            # Rows added to the collection later only carry the foreign key.
+            for local, remote in relationship.local_remote_pairs:
+                local_value = getattr(obj, mapper.get_property_by_column(local).key)
+                tags.add(collection_tag(remote.table.name, remote.name, local_value))
+            for child in value:
+                _collect_tags(child, nested, tags)
+        elif value is not None:
+            _collect_tags(value, nested, tags)
+
+
+def response_tags(result, schema):
+    """
+    Return the tags of every row a response embeds, following the
+    relationships its response model serializes.
+
+    Args:
+        result (Base | List[Base]): The ORM object(s) the endpoint returns.
+        schema (Type[BaseModel]): The response model of one object.
+
+    Returns:
+        Set[str]: The tags.
+    """
+    tags = set()
+    for obj in result if isinstance(result, list) else [result]:
+        _collect_tags(obj, schema, tags)
+    return tags
+
+
+def cache_response(request: Request, result, schema, *tags):
+    """
+    Mark an endpoint's response as cacheable, tagged with the rows it embeds.
+
+    Args:
+        request (Request): The request being served.
+        result (Base | List[Base]): The ORM object(s) the endpoint returns.
+        schema (Type[BaseModel]): The response model of one object.
+        *tags (str): Further tags, e.g. `list_tag` for a list endpoint, or the
+            `collection_tag` of a list filtered by a foreign key.
+    """
+    if RESPONSE_CACHE:
+        request.state.cache_tags = response_tags(result, schema).union(tags)
+
+
+def _cache_key(request):
+    return request.url.path + "?" + urlencode(sorted(request.query_params.multi_items()))
+
+
+async def _call(backend, method, *args):
+    if backend.blocking:
+        return await run_in_threadpool(method, *args)
+    return method(*args)
+
+
+def _record(result):
+    if result == "hit":
+        response_cache.hits += 1
+    else:
+        response_cache.misses += 1
+    CACHE_REQUESTS.labels(result).inc()
+
+
+async def response_cache_middleware(request: Request, call_next):
+    """
+    Serve GET responses that endpoints marked with `cache_response` from the cache.
+
+    Requests with `X-Read-After` bypass it, as a cached response does not
+    say which writes it observed. Entries expire after the route's staleness
+    budget at most, so a stalled consumer cannot keep them served past it.
+    """
+    if request.method != "GET" or not response_cache.listening:
+        return await call_next(request)
+    if "x-read-after" in request.headers:
+        CACHE_REQUESTS.labels("bypass").inc()
+        return await call_next(request)
+
+    key = _cache_key(request)
+    backend = response_cache.backend
+    try:
+        cached = await _call(backend, response_cache.get, key)
+    except Exception as e:
+        logger.warning(f"Response cache lookup failed: {e}")
+        cached = None
+    if cached is not None:
+        _record("hit")
+        request.scope["route"] = CachedRoute(cached.route)
+        return Response(cached.body, media_type="application/json", headers={"X-Cache": "hit"})
+
+    since = response_cache.sequence()
+    response = await call_next(request)
+    tags = getattr(request.state, "cache_tags", None)
+    if tags is None or response.status_code != 200:
+        return response
+
+    _record("miss")
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    route = request.scope.get("route")
+    ttl = getattr(request.state, "max_staleness_s", None)
+    try:
+        await _call(backend, response_cache.set, key, CachedResponse(body, route.path), tags, since, ttl)
+    except Exception as e:
+        logger.warning(f"Response cache store failed: {e}")
+    headers = dict(response.headers)
+    headers["X-Cache"] = "miss"
+    return Response(body, status_code=response.status_code, headers=headers)
+
+
+def get_backend():
+    if CACHE_BACKEND == "redis":
+        return RedisBackend(CACHE_REDIS_URL, CACHE_TTL_S)
+    if CACHE_BACKEND == "memory":
+        return MemoryBackend(CACHE_MAX_ENTRIES, CACHE_TTL_S)
+    raise ValueError(f"Unknown CACHE_BACKEND: {CACHE_BACKEND}")
+
+
+response_cache = ResponseCache(get_backend() if RESPONSE_CACHE else MemoryBackend(0, 0))
+
+
+def setup_response_cache(app):
+    """
+    Add the response cache to a FastAPI app and start its invalidation listener.
+
+    Args:
+        app (FastAPI): The application.
+    """
+    if not RESPONSE_CACHE:
+        return
+    if isinstance(response_cache.backend, MemoryBackend):
+        CACHE_ENTRIES.set_function(lambda: len(response_cache.backend))
+    CACHE_HIT_RATIO.set_function(response_cache.hit_ratio)
+    app.middleware("http")(response_cache_middleware)
+    InvalidationListener(postgres_engine, response_cache, CACHE_RECONNECT_S).start()
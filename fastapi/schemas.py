@@ -1,5 +1,6 @@
 from pydantic import BaseModel
 from typing import List, Optional
+from models import OrderStatus
 
 class ProductCategoryBase(BaseModel):
     name: str
@@ -35,6 +36,9 @@ class OrderItemBase(BaseModel):
     quantity: int
     price: float
 
+class OrderItemCreate(OrderItemBase):
+    pass
+
 class OrderItem(OrderItemBase):
     id: int
     order_id: int
@@ -45,10 +49,13 @@ class OrderItem(OrderItemBase):
 
 class OrderBase(BaseModel):
     total_amount: float
-    status: str
+    status: OrderStatus = OrderStatus.PENDING
 
 class OrderCreate(OrderBase):
-    pass
+    order_items: List[OrderItemCreate] = []
+
+class OrderBulkCreate(OrderCreate):
+    user_id: int
 
 class Order(OrderBase):
     id: int
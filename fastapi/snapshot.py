@@ -0,0 +1,176 @@
+import io
+import json
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import text
+from bulk_apply import TABLE_ORDER, appliers, is_poison
+from consumer_metrics import CONVERT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_OPS = ('r',)
+
+
+def _copy_value(value):
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.isoformat()
+    if isinstance(value, timedelta):
+        return f"{value.total_seconds()} seconds"
+    if isinstance(value, bytes):
+        return "\\\\x" + value.hex()
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+class TableLoader:
+    """
+    COPY-based loading of Debezium snapshot rows into one table.
+
+    Rows are streamed with `COPY ... FROM STDIN` in PostgreSQL's text format.
+    Into an empty table they are copied directly; otherwise (a replayed or
+    restarted snapshot) they are copied into an index-free temporary staging
+    table and merged with a single `INSERT ... SELECT ... ON CONFLICT`.
+    """
+
+    def __init__(self, applier):
+        self.applier = applier
+        table = applier.table
+        self.columns = [c.name for c in table.columns]
+        pk = applier.pk.name
+        column_list = ", ".join(f'"{name}"' for name in self.columns)
+        staging = f"snapshot_{table.name}"
+
+        self.is_empty_sql = text(f'SELECT NOT EXISTS (SELECT 1 FROM "{table.name}")')
+        self.copy_sql = f'COPY "{table.name}" ({column_list}) FROM STDIN'
+        self.create_staging_sql = text(
+            f'CREATE TEMP TABLE IF NOT EXISTS "{staging}" '
+            f'(LIKE "{table.name}" INCLUDING DEFAULTS) ON COMMIT DELETE ROWS'
+        )
+        self.copy_staging_sql = f'COPY "{staging}" ({column_list}) FROM STDIN'
+        updates = ", ".join(f'"{name}" = EXCLUDED."{name}"' for name in self.columns if name != pk)
+        self.merge_sql = text(
+            f'INSERT INTO "{table.name}" ({column_list}) SELECT {column_list} FROM "{staging}" '
+            f'ON CONFLICT ("{pk}") DO UPDATE SET {updates}'
+        )
+
+    def _copy(self, db, sql, rows):
+        buffer = "".join(
+            "\t".join(_copy_value(row[name]) for name in self.columns) + "\n"
+            for row in rows
+        )
+        cursor = db.connection().connection.cursor()
+        try:
+            cursor.copy_expert(sql, io.StringIO(buffer))
+        finally:
+            cursor.close()
+
+    def load(self, db, events):
+        """
+        Write snapshot row images, last image per key winning.
+
+        Args:
+            db (Session): The PostgreSQL session.
+            events (List[ChangeEvent]): The `r` events, each converted
+                according to its schema version.
+
+        Returns:
+            int: The number of rows written.
+        """
+        latest = {}
+        for event in events:
+            latest[event.row[self.applier.pk.name]] = event
+        with CONVERT_SECONDS.time():
+            converter = self.applier.converter
+            converted = [converter(event.schema)(event.row) for event in latest.values()]
+        if db.execute(self.is_empty_sql).scalar():
+            self._copy(db, self.copy_sql, converted)
+        else:
+            db.execute(self.create_staging_sql)
+            self._copy(db, self.copy_staging_sql, converted)
+            db.execute(self.merge_sql)
+        return len(converted)
+
+
+loaders = {}
+
+
+def get_loader(table):
+    """
+    Return the TableLoader of a table, rebuilt whenever its applier is replaced.
+    """
+    applier = appliers.get(table)
+    if applier is None:
+        return None
+    loader = loaders.get(table)
+    if loader is None or loader.applier is not applier:
+        loader = loaders[table] = TableLoader(applier)
+    return loader
+
+
+def load_snapshot(db, events, skip_fk_checks=True):
+    """
+    Bulk-load snapshot (`r`) events with COPY.
+
+    A Debezium snapshot is a consistent copy of MySQL, but its tables arrive
+    on separate topics in no particular order. With `skip_fk_checks`, foreign
+    key triggers are disabled for the load (`session_replication_role =
+    replica`, which needs a superuser) and the constraints hold again once
+    every table is loaded. Without it, tables are loaded parent-first and a
+    batch whose parents have not arrived yet fails.
+
+    Any error caused by the rows themselves rolls the load back to a
+    savepoint and returns the events to the caller, to be applied as
+    ordinary upserts with deferral and dead-lettering.
+
+    Args:
+        db (Session): The PostgreSQL session, inside the batch's transaction.
+        events (List[ChangeEvent]): The snapshot events of the batch.
+        skip_fk_checks (bool): Disable foreign key triggers while copying.
+
+    Returns:
+        Tuple[List[ChangeEvent], List[ChangeEvent]]: The events loaded and
+            the events that could not be loaded.
+
+    Raises:
+        OperationalError, InterfaceError: If PostgreSQL is unavailable.
+    """
+    known = []
+    by_table = defaultdict(list)
+    for event in events:
+        if get_loader(event.table) is not None:
+            known.append(event)
+            by_table[event.table].append(event)
+        else:
+            logger.warning(f"No processor found for table: {event.table}")
+    if not by_table:
+        return [], []
+
+    try:
+        with db.begin_nested():
+            if skip_fk_checks:
+                db.execute(text("SET LOCAL session_replication_role = replica"))
+            for table in TABLE_ORDER:
+                if table in by_table:
+                    get_loader(table).load(db, by_table[table])
+            if skip_fk_checks:
+                db.execute(text("SET LOCAL session_replication_role = origin"))
+    except Exception as e:
+        if not is_poison(e):
+            raise
+        logger.warning(f"COPY of {len(events)} snapshot rows failed, applying them as upserts: {e}")
+        return [], known
+    return known, []
@@ -0,0 +1,222 @@
+import json
+import random
+import time
+from collections import defaultdict, namedtuple
+from sqlalchemy import Boolean, DateTime, Enum, Float, Integer
+from database import Base
+import models
+
+# The attributes of a kafka-python ConsumerRecord that the consumer reads.
+SyntheticMessage = namedtuple("SyntheticMessage", ["topic", "partition", "offset", "key", "value"])
+
+TOPIC_PREFIX = "mysql.fastapi_db"
+
+# Share of creates per table; children outnumber their parents as in the app.
+CREATE_WEIGHTS = {
+    "product_categories": 1,
+    "users": 15,
+    "products": 8,
+    "orders": 26,
+    "order_items": 50,
+}
+PARENTS = {
+    table.name: [(fk.parent.name, fk.column.table.name) for fk in table.foreign_keys]
+    for table in Base.metadata.sorted_tables
+}
+
+
+def _field_schema(column):
+    if isinstance(column.type, DateTime):
+        field = {"type": "int64", "name": "io.debezium.time.Timestamp", "version": 1}
+    elif isinstance(column.type, Boolean):
+        field = {"type": "boolean"}
+    elif isinstance(column.type, Float):
+        field = {"type": "double"}
+    elif isinstance(column.type, Integer):
+        field = {"type": "int32"}
+    else:
+        field = {"type": "string"}
+    field.update(optional=not column.primary_key, field=column.name)
+    return field
+
+
+def envelope_schema(table):
+    """
+    Build the `schema` block Debezium's JsonConverter embeds for a table.
+    """
+    row = {
+        "type": "struct",
+        "optional": True,
+        "name": f"{TOPIC_PREFIX}.{table.name}.Value",
+        "fields": [_field_schema(column) for column in table.columns],
+    }
+    source = {
+        "type": "struct",
+        "optional": False,
+        "name": "io.debezium.connector.mysql.Source",
+        "field": "source",
+        "fields": [
+            {"type": "string", "optional": False, "field": name}
+            for name in ("version", "connector", "name", "db", "table")
+        ] + [{"type": "int64", "optional": False, "field": "ts_ms"}],
+    }
+    return {
+        "type": "struct",
+        "optional": False,
+        "name": f"{TOPIC_PREFIX}.{table.name}.Envelope",
+        "fields": [
+            dict(row, field="before"),
+            dict(row, field="after"),
+            source,
+            {"type": "string", "optional": False, "field": "op"},
+            {"type": "int64", "optional": True, "field": "ts_ms"},
+        ],
+    }
+
+
+class EventGenerator:
+    """
+    Produce a stream of Debezium change messages for the five replicated tables.
+
+    Rows are created parent-first with foreign keys pointing at live parent
+    rows, updates change a non-key column of a live row, and deletes only
+    remove rows nothing references, so the stream is one MySQL could emit
+    and applies cleanly.
+
+    Args:
+        update_ratio (float): Share of events that are updates.
+        delete_ratio (float): Share of events that are deletes.
+        schemas (bool): Embed the `schema` block, as with `schemas.enable=true`.
+        seed (int, optional): Seed for repeatable streams.
+    """
+
+    def __init__(self, update_ratio=0.2, delete_ratio=0.05, schemas=True, seed=None):
+        self.update_ratio = update_ratio
+        self.delete_ratio = delete_ratio
+        self.rng = random.Random(seed)
+        self.tables = {table.name: table for table in Base.metadata.sorted_tables}
+        self.schemas = {name: envelope_schema(table) for name, table in self.tables.items()} if schemas else None
+        # Columns an update may change: not keys, and not unique names.
+        self.updatable = {
+            name: [
+                c for c in table.columns
+                if not c.primary_key and not c.foreign_keys and c.name not in ("email", "name")
+            ]
+            for name, table in self.tables.items()
+        }
+        self.rows = {name: {} for name in self.tables}
+        self.live = {name: [] for name in self.tables}
+        self.references = defaultdict(int)
+        self.next_id = defaultdict(int)
+        self.offsets = defaultdict(int)
+        self.clock_ms = int(time.time() * 1000)
+
+    def _value(self, column, row_id):
+        if column.name in ("email", "name"):
+            return f"{column.table.name}-{row_id}"
+        if column.nullable and column.name == "last_login" and self.rng.random() < 0.5:
+            return None
+        if isinstance(column.type, DateTime):
+            return self.clock_ms - self.rng.randint(0, 86_400_000)
+        if isinstance(column.type, Boolean):
+            return self.rng.random() < 0.9
+        if isinstance(column.type, Float):
+            return round(self.rng.uniform(1, 500), 2)
+        if isinstance(column.type, Enum):
+            return self.rng.choice(list(models.OrderStatus)).name
+        if isinstance(column.type, Integer):
+            return self.rng.randint(1, 5)
+        return f"{column.name} {row_id} " + "x" * self.rng.randint(10, 120)
+
+    def _create(self):
+        tables = [name for name in CREATE_WEIGHTS if all(self.live[p] for _, p in PARENTS[name])]
+        name = self.rng.choices(tables, [CREATE_WEIGHTS[t] for t in tables])[0]
+        self.next_id[name] += 1
+        row_id = self.next_id[name]
+        row = {}
+        for column in self.tables[name].columns:
+            row[column.name] = row_id if column.primary_key else self._value(column, row_id)
+        for column, parent in PARENTS[name]:
+            row[column] = self.rng.choice(self.live[parent])
+            self.references[(parent, row[column])] += 1
+        self.rows[name][row_id] = row
+        self.live[name].append(row_id)
+        return name, "c", None, row
+
+    def _update(self):
+        tables = [name for name in self.tables if self.live[name] and self.updatable[name]]
+        if not tables:
+            return None
+        name = self.rng.choice(tables)
+        before = self.rows[name][self.rng.choice(self.live[name])]
+        after = dict(before)
+        column = self.rng.choice(self.updatable[name])
+        after[column.name] = self._value(column, after["id"])
+        self.rows[name][after["id"]] = after
+        return name, "u", before, after
+
+    def _delete(self):
+        for _ in range(10):
+            name = self.rng.choices(list(CREATE_WEIGHTS), list(CREATE_WEIGHTS.values()))[0]
+            if not self.live[name]:
+                continue
+            index = self.rng.randrange(len(self.live[name]))
+            row_id = self.live[name][index]
+            if self.references[(name, row_id)]:
+                continue
+            self.live[name][index] = self.live[name][-1]
+            self.live[name].pop()
+            before = self.rows[name].pop(row_id)
+            for column, parent in PARENTS[name]:
+                self.references[(parent, before[column])] -= 1
+            return name, "d", before, None
+        return None
+
+    def _message(self, table, op, before, after):
+        self.clock_ms += self.rng.randint(0, 3)
+        payload = {
+            "before": before,
+            "after": after,
+            "source": {
+                "version": "1.9.7.Final",
+                "connector": "mysql",
+                "name": "mysql",
+                "db": "fastapi_db",
+                "table": table,
+                "ts_ms": self.clock_ms,
+            },
+            "op": op,
+            "ts_ms": self.clock_ms + 5,
+        }
+        value = {"schema": self.schemas[table], "payload": payload} if self.schemas else payload
+        topic = f"{TOPIC_PREFIX}.{table}"
+        offset = self.offsets[topic]
+        self.offsets[topic] += 1
+        key = json.dumps({"id": (after or before)["id"]}).encode()
+        return SyntheticMessage(topic, 0, offset, key, json.dumps(value).encode())
+
+    def next_message(self):
+        """
+        Return the next change message.
+
+        Returns:
+            SyntheticMessage: A message with a JSON-encoded Debezium envelope.
+        """
+        roll = self.rng.random()
+        event = None
+        if roll < self.delete_ratio:
+            event = self._delete()
+        elif roll < self.delete_ratio + self.update_ratio:
+            event = self._update()
+        if event is None:
+            event = self._create()
+        return self._message(*event)
+
+    def messages(self, count):
+        """
+        Generate `count` messages.
+
+        Returns:
+            List[SyntheticMessage]: The messages, in the order MySQL would emit them.
+        """
+        return [self.next_message() for _ in range(count)]
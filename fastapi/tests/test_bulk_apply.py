@@ -0,0 +1,108 @@
+import contextlib
+import pytest
+from sqlalchemy.exc import IntegrityError, OperationalError
+import bulk_apply
+from bulk_apply import ChangeEvent, apply_isolated, order_events
+
+
+def event(table, op, row_id, **row):
+    return ChangeEvent(table, op, {"id": row_id, **row})
+
+
+def keys(events):
+    return [(e.table, e.op, e.row["id"]) for e in events]
+
+
+def test_upserts_are_applied_parent_first():
+    events = order_events([
+        event("order_items", "c", 1, order_id=1, product_id=1),
+        event("orders", "c", 1, user_id=1),
+        event("products", "c", 1, category_id=1),
+        event("users", "c", 1),
+        event("product_categories", "c", 1),
+    ])
+    order = [e.table for e in events]
+    assert order.index("users") < order.index("orders") < order.index("order_items")
+    assert order.index("product_categories") < order.index("products") < order.index("order_items")
+
+
+def test_deletes_are_applied_child_first_after_upserts():
+    events = order_events([
+        event("users", "d", 1),
+        event("orders", "d", 1, user_id=1),
+        event("users", "c", 2),
+    ])
+    assert keys(events) == [("users", "c", 2), ("orders", "d", 1), ("users", "d", 1)]
+
+
+def test_changes_to_the_same_row_keep_their_order():
+    events = order_events([
+        event("orders", "c", 1, user_id=1),
+        event("orders", "d", 1, user_id=1),
+        event("users", "c", 1),
+        event("orders", "c", 1, user_id=1),
+    ])
+    # Distinct rows between two changes to the same row may still be reordered.
+    assert keys(events) == [
+        ("orders", "c", 1),
+        ("users", "c", 1),
+        ("orders", "d", 1),
+        ("orders", "c", 1),
+    ]
+
+
+def test_unknown_tables_and_operations_are_dropped():
+    events = order_events([
+        event("audit_log", "c", 1),
+        event("users", "t", 1),
+        event("users", "r", 2),
+    ])
+    assert keys(events) == [("users", "r", 2)]
+
+
+class FakeSession:
+    """
+    Count savepoints, and collect the events the patched `apply_ordered` writes.
+    """
+
+    def __init__(self):
+        self.committed = []
+        self.attempts = 0
+
+    @contextlib.contextmanager
+    def begin_nested(self):
+        self.attempts += 1
+        yield
+
+
+def fail_on(poison_ids, error_type=IntegrityError):
+    def apply_ordered(db, events):
+        if any(e.row["id"] in poison_ids for e in events):
+            raise error_type("INSERT", {}, Exception("rejected"))
+        db.committed.extend(events)
+        return len(events)
+    return apply_ordered
+
+
+def test_bisection_isolates_poison_events(monkeypatch):
+    monkeypatch.setattr(bulk_apply, "apply_ordered", fail_on({3, 6}))
+    db = FakeSession()
+    events = [event("users", "c", i) for i in range(8)]
+    applied, failed = apply_isolated(db, events)
+    assert applied == 6
+    assert [e.row["id"] for e, _ in failed] == [3, 6]
+    assert all(isinstance(error, IntegrityError) for _, error in failed)
+    assert sorted(e.row["id"] for e in db.committed) == [0, 1, 2, 4, 5, 7]
+
+
+def test_a_clean_batch_is_applied_in_one_savepoint(monkeypatch):
+    monkeypatch.setattr(bulk_apply, "apply_ordered", fail_on(set()))
+    db = FakeSession()
+    assert apply_isolated(db, [event("users", "c", i) for i in range(8)]) == (8, [])
+    assert db.attempts == 1
+
+
+def test_infrastructure_errors_are_raised_not_isolated(monkeypatch):
+    monkeypatch.setattr(bulk_apply, "apply_ordered", fail_on({3}, OperationalError))
+    with pytest.raises(OperationalError):
+        apply_isolated(FakeSession(), [event("users", "c", i) for i in range(8)])
@@ -0,0 +1,55 @@
+from bulk_apply import ChangeEvent
+from coalesce import coalesce_events
+
+
+def event(op, row_id, table="users", offset=0, **row):
+    return ChangeEvent(table, op, {"id": row_id, **row}, position=("t", 0, offset))
+
+
+def test_last_upsert_wins():
+    events, collapsed = coalesce_events([
+        event("u", 1, username="a", offset=0),
+        event("u", 1, username="b", offset=1),
+    ])
+    assert collapsed == 1
+    assert [(e.op, e.row["username"], e.position[2]) for e in events] == [("u", "b", 1)]
+
+
+def test_update_of_created_row_stays_a_create():
+    events, _ = coalesce_events([event("c", 1, username="a"), event("u", 1, username="b")])
+    assert [(e.op, e.row["username"]) for e in events] == [("c", "b")]
+
+
+def test_delete_wins_and_is_kept_for_rows_created_in_the_window():
+    events, collapsed = coalesce_events([event("c", 1), event("u", 1), event("d", 1)])
+    assert collapsed == 2
+    assert [e.op for e in events] == ["d"]
+
+
+def test_rows_and_tables_are_kept_apart():
+    events, collapsed = coalesce_events([
+        event("u", 1, offset=0),
+        event("u", 1, table="orders", offset=1),
+        event("u", 2, offset=2),
+    ])
+    assert collapsed == 0
+    assert [(e.table, e.row["id"]) for e in events] == [("users", 1), ("orders", 1), ("users", 2)]
+
+
+def test_surviving_event_moves_to_its_last_position():
+    events, _ = coalesce_events([
+        event("u", 1, offset=0),
+        event("u", 2, offset=1),
+        event("u", 1, offset=2),
+    ])
+    assert [e.row["id"] for e in events] == [2, 1]
+
+
+def test_unknown_tables_and_rowless_events_are_kept():
+    events, collapsed = coalesce_events([
+        ChangeEvent("audit_log", "u", {"id": 1}),
+        ChangeEvent("audit_log", "u", {"id": 1}),
+        ChangeEvent("users", "d", None),
+    ])
+    assert collapsed == 0
+    assert len(events) == 3
@@ -0,0 +1,31 @@
+from datetime import datetime, timezone
+from compare_databases import _value_normalizer
+from models import Order, OrderStatus, Product, User
+
+
+def normalize(column, value):
+    return _value_normalizer(column)(value)
+
+
+def test_floats_match_across_single_and_double_precision():
+    price = Product.__table__.c.price
+    # MySQL FLOAT is single precision.
+    assert normalize(price, 19.989999771118164) == normalize(price, 19.99)
+
+
+def test_datetimes_are_compared_to_the_second_without_time_zone():
+    created_at = User.__table__.c.created_at
+    assert normalize(created_at, datetime(2024, 1, 1, 12, 0, 0, 999999)) == normalize(
+        created_at, datetime(2024, 1, 1, 12, 0, 0, tzinfo=timezone.utc)
+    )
+
+
+def test_booleans_and_enums_become_plain_values():
+    assert normalize(User.__table__.c.is_active, 1) is True
+    assert normalize(Order.__table__.c.status, OrderStatus.SHIPPED) == "SHIPPED"
+    assert normalize(Order.__table__.c.status, "SHIPPED") == "SHIPPED"
+
+
+def test_nulls_stay_null():
+    for column in (Product.__table__.c.price, User.__table__.c.last_login, User.__table__.c.is_active):
+        assert normalize(column, None) is None
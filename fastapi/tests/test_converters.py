@@ -0,0 +1,60 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+from sqlalchemy import Column, Integer, MetaData, Numeric, Table
+from converters import compile_row_converter, make_row_converter, schema_row_converter
+from models import User
+
+
+def test_compiled_converter_converts_non_null_values_only():
+    convert = compile_row_converter([("id", None), ("price", float), ("note", str)])
+    assert convert({"id": 1, "price": 2, "note": None}) == {"id": 1, "price": 2.0, "note": None}
+    assert convert({"id": 1}) == {"id": 1, "price": None, "note": None}
+
+
+def test_compiled_converter_quotes_column_names():
+    convert = compile_row_converter([("it's", None), ("order", int)])
+    assert convert({"it's": "x", "order": "3"}) == {"it's": "x", "order": 3}
+
+
+def test_schemaless_rows_yield_every_column():
+    convert = make_row_converter(User.__table__)
+    row = convert({"id": 1, "email": "a@x", "is_active": 1, "created_at": 1_500, "unknown": "dropped"})
+    assert set(row) == {column.name for column in User.__table__.columns}
+    assert row["is_active"] is True
+    assert row["created_at"] == datetime(1970, 1, 1, 0, 0, 1, 500000, tzinfo=timezone.utc)
+    assert row["last_login"] is None
+    assert "unknown" not in row
+
+
+def test_schema_converter_decodes_logical_types():
+    fields = [
+        {"field": "id", "type": "int32"},
+        {"field": "is_active", "type": "int16"},
+        {"field": "created_at", "type": "string", "name": "io.debezium.time.ZonedTimestamp"},
+        {"field": "last_login", "type": "int64", "name": "io.debezium.time.MicroTimestamp"},
+    ]
+    convert = schema_row_converter(User.__table__, fields)
+    row = convert({
+        "id": 1, "is_active": 0, "created_at": "2024-01-01T00:00:00.12Z", "last_login": 1_500_000,
+    })
+    assert row["is_active"] is False
+    assert row["created_at"] == datetime(2024, 1, 1, 0, 0, 0, 120000, tzinfo=timezone.utc)
+    assert row["last_login"] == datetime(1970, 1, 1, 0, 0, 1, 500000)
+    # A column the schema version lacks is written as null.
+    assert row["email"] is None
+
+
+def test_schema_converter_decodes_decimals():
+    table = Table(
+        "prices", MetaData(), Column("id", Integer, primary_key=True), Column("price", Numeric(10, 2))
+    )
+    fields = [
+        {"field": "id", "type": "int32"},
+        {
+            "field": "price", "type": "bytes", "name": "org.apache.kafka.connect.data.Decimal",
+            "parameters": {"scale": "2", "connect.decimal.precision": "10"},
+        },
+    ]
+    # 12345 unscaled, big-endian two's complement, base64-encoded.
+    convert = schema_row_converter(table, fields)
+    assert convert({"id": 1, "price": "MDk="}) == {"id": 1, "price": Decimal("123.45")}
@@ -0,0 +1,141 @@
+import time
+import pytest
+from kafka import TopicPartition
+import deferred
+from bulk_apply import ChangeEvent
+from deferred import DeferredBuffer
+
+
+@pytest.fixture
+def parents(monkeypatch):
+    """
+    The parent rows PostgreSQL already has, as (table, id) pairs.
+    """
+    existing = set()
+    monkeypatch.setattr(
+        deferred, "existing_keys",
+        lambda db, table, ids: {i for i in ids if (table, i) in existing},
+    )
+    return existing
+
+
+def order(order_id, user_id, offset):
+    return ChangeEvent(
+        "orders", "c", {"id": order_id, "user_id": user_id}, position=("t.orders", 0, offset)
+    )
+
+
+def user(user_id, offset=0):
+    return ChangeEvent("users", "c", {"id": user_id}, position=("t.users", 0, offset))
+
+
+def test_orphan_waits_until_its_parent_arrives(parents):
+    buffer = DeferredBuffer(recheck_interval=3600)
+    assert buffer.resolve(None, [order(1, 10, offset=5)]) == []
+    assert len(buffer) == 1
+    assert buffer.held_offsets() == {("t.orders", 0): 5}
+    buffer.commit()
+
+    events = buffer.resolve(None, [user(10)])
+    assert [(e.table, e.row["id"]) for e in events] == [("orders", 1), ("users", 10)]
+    assert len(buffer) == 0
+    assert buffer.held_offsets() == {}
+
+
+def test_parent_in_the_batch_or_in_postgres_does_not_defer(parents):
+    parents.add(("users", 11))
+    buffer = DeferredBuffer(recheck_interval=3600)
+    events = buffer.resolve(None, [user(10), order(1, 10, offset=1), order(2, 11, offset=2)])
+    assert len(events) == 3
+    assert len(buffer) == 0
+
+
+def test_newer_event_supersedes_a_waiting_row(parents):
+    parents.add(("users", 11))
+    buffer = DeferredBuffer(recheck_interval=3600)
+    buffer.resolve(None, [order(1, 10, offset=1)])
+    events = buffer.resolve(None, [order(1, 11, offset=2)])
+    assert [e.row["user_id"] for e in events] == [11]
+    assert len(buffer) == 0
+
+
+def test_recheck_releases_rows_whose_parent_was_written_elsewhere(parents):
+    buffer = DeferredBuffer(recheck_interval=0)
+    buffer.resolve(None, [order(1, 10, offset=1)])
+    parents.add(("users", 10))
+    assert buffer.due()
+    assert [e.row["id"] for e in buffer.resolve(None, [])] == [1]
+
+
+def test_rollback_parks_released_rows_again(parents):
+    buffer = DeferredBuffer(recheck_interval=3600)
+    buffer.resolve(None, [order(1, 10, offset=5)])
+    buffer.commit()
+    buffer.resolve(None, [user(10)])
+    buffer.rollback()
+    assert len(buffer) == 1
+    assert buffer.held_offsets() == {("t.orders", 0): 5}
+
+
+def test_expired_rows_are_dropped_once_their_batch_commits(parents):
+    buffer = DeferredBuffer(max_age=0, recheck_interval=3600)
+    buffer.resolve(None, [order(1, 10, offset=5)])
+    buffer.commit()
+    time.sleep(0.01)
+
+    buffer.resolve(None, [])
+    assert [e.row["id"] for e, _ in buffer.take_dropped()] == [1]
+    buffer.rollback()
+    assert len(buffer) == 1
+    assert buffer.dropped == 0
+    assert buffer.held_offsets() == {("t.orders", 0): 5}
+
+    buffer.resolve(None, [])
+    dropped = buffer.take_dropped()
+    buffer.commit()
+    assert [reason for _, reason in dropped] == ["parent not seen within 0s (waiting for users 10)"]
+    assert len(buffer) == 0
+    assert buffer.dropped == 1
+
+
+def test_full_buffer_evicts_the_oldest_row(parents):
+    buffer = DeferredBuffer(max_size=2, recheck_interval=3600)
+    buffer.resolve(None, [order(1, 10, offset=1), order(2, 10, offset=2), order(3, 10, offset=3)])
+    assert [e.row["id"] for e, _ in buffer.take_dropped()] == [1]
+    assert buffer.held_offsets() == {("t.orders", 0): 2}
+
+
+def test_parent_delete_waits_for_its_children(parents):
+    buffer = DeferredBuffer(recheck_interval=3600)
+    delete = ChangeEvent("users", "d", {"id": 10}, position=("t.users", 0, 7))
+    buffer.defer_delete(delete)
+    assert buffer.held_offsets() == {("t.users", 0): 7}
+
+    # A batch that only touches unrelated tables leaves it waiting.
+    assert buffer.resolve(None, [ChangeEvent("product_categories", "c", {"id": 1})]) == [
+        ChangeEvent("product_categories", "c", {"id": 1})
+    ]
+    assert len(buffer) == 1
+
+    child_delete = ChangeEvent("orders", "d", {"id": 1, "user_id": 10}, position=("t.orders", 0, 3))
+    assert buffer.resolve(None, [child_delete]) == [delete, child_delete]
+    assert len(buffer) == 0
+
+
+def test_retried_parent_delete_keeps_its_deferral_time(parents):
+    buffer = DeferredBuffer(max_age=3600, recheck_interval=0)
+    delete = ChangeEvent("users", "d", {"id": 10}, position=("t.users", 0, 7))
+    buffer.defer_delete(delete)
+    time.sleep(0.05)
+
+    assert buffer.resolve(None, []) == [delete]
+    buffer.defer_delete(delete)
+    assert buffer.stats()["oldest_age_seconds"] >= 0.05
+
+
+def test_forget_drops_rows_from_revoked_partitions(parents):
+    buffer = DeferredBuffer(recheck_interval=3600)
+    moved = ChangeEvent("orders", "c", {"id": 2, "user_id": 10}, position=("t.orders", 1, 9))
+    buffer.resolve(None, [order(1, 10, offset=5), moved])
+    buffer.forget({TopicPartition("t.orders", 1)})
+    assert buffer.held_offsets() == {("t.orders", 0): 5}
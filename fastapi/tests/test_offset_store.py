@@ -0,0 +1,33 @@
+from collections import namedtuple
+from kafka import TopicPartition
+from offset_store import OffsetLedger
+
+Message = namedtuple("Message", "topic partition offset")
+
+
+def test_stored_offset_is_one_past_the_last_message_and_held_back():
+    ledger = OffsetLedger()
+    batch = [Message("t", 0, 4), Message("t", 0, 5), Message("u", 0, 1)]
+    offsets = ledger.pending(batch, held={("t", 0): 5})
+    assert offsets == {("t", 0): 5, ("u", 0): 2}
+    ledger.committed(offsets)
+
+    # Nothing new and nothing released: nothing to store.
+    assert ledger.pending([], held={("t", 0): 5}) == {}
+    # The held row was written: the partition moves on without new messages.
+    assert ledger.pending([], held={}) == {("t", 0): 6}
+
+
+def test_unsent_offsets_are_taken_once():
+    ledger = OffsetLedger()
+    ledger.committed(ledger.pending([Message("t", 0, 4)]))
+    assert {tp: meta.offset for tp, meta in ledger.take_unsent().items()} == {TopicPartition("t", 0): 5}
+    assert ledger.take_unsent() == {}
+
+
+def test_forget_drops_revoked_partitions():
+    ledger = OffsetLedger()
+    ledger.committed(ledger.pending([Message("t", 0, 4), Message("t", 1, 2)]))
+    ledger.forget({TopicPartition("t", 1)})
+    assert list(ledger.take_unsent()) == [TopicPartition("t", 0)]
+    assert ledger.pending([Message("t", 1, 0)]) == {("t", 1): 1}
@@ -0,0 +1,71 @@
+from collections import namedtuple
+from kafka import TopicPartition
+from parallel_apply import OffsetTracker, route
+
+Message = namedtuple("Message", "topic partition offset key")
+
+
+def messages(offsets, topic="t", partition=0):
+    return [Message(topic, partition, offset, str(offset).encode()) for offset in offsets]
+
+
+def committed(offsets):
+    return {(tp.topic, tp.partition): meta.offset for tp, meta in offsets.items()}
+
+
+def test_route_keeps_a_row_on_one_worker():
+    first = Message("t", 0, 1, b'{"id": 7}')
+    again = Message("t", 3, 9, b'{"id": 7}')
+    assert route(first, 4) == route(again, 4)
+    assert 0 <= route(Message("t", 0, 1, None), 4) < 4
+
+
+def test_commit_point_is_the_lowest_offset_in_flight():
+    tracker = OffsetTracker()
+    tracker.dispatched(messages(range(10)))
+    assert committed(tracker.committable()) == {("t", 0): 0}
+
+    tracker.finished(messages(range(5, 10)), "w1")
+    assert tracker.committable() == {}
+    tracker.finished(messages(range(0, 5)), "w0")
+    assert committed(tracker.committable()) == {("t", 0): 10}
+    assert tracker.idle()
+
+
+def test_commit_point_never_passes_a_held_row():
+    tracker = OffsetTracker()
+    tracker.dispatched(messages(range(10)))
+    tracker.finished(messages(range(10)), "w0", {("t", 0): 4})
+    assert committed(tracker.committable()) == {("t", 0): 4}
+    assert not tracker.idle()
+
+    tracker.finished([], "w0", {})
+    assert committed(tracker.committable()) == {("t", 0): 10}
+
+
+def test_partitions_are_tracked_apart():
+    tracker = OffsetTracker()
+    tracker.dispatched(messages(range(3)) + messages(range(3), partition=1))
+    tracker.finished(messages(range(3), partition=1), "w0")
+    assert committed(tracker.committable()) == {("t", 0): 0, ("t", 1): 3}
+
+
+def test_in_flight_leaves_out_the_workers_own_batch_and_rows():
+    tracker = OffsetTracker()
+    first, second = messages(range(0, 5)), messages(range(5, 10))
+    tracker.dispatched(first + second)
+    assert tracker.in_flight(second, "w1") == {("t", 0): 0}
+    assert tracker.in_flight(first, "w0") == {("t", 0): 5}
+
+    tracker.finished(first, "w0", {("t", 0): 2})
+    assert tracker.in_flight(second, "w1") == {("t", 0): 2}
+    assert tracker.in_flight(second, "w0") == {}
+
+
+def test_forget_drops_revoked_partitions():
+    tracker = OffsetTracker()
+    tracker.dispatched(messages(range(3)) + messages(range(3), partition=1))
+    tracker.finished(messages(range(3)), "w0", {("t", 0): 1, ("t", 1): 0})
+    tracker.forget({TopicPartition("t", 1)})
+    assert committed(tracker.committable()) == {("t", 0): 1}
+    assert tracker.in_flight([], "w1") == {("t", 0): 1}